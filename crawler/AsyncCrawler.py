@@ -0,0 +1,163 @@
+"""
+A crawler that fetches with asyncio instead of threads.
+
+It shares everything but the fetching with Crawler: the directory layout, the queue, the bloom filters,
+the FileSet, saving, snapshots and the handling of a fetched page (Crawler.process_page).
+
+Details:
+- one aiohttp session per epoch, whose connector keeps alive and pools up to connections_per_host
+  connections per host, and up to max_in_flight connections in total.
+- a dispatcher coroutine takes urls from the frontier, which hands out a url only when its host is ready
+  (see Frontier.HostFrontier, shared with the threaded crawler), and starts a fetch for each of them.
+  a slow host does not hold back the others.
+- fetched pages are handed to Crawler.process_page in the default thread pool, so that parsing
+  does not block the event loop.
+- at the end of an epoch, in-flight fetches get request_timeout_s to finish,
+  and the ones that don't are cancelled and go back to the queue.
+- with conditional_get, the fetches send the validators of the HttpCache and skip the pages not modified,
+  as in Crawler.fetch.
+"""
+import asyncio
+import queue
+from typing import Optional
+
+import aiohttp
+import loguru
+
+import Crawler
+import Frontier
+import request_utils
+
+logger = loguru.logger
+
+
+class AsyncCrawler(Crawler.Crawler):
+
+    def __init__(self,
+                 *args,
+                 max_in_flight: int = 256,
+                 connections_per_host: int = 8,
+                 request_timeout_s: float = 5.0,
+                 state_dict: Optional[dict] = None,
+                 **kwargs,
+                 ):
+        """
+        See Crawler.Crawler for the other parameters.
+        :param max_in_flight: the maximum number of requests in flight.
+        :param connections_per_host: the maximum number of connections to a single host.
+        :param request_timeout_s:
+        """
+        super().__init__(*args, state_dict=state_dict, **kwargs)
+
+        if state_dict is None:
+            self.max_in_flight = max_in_flight
+            self.connections_per_host = connections_per_host
+            self.request_timeout_s = request_timeout_s
+        else:
+            self.max_in_flight = state_dict.get("max_in_flight", max_in_flight)
+            self.connections_per_host = state_dict.get("connections_per_host", connections_per_host)
+            self.request_timeout_s = state_dict.get("request_timeout_s", request_timeout_s)
+
+    def as_state_dict(self,
+                      ):
+        state_dict = super().as_state_dict()
+        state_dict.update({
+            "max_in_flight": self.max_in_flight,
+            "connections_per_host": self.connections_per_host,
+            "request_timeout_s": self.request_timeout_s,
+        })
+        return state_dict
+
+    def crawl_epoch(self,
+                    epoch: int,
+                    secs: int,
+                    ):
+        self.configure_frontier()
+        logger.info(f"Starting epoch {epoch}")
+        asyncio.run(self._crawl(secs))
+        logger.info(f"MainThread : All fetches stopped.")
+
+    async def _crawl(self, secs):
+        loop = asyncio.get_running_loop()
+        start_time = loop.time()
+        last_tick = start_time
+        in_flight = set()
+
+        connector = aiohttp.TCPConnector(limit=self.max_in_flight, limit_per_host=self.connections_per_host)
+        timeout = aiohttp.ClientTimeout(total=self.request_timeout_s)
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout,
+                                         headers={"User-Agent": self.user_agent}) as session:
+            while loop.time() - start_time < secs:
+                now = loop.time()
+                if now - last_tick > 5:
+                    last_tick = now
+                    logger.info(f"MainThread : {now - start_time:.3f} seconds passed. "
+                                f"Queue length ~ {self.queue.qsize()}, {len(in_flight)} in flight.")
+
+                # start a fetch for every url whose host is ready.
+                while len(in_flight) < self.max_in_flight:
+                    try:
+                        cur_item = self.queue.get_item_nowait(accept=lambda url: self.should_crawl(url, "dispatcher"))
+                    except queue.Empty:
+                        break
+                    task = asyncio.create_task(self._fetch_and_process(session, cur_item))
+                    in_flight.add(task)
+                    task.add_done_callback(in_flight.discard)
+
+                delay = 0.05
+                wait_s = self.queue.time_until_ready()
+                if wait_s is not None and len(in_flight) < self.max_in_flight:
+                    delay = min(delay, wait_s)
+                await asyncio.sleep(delay)
+
+            logger.info(f"MainThread : waiting for {len(in_flight)} fetches.")
+            if in_flight:
+                _, pending = await asyncio.wait(set(in_flight), timeout=self.request_timeout_s)
+                for task in pending:
+                    task.cancel()
+                await asyncio.gather(*pending, return_exceptions=True)
+
+    async def _fetch_and_process(self, session: aiohttp.ClientSession, cur_item: Frontier.FrontierItem):
+        cur_url = cur_item.url
+        try:
+            result = await self._fetch(session, cur_url)
+            if result is not None:
+                await asyncio.get_running_loop().run_in_executor(None, self.process_page, cur_url, result.content,
+                                                                 "async", cur_item.depth)
+                if self.http_cache is not None:
+                    # only once processed, see Crawler.crawl_item.
+                    self.http_cache.update(cur_url, result.content, result.etag, result.last_modified)
+        except asyncio.CancelledError:
+            self.requeue(cur_item)
+            raise
+        finally:
+            # the url stays in flight until its page is processed, so that a snapshot taken meanwhile keeps it.
+            self.queue.task_done(cur_url)
+
+    async def _fetch(self, session: aiohttp.ClientSession, url: str) -> Optional[request_utils.FetchResult]:
+        """
+        Fetch a page, conditionally with conditional_get, like Crawler.fetch.
+        :return: None if the fetch failed or the page has not changed since it was processed.
+        """
+        headers = self.http_cache.validators(url) if self.http_cache is not None else None
+        try:
+            async with session.get(url, headers=headers) as response:
+                etag, last_modified = response.headers.get("ETag"), response.headers.get("Last-Modified")
+                if response.status == 304:
+                    result = request_utils.FetchResult(url, 304, None, etag, last_modified)
+                elif response.status != 200:
+                    logger.error(f"HTTPError: {response.status} with url {url}")
+                    return None
+                else:
+                    content = await response.read()
+                    # aiohttp decodes the body. the length sent is only known from Content-Length.
+                    wire_bytes = int(response.headers.get("Content-Length", len(content)))
+                    result = request_utils.FetchResult(url, 200, content, etag, last_modified,
+                                                       wire_bytes, len(content))
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            logger.error(f"Exception: {e!r} with url {url}")
+            return None
+        self.record_transfer(result)
+        if self.http_cache is not None and not self.is_modified(result, "async"):
+            return None
+        return result
@@ -1,3 +1,4 @@
+import hashlib
 import json
 
 import numpy as np
@@ -6,6 +7,9 @@ import os.path as osp
 import os
 
 import threading
+from typing import List, Optional
+
+import utils
 
 
 class BKDRHashGenerator:
@@ -34,58 +38,235 @@ class BKDRHashGenerator:
         return self
 
 
+class HashStrategy:
+    """
+    Maps a key to the hash_num bit positions it occupies in a BloomFilter of the given size.
+
+    The name of the strategy is persisted with the BloomFilter, see hash_strategy_recipe.
+    """
+    name: str
+
+    def __init__(self, hash_num):
+        self.hash_num = hash_num
+
+    def positions(self, key, size):
+        """
+        :return: int64 array of shape (hash_num,)
+        """
+        raise NotImplementedError
+
+    def positions_many(self, keys, size):
+        """
+        :return: int64 array of shape (len(keys), hash_num)
+        """
+        ret = np.empty((len(keys), self.hash_num), dtype=np.int64)
+        for i, key in enumerate(keys):
+            ret[i] = self.positions(key, size)
+        return ret
+
+
+class BKDRHashStrategy(HashStrategy):
+    """
+    The legacy scheme: hash_num BKDR hashes with the seeds of BKDRHashGenerator.
+
+    Gives exactly the positions of BKDRHashGenerator, but reduces modulo size at every step
+    instead of letting the hash grow into a huge integer.
+    """
+    name = "bkdr"
+
+    def __init__(self, hash_num):
+        super().__init__(hash_num)
+        self.seeds = [hash_func.__defaults__[0] for hash_func in BKDRHashGenerator(hash_num)]
+
+    def positions(self, key, size):
+        codes = [ord(ch) for ch in key]
+        ret = np.empty(self.hash_num, dtype=np.int64)
+        for i, seed in enumerate(self.seeds):
+            seed %= size
+            _hash = 0
+            for code in codes:
+                _hash = (_hash * seed + code) % size
+            ret[i] = _hash
+        return ret
+
+
+class Blake2bHashStrategy(HashStrategy):
+    """
+    Hashes the utf-8 bytes of the key once with blake2b and derives all positions from the
+    two 64-bit halves of the digest (Kirsch-Mitzenmacher double hashing):
+        position_i = (h1 + i * h2) mod size
+    """
+    name = "blake2b"
+
+    def __init__(self, hash_num):
+        super().__init__(hash_num)
+        self.steps = np.arange(hash_num, dtype=np.uint64)
+
+    @staticmethod
+    def _digests(keys):
+        """
+        :return: uint64 array of shape (len(keys), 2)
+        """
+        buffer = b"".join(hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest() for key in keys)
+        return np.frombuffer(buffer, dtype="<u8").reshape(-1, 2)
+
+    def positions(self, key, size):
+        return self.positions_many([key], size)[0]
+
+    def positions_many(self, keys, size):
+        digests = self._digests(keys)
+        h1 = digests[:, :1]
+        # an odd h2 never degenerates to probing the same position k times.
+        h2 = digests[:, 1:] | np.uint64(1)
+        # uint64 arithmetic wraps around, which is fine for a hash.
+        return ((h1 + self.steps * h2) % np.uint64(size)).astype(np.int64)
+
+
+# the strategy recorded in BloomFilter.json picks the class used on load.
+hash_strategy_recipe = {
+    BKDRHashStrategy.name: BKDRHashStrategy,
+    Blake2bHashStrategy.name: Blake2bHashStrategy,
+}
+
+DEFAULT_HASH_STRATEGY = Blake2bHashStrategy.name
+
+# BloomFilter.json files written before hash strategies existed.
+LEGACY_HASH_STRATEGY = BKDRHashStrategy.name
+
+
+# number of set bits of every byte value.
+_POPCOUNT_TABLE = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
 class BitArray:
     """
-    BitArray implemented with Bytearray
+    BitArray implemented with a numpy uint8 array.
+
+    Bit n lives in byte n // 8, counting from the most significant bit,
+    which is the same layout the previous bytearray implementation used,
+    so saved bitarrays stay loadable.
     """
 
     def __init__(self, _size: int = 0, _bytearray=None):
         """
-        size: the size of the bytearray
+        size: the size of the bitarray (in bits)
+        _bytearray: an existing buffer (bytearray, uint8 array or np.memmap) to wrap
         """
         if _bytearray is not None:
-            self.bytearray = _bytearray
-            self.size = len(_bytearray) * 8
+            if isinstance(_bytearray, np.memmap):
+                # keep the memmap itself so that it can be flushed.
+                self.array = _bytearray
+            else:
+                self.array = np.asarray(_bytearray, dtype=np.uint8)
+            self.size = len(self.array) * 8
 
         else:
             assert _size > 0
             # make size a multiple of 8
             byte_count = math.ceil(_size / 8.)
-            self.bytearray = bytearray(byte_count)
+            self.array = np.zeros(byte_count, dtype=np.uint8)
             self.size = byte_count * 8
 
+    @property
+    def backing_file(self):
+        """
+        The file the bitarray is memory-mapped to, or None if it lives in memory.
+        """
+        if isinstance(self.array, np.memmap):
+            return self.array.filename
+        return None
+
     def set(self, n):
         """
         Sets the nth element of the bitarray
         """
-        index = int(n / 8)
-        position = n % 8
-        self.bytearray[index] = self.bytearray[index] | 1 << (7 - position)
+        self.array[n >> 3] |= 0x80 >> (n & 7)
 
     def get(self, n):
         """
         Gets the nth element of the bitarray
         """
-        index = n // 8
-        position = n % 8
-        return (self.bytearray[index] & (1 << (7 - position))) > 0
+        return (int(self.array[n >> 3]) & (0x80 >> (n & 7))) > 0
+
+    def set_many(self, indices):
+        """
+        Sets all the given elements of the bitarray in one vectorized call.
+        :param indices: array-like of bit positions, any shape.
+        """
+        indices = np.asarray(indices, dtype=np.int64).ravel()
+        masks = np.right_shift(0x80, indices & 7).astype(np.uint8)
+        # ufunc.at is unbuffered, so several positions falling into the same byte are all kept.
+        np.bitwise_or.at(self.array, indices >> 3, masks)
+
+    def get_many(self, indices):
+        """
+        Gets all the given elements of the bitarray in one vectorized call.
+        :param indices: array-like of bit positions, any shape.
+        :return: a bool array of the same shape as indices.
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        masks = np.right_shift(0x80, indices & 7).astype(np.uint8)
+        return (self.array[indices >> 3] & masks) != 0
+
+    def count(self):
+        """
+        The number of set bits.
+        """
+        return int(_POPCOUNT_TABLE[self.array].sum(dtype=np.int64))
+
+    def copy(self):
+        """
+        An in-memory copy, also of a memory-mapped bitarray.
+        """
+        return BitArray(_bytearray=np.array(self.array, dtype=np.uint8))
+
+    def flush(self):
+        """
+        Write the dirty pages of a memory-mapped bitarray back to its file.
+        Does nothing for an in-memory bitarray.
+        """
+        if self.backing_file is not None:
+            self.array.flush()
 
     def save(self, path, filename="bitarray.npy"):
         """
-        Save the bitarray to a file
+        Save the bitarray to a file.
+
+        A memory-mapped bitarray is only flushed when saved onto its own file,
+        and is flushed then cloned when saved somewhere else (e.g. a snapshot).
         """
         _dir = osp.join(path, filename)
-        np.save(_dir, self.bytearray)
+        if self.backing_file is None:
+            np.save(_dir, self.array)
+            return
+
+        self.flush()
+        if osp.exists(_dir) and osp.samefile(_dir, self.backing_file):
+            return
+        utils.clone_file(self.backing_file, _dir)
 
     @staticmethod
-    def load(path, filename="bitarray.npy"):
+    def load(path, filename="bitarray.npy", mmap=False):
         """
         Load the bitarray from a file
+        :param mmap: if True, memory-map the file instead of reading it.
+               Loading is then instant, and the file is updated in place.
         """
         _dir = osp.join(path, filename)
         if not osp.exists(_dir):
             raise FileNotFoundError(f"File {_dir} not found!")
-        _bytearray = np.load(_dir)
+        _bytearray = np.load(_dir, mmap_mode="r+" if mmap else None)
+        return BitArray(_bytearray=_bytearray)
+
+    @staticmethod
+    def create_memmap(path, _size, filename="bitarray.npy"):
+        """
+        Create a zeroed bitarray memory-mapped to a new .npy file, which is also what save() writes.
+        """
+        os.makedirs(path, exist_ok=True)
+        byte_count = math.ceil(_size / 8.)
+        _bytearray = np.lib.format.open_memmap(osp.join(path, filename), mode="w+",
+                                               dtype=np.uint8, shape=(byte_count,))
         return BitArray(_bytearray=_bytearray)
 
 
@@ -94,11 +275,17 @@ class BloomFilter:
     BloomFilter implemented with BitArray
     """
 
-    def __init__(self, size, hash_num, bitarray=None):
+    def __init__(self, size, hash_num, bitarray=None, hash_strategy=DEFAULT_HASH_STRATEGY):
         """
         size: the size of the bytearray
         hash_num: the number of hash functions
+        hash_strategy: a key of hash_strategy_recipe
+
+        A single lock guards every read and write, the BloomFilter is thread-safe on its own.
         """
+        if hash_strategy not in hash_strategy_recipe:
+            raise ValueError(f"Invalid hash strategy {hash_strategy}")
+
         self.lock = threading.Lock()
 
         self.size = size
@@ -107,28 +294,76 @@ class BloomFilter:
             self.bitarray = bitarray
         else:
             self.bitarray = BitArray(size)
-        self.hash_funcs = list(BKDRHashGenerator(hash_num))
+        self.hash_strategy = hash_strategy
+        self.hasher: HashStrategy = hash_strategy_recipe[hash_strategy](hash_num)
+
+    def copy(self):
+        """
+        An in-memory copy, e.g. to save a snapshot from while this one is still written to.
+        """
+        with self.lock:
+            bitarray = self.bitarray.copy()
+        return BloomFilter(self.size, self.hash_num, bitarray=bitarray, hash_strategy=self.hash_strategy)
+
+    def _positions(self, key):
+        """
+        The bit positions probed for the key, as an int64 array of length hash_num.
+        """
+        return self.hasher.positions(key, self.size)
 
     def add(self, key):
         """
         Add a key to the BloomFilter
         """
+        positions = self._positions(key)
         with self.lock:
-            for hash_func in self.hash_funcs:
-                self.bitarray.set(hash_func(key) % self.size)
+            self.bitarray.set_many(positions)
 
     def __contains__(self, key):
         """
         Check if the key is in the BloomFilter
         """
+        positions = self._positions(key)
+        with self.lock:
+            return bool(self.bitarray.get_many(positions).all())
+
+    def add_many(self, keys):
+        """
+        Add all the keys to the BloomFilter under one lock acquisition.
+        """
+        keys = list(keys)
+        if not keys:
+            return
+        positions = self.hasher.positions_many(keys, self.size)
+        with self.lock:
+            self.bitarray.set_many(positions)
+
+    def contains_many(self, keys) -> np.ndarray:
+        """
+        Check all the keys under one lock acquisition.
+        :return: a bool array, True where the key is (probably) in the BloomFilter.
+        """
+        keys = list(keys)
+        if not keys:
+            return np.zeros(0, dtype=bool)
+        positions = self.hasher.positions_many(keys, self.size)
         with self.lock:
-            for hash_func in self.hash_funcs:
-                if not self.bitarray.get(hash_func(key) % self.size):
-                    return False
-        return True
+            return self.bitarray.get_many(positions).all(axis=1)
+
+    def fill_ratio(self):
+        """
+        The fraction of bits that are set.
+        """
+        return self.bitarray.count() / self.bitarray.size
+
+    def estimated_error_rate(self):
+        """
+        The false positive rate implied by the current fill ratio.
+        """
+        return self.fill_ratio() ** self.hash_num
 
     def __str__(self):
-        return f"BloomFilter(size={self.size}, hash_num={self.hash_num})"
+        return f"BloomFilter(size={self.size}, hash_num={self.hash_num}, hash_strategy={self.hash_strategy})"
 
     __repr__ = __str__
 
@@ -137,22 +372,32 @@ class BloomFilter:
         return {
             "size": self.size,
             "hash_num": self.hash_num,
+            "hash_strategy": self.hash_strategy,
             "bitarray": self.bitarray
         }
 
     @staticmethod
-    def load_from(path, filename="BloomFilter.json"):
+    def load_from(path, filename="BloomFilter.json", mmap=False):
+        """
+        Load the BloomFilter from a directory.
+        :param mmap: memory-map the bitarray. Saving back to the same directory is then a flush.
+        """
         _filepath = osp.join(path, filename)
         _bitarray_dir = osp.join(path, ".bitarray")
         if not osp.exists(_filepath):
             raise FileNotFoundError(f"File {_filepath} not found!")
-        if not osp.exists(_bitarray_dir):
-            raise FileNotFoundError(f"File {_bitarray_dir} not found!")
         with open(_filepath, "r") as f:
             state_dict = json.load(f)
 
-        bitarray = BitArray.load(_bitarray_dir)
-        ret = BloomFilter(size=state_dict["size"], hash_num=state_dict["hash_num"], bitarray=bitarray)
+        if state_dict.get("type") == ScalableBloomFilter.type_name:
+            return ScalableBloomFilter.load_from(path, filename=filename, mmap=mmap)
+
+        if not osp.exists(_bitarray_dir):
+            raise FileNotFoundError(f"File {_bitarray_dir} not found!")
+
+        bitarray = BitArray.load(_bitarray_dir, mmap=mmap)
+        ret = BloomFilter(size=state_dict["size"], hash_num=state_dict["hash_num"], bitarray=bitarray,
+                          hash_strategy=state_dict.get("hash_strategy", LEGACY_HASH_STRATEGY))
         return ret
 
     def save_to(self, path, filename="BloomFilter.json"):
@@ -184,9 +429,227 @@ class BloomFilter:
         return size, func_count
 
 
-def bloom_filter_maker(capacity, error_rate):
+class ScalableBloomFilter:
+    """
+    A BloomFilter that grows with the number of keys, so its false positive rate stays bounded.
+
+    Keys are added to the last BloomFilter of a chain of slices. Once the estimated fill ratio of the
+    last slice reaches fill_threshold, a new slice is appended, growth times larger and with its error
+    rate multiplied by tightening. The slice error rates are a geometric series starting at
+    error_rate * (1 - tightening), so the compound error rate stays below error_rate.
+
+    File structure:
+    | BloomFilter.json: the parameters, with "type": "scalable".
+    | slice_0/: a BloomFilter.
+    | slice_1/: ...
+    """
+    type_name = "scalable"
+
+    def __init__(self,
+                 initial_capacity: int = 100000,
+                 error_rate: float = 1e-5,
+                 growth: int = 2,
+                 tightening: float = 0.5,
+                 fill_threshold: float = 0.5,
+                 hash_strategy: str = DEFAULT_HASH_STRATEGY,
+                 mmap_path: Optional[str] = None,
+                 state_dict: Optional[dict] = None,
+                 ):
+        """
+        :param initial_capacity: the capacity of the first slice.
+        :param error_rate: the bound on the compound false positive rate.
+        :param growth: the capacity ratio of a slice to its predecessor.
+        :param tightening: the error rate ratio of a slice to its predecessor.
+        :param fill_threshold: the fill ratio of the last slice at which a new slice is added.
+        :param mmap_path: if not None, slices are memory-mapped to files under this directory.
+        :param state_dict: used when loading, see load_from.
+        """
+        self.lock = threading.Lock()
+
+        if state_dict is not None:
+            self.initial_capacity = state_dict["initial_capacity"]
+            self.error_rate = state_dict["error_rate"]
+            self.growth = state_dict["growth"]
+            self.tightening = state_dict["tightening"]
+            self.fill_threshold = state_dict["fill_threshold"]
+            self.hash_strategy = state_dict["hash_strategy"]
+            self.mmap_path = state_dict["mmap_path"]
+            self.slices: List[BloomFilter] = state_dict["slices"]
+            self.counts: List[int] = state_dict["counts"]
+        else:
+            self.initial_capacity = initial_capacity
+            self.error_rate = error_rate
+            self.growth = growth
+            self.tightening = tightening
+            self.fill_threshold = fill_threshold
+            self.hash_strategy = hash_strategy
+            self.mmap_path = mmap_path
+            self.slices = []
+            self.counts = []
+            self._add_slice()
+
+    def _slice_error_rate(self, i):
+        return self.error_rate * (1 - self.tightening) * self.tightening ** i
+
+    def _add_slice(self):
+        i = len(self.slices)
+        capacity = self.initial_capacity * self.growth ** i
+        mmap_path = osp.join(self.mmap_path, f"slice_{i}") if self.mmap_path is not None else None
+        self.slices.append(bloom_filter_maker(capacity, self._slice_error_rate(i), hash_strategy=self.hash_strategy,
+                                              mmap_path=mmap_path))
+        self.counts.append(0)
+
+    def _slice_room(self):
+        """
+        How many more keys the last slice takes before its estimated fill ratio,
+        1 - exp(-hash_num * count / size), reaches fill_threshold,
+        or the false positive rate it implies reaches the error rate of the slice.
+        """
+        last = self.slices[-1]
+        max_fill = min(self.fill_threshold, self._slice_error_rate(len(self.slices) - 1) ** (1 / last.hash_num))
+        max_count = -last.size / last.hash_num * math.log(1 - max_fill)
+        return max(int(max_count) - self.counts[-1], 0)
+
+    def add(self, key):
+        """
+        Add a key to the ScalableBloomFilter
+        """
+        with self.lock:
+            if key in self:
+                return
+            if self._slice_room() == 0:
+                self._add_slice()
+            self.slices[-1].add(key)
+            self.counts[-1] += 1
+
+    def add_many(self, keys):
+        """
+        Add all the keys, filling up the last slice and adding new ones as needed.
+        """
+        with self.lock:
+            keys = list(dict.fromkeys(keys))
+            met_mask = self.contains_many(keys)
+            new_keys = [key for key, met in zip(keys, met_mask) if not met]
+            while new_keys:
+                room = self._slice_room()
+                if room == 0:
+                    self._add_slice()
+                    continue
+                self.slices[-1].add_many(new_keys[:room])
+                self.counts[-1] += len(new_keys[:room])
+                new_keys = new_keys[room:]
+
+    def __contains__(self, key):
+        """
+        Check if the key is in any of the slices
+        """
+        return any(key in _slice for _slice in self.slices)
+
+    def contains_many(self, keys) -> np.ndarray:
+        """
+        :return: a bool array, True where the key is (probably) in one of the slices.
+        """
+        keys = list(keys)
+        ret = np.zeros(len(keys), dtype=bool)
+        for _slice in self.slices:
+            ret |= _slice.contains_many(keys)
+        return ret
+
+    def fill_ratio(self):
+        """
+        The fraction of bits set in the last slice, the one keys are added to.
+        """
+        return self.slices[-1].fill_ratio()
+
+    def estimated_error_rate(self):
+        """
+        The compound false positive rate implied by the current fill ratios of all slices.
+        """
+        return 1 - math.prod(1 - _slice.estimated_error_rate() for _slice in self.slices)
+
+    def __len__(self):
+        """
+        The number of keys added (keys reported as already present are not counted).
+        """
+        return sum(self.counts)
+
+    def copy(self):
+        """
+        An in-memory copy, see BloomFilter.copy. New slices of the copy are not memory-mapped.
+        """
+        with self.lock:
+            state_dict = self.as_state_dict()
+            state_dict["slices"] = [_slice.copy() for _slice in self.slices]
+            state_dict["counts"] = list(self.counts)
+        state_dict["mmap_path"] = None
+        return ScalableBloomFilter(state_dict=state_dict)
+
+    def __str__(self):
+        return f"ScalableBloomFilter(slices={len(self.slices)}, count={len(self)}, " \
+               f"initial_capacity={self.initial_capacity}, error_rate={self.error_rate})"
+
+    __repr__ = __str__
+
+    def as_state_dict(self):
+        return {
+            "type": self.type_name,
+            "initial_capacity": self.initial_capacity,
+            "error_rate": self.error_rate,
+            "growth": self.growth,
+            "tightening": self.tightening,
+            "fill_threshold": self.fill_threshold,
+            "hash_strategy": self.hash_strategy,
+            "mmap_path": self.mmap_path,
+            "counts": self.counts,
+            "slices": self.slices,
+        }
+
+    @staticmethod
+    def load_from(path, filename="BloomFilter.json", mmap=False):
+        """
+        Load the ScalableBloomFilter from a directory. BloomFilter.load_from forwards here as well.
+        :param mmap: memory-map the slices, and create new slices as memory-mapped files under path.
+        """
+        _filepath = osp.join(path, filename)
+        if not osp.exists(_filepath):
+            raise FileNotFoundError(f"File {_filepath} not found!")
+        with open(_filepath, "r") as f:
+            state_dict = json.load(f)
+
+        state_dict["slices"] = [BloomFilter.load_from(osp.join(path, f"slice_{i}"), mmap=mmap)
+                                for i in range(len(state_dict["counts"]))]
+        state_dict["mmap_path"] = path if mmap else None
+        return ScalableBloomFilter(state_dict=state_dict)
+
+    def save_to(self, path, filename="BloomFilter.json"):
+        """
+        Save the parameters to path/filename and every slice to path/slice_{i}/.
+        """
+        os.makedirs(path, exist_ok=True)
+        with self.lock:
+            state_dict = self.as_state_dict()
+            state_dict_to_json = {k: v for k, v in state_dict.items() if k not in ("slices", "mmap_path")}
+            with open(osp.join(path, filename), "w") as f:
+                json.dump(state_dict_to_json, f)
+
+            for i, _slice in enumerate(self.slices):
+                _slice.save_to(osp.join(path, f"slice_{i}"))
+
+
+def bloom_filter_maker(capacity, error_rate, hash_strategy=DEFAULT_HASH_STRATEGY, mmap_path=None, scalable=False):
+    """
+    :param mmap_path: if not None, the bitarray is memory-mapped to a file under this directory,
+           at the place where save_to(mmap_path) would write it.
+    :param scalable: make a ScalableBloomFilter whose first slice has the given capacity.
+    """
+    if scalable:
+        return ScalableBloomFilter(initial_capacity=capacity, error_rate=error_rate,
+                                   hash_strategy=hash_strategy, mmap_path=mmap_path)
     size, hash_func_count = BloomFilter.best_args(capacity, error_rate)
-    return BloomFilter(size, hash_func_count)
+    bitarray = None
+    if mmap_path is not None:
+        bitarray = BitArray.create_memmap(osp.join(mmap_path, ".bitarray"), size)
+    return BloomFilter(size, hash_func_count, bitarray=bitarray, hash_strategy=hash_strategy)
 
 
 def test_best_args():
@@ -0,0 +1,196 @@
+"""
+Per-record compression of the contents of a FileSet.
+
+The codec of a content is recorded with its entry (FileSetRecordedEntry.codec), so that contents stored with
+different codecs, or before there were codecs, stay readable side by side. The codecs recorded:
+- None: stored as is ("raw").
+- "zlib": deflate, with the zlib framing.
+- "zlib-dict:{id}": zlib with a preset dictionary, see train_zlib_dictionary.
+- "zstd", "zstd-dict:{id}": zstandard, only if the zstandard package is installed.
+
+The pages of a site share most of their markup: the head, the navigation, the footer. A dictionary trained on
+a few of them holds that boilerplate, so that every page refers to it instead of spelling it out again.
+The dictionaries are named by the hash of their bytes, and never change once written.
+
+File structure:
+| {id}.dict: a dictionary.
+"""
+import collections
+import hashlib
+import os
+import os.path as osp
+import re
+import threading
+import zlib
+from typing import Dict, List, Optional, Tuple
+
+try:
+    import zstandard
+except ImportError:
+    # optional, only for the zstd codecs.
+    zstandard = None
+
+CODECS = ["raw", "zlib", "zlib-dict"] + (["zstd", "zstd-dict"] if zstandard is not None else [])
+
+ZLIB_LEVEL = 6
+ZSTD_LEVEL = 3
+
+# zlib only looks 32 KiB back, a larger preset dictionary is of no use.
+ZLIB_DICTIONARY_SIZE = 32 * 1024
+ZSTD_DICTIONARY_SIZE = 112 * 1024
+
+# the pieces of the pages counted when training a zlib dictionary: lines, and the tags of the long ones.
+_LONG_LINE = 256
+_TAG_BOUNDARY = re.compile(rb"(?=<)")
+_MIN_PIECE = 8
+
+
+def check_codec(codec: str):
+    if codec not in CODECS:
+        raise ValueError(f"Unsupported codec {codec}, the codecs available are {CODECS}")
+
+
+def uses_dictionary(codec: str) -> bool:
+    return codec.endswith("-dict")
+
+
+def split_codec(recorded_codec: Optional[str]) -> Tuple[str, Optional[str]]:
+    """
+    :param recorded_codec: as recorded with an entry, e.g. "zlib-dict:0123abcd".
+    :return: the codec, e.g. "zlib-dict", and the id of its dictionary, None if it has none.
+    """
+    if recorded_codec is None:
+        return "raw", None
+    codec, _, dictionary_id = recorded_codec.partition(":")
+    return codec, dictionary_id or None
+
+
+def dictionary_id_of(dictionary: bytes) -> str:
+    return hashlib.blake2b(dictionary, digest_size=8).hexdigest()
+
+
+def _pieces(sample: bytes):
+    for line in sample.splitlines():
+        line = line.strip()
+        if len(line) > _LONG_LINE:
+            yield from (piece for piece in _TAG_BOUNDARY.split(line) if len(piece) >= _MIN_PIECE)
+        elif len(line) >= _MIN_PIECE:
+            yield line
+
+
+def train_zlib_dictionary(samples: List[bytes], size: int = ZLIB_DICTIONARY_SIZE) -> bytes:
+    """
+    A preset dictionary for zlib: the pieces (lines, tags) found in the most samples, worth the most bytes.
+    The most valuable ones come last, as zlib codes a nearer match in fewer bits.
+    :param samples: pages of the site.
+    :param size:
+    :return:
+    """
+    document_frequency = collections.Counter()
+    for sample in samples:
+        document_frequency.update(set(_pieces(sample)))
+    common = sorted(((count * len(piece), piece) for piece, count in document_frequency.items() if count > 1),
+                    reverse=True)
+    chosen = []
+    total = 0
+    for _, piece in common:
+        if total + len(piece) + 1 <= size:
+            chosen.append(piece)
+            total += len(piece) + 1
+    return b"\n".join(reversed(chosen))
+
+
+def train_dictionary(codec: str, samples: List[bytes]) -> bytes:
+    """
+    :param codec: "zlib-dict" or "zstd-dict".
+    :param samples: pages of the site.
+    :return: the dictionary.
+    """
+    if codec == "zstd-dict":
+        raw_dictionary = train_zlib_dictionary(samples, ZSTD_DICTIONARY_SIZE)
+        try:
+            trained_dictionary = zstandard.train_dictionary(ZSTD_DICTIONARY_SIZE, samples).as_bytes()
+        except zstandard.ZstdError:
+            # too few samples to train on.
+            return raw_dictionary
+        # the trainer of zstd keeps little of pages that differ mostly in their text, the raw dictionary
+        # may do better: the one that compresses the samples the most is kept.
+        return min((raw_dictionary, trained_dictionary),
+                   key=lambda dictionary: sum(len(compress(sample, codec, dictionary)) for sample in samples))
+    return train_zlib_dictionary(samples)
+
+
+def compress(content: bytes, codec: str, dictionary: Optional[bytes] = None) -> bytes:
+    """
+    :param content:
+    :param codec: one of CODECS.
+    :param dictionary: for the -dict codecs.
+    :return:
+    """
+    if codec == "raw":
+        return content
+    if codec in ("zlib", "zlib-dict"):
+        compressor = zlib.compressobj(ZLIB_LEVEL, zdict=dictionary) if dictionary else zlib.compressobj(ZLIB_LEVEL)
+        return compressor.compress(content) + compressor.flush()
+    if codec in ("zstd", "zstd-dict") and zstandard is not None:
+        # the compressors are not thread-safe, one per call.
+        dict_data = zstandard.ZstdCompressionDict(dictionary) if dictionary else None
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL, dict_data=dict_data).compress(content)
+    raise ValueError(f"Unsupported codec {codec}")
+
+
+def decompress(data: bytes, codec: str, dictionary: Optional[bytes] = None) -> bytes:
+    if codec == "raw":
+        return data
+    if codec in ("zlib", "zlib-dict"):
+        decompressor = zlib.decompressobj(zdict=dictionary) if dictionary else zlib.decompressobj()
+        return decompressor.decompress(data) + decompressor.flush()
+    if codec in ("zstd", "zstd-dict") and zstandard is not None:
+        dict_data = zstandard.ZstdCompressionDict(dictionary) if dictionary else None
+        # the content size is in the frame header.
+        return zstandard.ZstdDecompressor(dict_data=dict_data).decompress(data)
+    raise ValueError(f"Unsupported codec {codec}")
+
+
+class DictionaryStore:
+    """
+    The dictionaries of a FileSet, by id, read once and cached.
+    """
+
+    def __init__(self,
+                 directory: str,
+                 ):
+        self.directory = directory
+        self.lock = threading.Lock()
+        self.cache: Dict[str, bytes] = {}
+
+    def _path(self, dictionary_id: str) -> str:
+        return osp.join(self.directory, f"{dictionary_id}.dict")
+
+    def add(self, dictionary: bytes) -> str:
+        """
+        :return: the id of the dictionary.
+        """
+        dictionary_id = dictionary_id_of(dictionary)
+        path = self._path(dictionary_id)
+        if not osp.exists(path):
+            os.makedirs(self.directory, exist_ok=True)
+            with open(path + ".tmp", "wb") as f:
+                f.write(dictionary)
+            os.replace(path + ".tmp", path)
+        with self.lock:
+            self.cache[dictionary_id] = dictionary
+        return dictionary_id
+
+    def get(self, dictionary_id: str) -> bytes:
+        with self.lock:
+            dictionary = self.cache.get(dictionary_id)
+        if dictionary is None:
+            path = self._path(dictionary_id)
+            if not osp.exists(path):
+                raise FileNotFoundError(f"File {path} not found!")
+            with open(path, "rb") as f:
+                dictionary = f.read()
+            with self.lock:
+                self.cache[dictionary_id] = dictionary
+        return dictionary
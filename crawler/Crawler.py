@@ -11,22 +11,54 @@ Details:
   - one bloom filter recording the urls whose files have been saved.
 - use DataSet to save the crawled data.
 - multithread.
-  - use a queue to store the urls to be crawled. (queue.Queue)
-  - control the behavior of the threads by using threading.Event.
-    - Auto-save: the main thread holds an event "stop_event".
-      - the main thread will set the event every constant time interval, or every 500 files saved, etc.
-      - sub-threads will cease to crawl urls when the event is set.
-      - when all sub-threads cease, the main thread will save the current state.
-        this is to make sure all the tasks are either in the queue, or are done when the state is saved.
+  - use a frontier to store the urls to be crawled. (Frontier.HostFrontier, a queue.Queue look-alike)
+    - it hands a url to a worker only when the url's host is ready, so the politeness is per host:
+      every host gets at most one request per host interval, and at most max_per_host at a time.
+      workers don't sleep between pages, crawling several hosts runs at the sum of their rates.
+    - the urls are prioritized: seeds, then articles (passing the strict filter), then hubs (passing the loose
+      filter only), shallower first. when it is full, the lowest priority urls are evicted for higher ones.
+    - with spill_queue, the frontier is a Frontier.SpillingFrontier: max_queue_size urls are kept in memory,
+      the rest is spilled to frontier/spill.bin instead of being evicted.
+  - the workers keep running from one epoch to the next, and stop at the end of run:
+    - stop_event: they take no new url, finish the page they are on, and exit. run joins them.
+    - cancel_event: set once the drain deadline has passed, the workers still fetching then drop their page
+      when the fetch returns and put their url back to the queue. meanwhile, their urls are in flight,
+      and saved in the queue.
+  - a page goes through fetch -> parse -> enqueue. with parse_workers, the parse stage (lxml, as_unique_url
+    and the filters) runs in a process pool fed with the raw bytes, which returns the article and hub urls
+    and the extract of the page, so that parsing doesn't hold the GIL the fetching threads need.
+  - a page is parsed only once: the links, image srcs, title and text are extracted together
+    (request_utils.extract_page), and saved pages keep them in a sidecar record of the FileSet,
+    so that the later stages (ImageRetriever, the indexers) don't parse the html again.
+  - with stream_pages, the parse stage runs while the page is being downloaded: the chunks read are fed to
+    a request_utils.PageExtractor, and the links are enqueued as soon as they are parsed,
+    without building a tree of the page.
+  - with conditional_get, the validators (ETag, Last-Modified) and a hash of every page fetched are kept in
+    an HttpCache.HttpCache. a page fetched again (a seed, a hub) is requested with If-None-Match and
+    If-Modified-Since, and is not processed again if the server answers 304 or sends the same body.
+  - the workers change the state only in process_page, under the shared side of a gate
+    (utils.SharedExclusiveLock). saves and snapshots take the exclusive side, so they see a state
+    where every url is either in the queue, in flight (handed out by the frontier, saved in the queue too),
+    or done.
 - Auto-save.
   - the state to be tracked are:
     - the current queue.
     - current bloom filters. (uses its own save/load mechanism)
     - the current DataSet state. (uses its own save/load mechanism)
+  - snapshots are copy-on-write: the bloom filters, the FileSet entries and the queue are copied in memory
+    under the gate, which only takes as long as the copy, and written out by a background thread
+    while the workers go on crawling.
+- Write-ahead log. (only with write_ahead_log)
+  - the workers log every url enqueued, every url fetched and every file saved to wal/ as they go.
+  - save() is a checkpoint: the log is rotated to a new generation, and the older ones are removed once saved.
+    CrawlerParams.json, which names the generation to replay from, is written last.
+  - after a crash, Crawler.recover loads the last checkpoint and replays the log since.
 
 
 """
+import concurrent.futures
 import json
+import multiprocessing
 import queue
 import threading
 import shutil
@@ -35,27 +67,25 @@ import os.path as osp
 import os
 import urllib.parse
 
-from typing import Optional
+from typing import Dict, Optional, Union
 
 import loguru
 import numpy as np
 
 import FileSet as fs
 import BloomFilter as bf
+import FingerprintSet as fps
+import Frontier
+import HttpCache as hc
+import WriteAheadLog as wal
 import utils
 import request_utils
 
 logger = loguru.logger
 
-strict_filter_recipe = {
-    "sina": utils.is_sina_sports_football_article,
-    "zhibo8": utils.is_zhibo8_news_football_article
-}
+strict_filter_recipe = utils.strict_filter_recipe
 
-loose_filter_recipe = {
-    "sina": utils.is_sina_sports_domain,
-    "zhibo8": utils.is_zhibo8_football_domain
-}
+loose_filter_recipe = utils.loose_filter_recipe
 
 zhibo8_seeds = [
     'https://news.zhibo8.com/zuqiu/more.htm?label=中超',
@@ -78,6 +108,11 @@ bypass_bloomfilter_recipe = {
     "zhibo8": set(zhibo8_seeds_quoted).copy()
 }
 
+# the priorities of the urls in the frontier, higher first.
+SEED_PRIORITY = 3
+ARTICLE_PRIORITY = 2
+HUB_PRIORITY = 1
+
 
 class Crawler:
     """
@@ -85,16 +120,22 @@ class Crawler:
     | CrawlerParams.json
     | met_urls/ (BloomFilter)
     | saved_urls/ (BloomFilter)
+    | met_urls_exact/ (FingerprintSet, only with exact_dedup)
+    | frontier/spill.bin (the spilled urls of the SpillingFrontier, only with spill_queue)
+    | frontier/spill-{checkpoint:08d}.bin (a copy of spill.bin taken by the last save, only with spill_queue)
+    | wal/ (WriteAheadLog, only with write_ahead_log)
+    | http_cache/ (HttpCache, only with conditional_get)
     | saved_files/ (FileSet)
     | snapshots/
 
 
     """
 
-    queue: queue.Queue
-    met_url_bf: bf.BloomFilter
-    saved_url_bf: bf.BloomFilter
+    queue: Frontier.HostFrontier
+    met_url_bf: Union[bf.BloomFilter, bf.ScalableBloomFilter]
+    saved_url_bf: Union[bf.BloomFilter, bf.ScalableBloomFilter]
     saved_content: fs.FileSet
+    met_url_store: Optional[fps.FingerprintSet]
 
     def __init__(self,
                  directory: Optional[str] = None,
@@ -105,49 +146,160 @@ class Crawler:
                  saved_url_bf_capacity: int = 100000,
                  error_rate: float = 1e-5,
                  filter_config: str = "sina",
+                 mmap_bloom_filters: bool = False,
+                 scalable_bloom_filters: bool = False,
+                 exact_dedup: bool = False,
+                 host_interval_ms: Optional[float] = None,
+                 host_intervals_ms: Optional[Dict[str, float]] = None,
+                 max_per_host: int = 0,
+                 spill_queue: bool = False,
+                 write_ahead_log: bool = False,
+                 parse_workers: int = 0,
+                 stream_pages: bool = False,
+                 conditional_get: bool = False,
+                 segment_storage: bool = False,
+                 content_codec: str = "raw",
                  user_agent="Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.1.2 Safari/605.1.15",
                  state_dict: Optional[dict] = None,
 
                  ):
+        """
+        :param mmap_bloom_filters: keep the bitarrays of the bloom filters in memory-mapped files
+               under met_urls/ and saved_urls/, so that loading them is instant and saving is a flush.
+        :param scalable_bloom_filters: use ScalableBloomFilters, which grow past their capacity instead of
+               letting the false positive rate explode. The capacities are then those of the first slices.
+        :param exact_dedup: also record the crawled urls in a FingerprintSet under met_urls_exact/,
+               which is consulted whenever met_url_bf says "maybe", so that false positives don't drop urls.
+        :param host_interval_ms: the minimum time between two requests to the same host.
+               Defaults to interval_ms / max_workers, the rate a single host used to be crawled at.
+        :param host_intervals_ms: per-host overrides of host_interval_ms, e.g. {"news.zhibo8.com": 500}.
+        :param max_per_host: the maximum number of requests in flight to the same host, 0 for no limit.
+        :param spill_queue: keep only max_queue_size urls in memory and spill the others to disk,
+               instead of evicting the lowest priority ones. See Frontier.SpillingFrontier.
+        :param write_ahead_log: log what the workers do to wal/, so that Crawler.recover can recover
+               the state up to the last record after a crash, not only up to the last save.
+        :param parse_workers: the number of processes parsing the fetched pages, 0 to parse in the worker threads.
+               The processes use the filters of filter_config.
+        :param stream_pages: parse the pages while they are downloaded and enqueue their links as they are found.
+               Only in the worker threads, i.e. without parse_workers.
+        :param conditional_get: keep the validators of the pages fetched under http_cache/, and fetch
+               them again with conditional GETs. Unchanged pages are not processed again.
+        :param segment_storage: append the saved pages to segment files instead of writing a file per page,
+               see FileSet and SegmentStore.
+        :param content_codec: how the saved pages are compressed, one of ContentCodec.CODECS. Needs segment_storage.
+               With "zlib-dict" or "zstd-dict", a dictionary of the site's boilerplate is trained from the first pages.
+        """
         self.lock = threading.Lock()
         self.pause_event = threading.Event()
         self.stop_event = threading.Event()
+        self.cancel_event = threading.Event()
+        self.gate = utils.SharedExclusiveLock()
+        self.workers = []
+        self.snapshot_thread: Optional[threading.Thread] = None
+        self.parse_pool: Optional[concurrent.futures.ProcessPoolExecutor] = None
+        self.parse_pool_lock = threading.Lock()
+        # the bytes of the bodies fetched since the crawler was created, as sent and once decoded.
+        self.transfer_lock = threading.Lock()
+        self.wire_bytes = 0
+        self.decoded_bytes = 0
 
         if state_dict is None:
-            self.queue = queue.Queue(maxsize=max_queue_size)
+            queue_items = []
+            spill_state = {}
+            self.wal_checkpoint_generation = 0
+            self.wal_checkpoint_entry_count = 0
+            self.spill_checkpoint = 0
 
             self.directory = directory
             self.max_workers = max_workers
             self.interval_ms = interval_ms
             self.user_agent = user_agent
-            self.met_url_bf = bf.bloom_filter_maker(capacity=met_url_bf_capacity, error_rate=error_rate)
-            self.saved_url_bf = bf.bloom_filter_maker(capacity=saved_url_bf_capacity, error_rate=error_rate)
-            self.saved_content = fs.FileSet(directory=osp.join(directory, "saved_files"))
+            self.mmap_bloom_filters = mmap_bloom_filters
+            self.exact_dedup = exact_dedup
+            self.host_interval_ms = host_interval_ms
+            self.host_intervals_ms = dict(host_intervals_ms) if host_intervals_ms is not None else {}
+            self.max_per_host = max_per_host
+            self.spill_queue = spill_queue
+            self.write_ahead_log = write_ahead_log
+            self.parse_workers = parse_workers
+            self.stream_pages = stream_pages
+            self.conditional_get = conditional_get
+            self.http_cache = hc.HttpCache() if conditional_get else None
+            self.segment_storage = segment_storage
+            self.content_codec = content_codec
 
             self.filter_config = filter_config
 
             self.met_url_bf_dir = osp.join(directory, "met_urls")
             self.saved_url_bf_dir = osp.join(directory, "saved_urls")
             self.saved_content_dir = osp.join(directory, "saved_files")
+            self.met_url_store_dir = osp.join(directory, "met_urls_exact")
 
+            # the directory must be cleared before the memory-mapped files are created in it.
             self.init_directory()
 
+            self.met_url_bf = bf.bloom_filter_maker(capacity=met_url_bf_capacity, error_rate=error_rate,
+                                                    mmap_path=self.met_url_bf_dir if mmap_bloom_filters else None,
+                                                    scalable=scalable_bloom_filters)
+            self.saved_url_bf = bf.bloom_filter_maker(capacity=saved_url_bf_capacity, error_rate=error_rate,
+                                                      mmap_path=self.saved_url_bf_dir if mmap_bloom_filters else None,
+                                                      scalable=scalable_bloom_filters)
+            self.saved_content = fs.FileSet(directory=self.saved_content_dir,
+                                            storage="segments" if segment_storage else "files",
+                                            codec=content_codec)
+            self.met_url_store = fps.FingerprintSet(directory=self.met_url_store_dir) if exact_dedup else None
+
         else:
-            self.queue = state_dict["queue"]
+            max_queue_size = state_dict["max_queue_size"]
+            queue_items = state_dict["queue"]
+            spill_state = state_dict.get("queue_spill", {})
+            self.wal_checkpoint_generation = state_dict.get("wal_generation", 0)
+            self.wal_checkpoint_entry_count = state_dict.get("saved_entry_count", 0)
+            self.spill_checkpoint = state_dict.get("spill_checkpoint", 0)
 
             self.directory = state_dict["directory"]
             self.max_workers = state_dict["max_workers"]
             self.interval_ms = state_dict["interval_ms"]
             self.user_agent = state_dict["user_agent"]
+            self.mmap_bloom_filters = state_dict.get("mmap_bloom_filters", False)
+            self.exact_dedup = state_dict.get("exact_dedup", False)
+            self.host_interval_ms = state_dict.get("host_interval_ms", None)
+            self.host_intervals_ms = state_dict.get("host_intervals_ms", {})
+            self.max_per_host = state_dict.get("max_per_host", 0)
+            self.spill_queue = state_dict.get("spill_queue", False)
+            self.write_ahead_log = state_dict.get("write_ahead_log", False)
+            self.parse_workers = state_dict.get("parse_workers", 0)
+            self.stream_pages = state_dict.get("stream_pages", False)
+            self.conditional_get = state_dict.get("conditional_get", False)
+            self.http_cache = state_dict.get("http_cache")
+            if self.conditional_get and self.http_cache is None:
+                self.http_cache = hc.HttpCache()
+            self.segment_storage = state_dict.get("segment_storage", False)
+            self.content_codec = state_dict.get("content_codec", "raw")
             self.met_url_bf = state_dict["met_url_bf"]
             self.saved_url_bf = state_dict["saved_url_bf"]
             self.saved_content = state_dict["saved_content"]
+            self.met_url_store = state_dict.get("met_url_store")
 
             self.filter_config = state_dict["filter_config"]
 
             self.met_url_bf_dir = osp.join(self.directory, "met_urls")
             self.saved_url_bf_dir = osp.join(self.directory, "saved_urls")
             self.saved_content_dir = osp.join(self.directory, "saved_files")
+            self.met_url_store_dir = osp.join(self.directory, "met_urls_exact")
+
+        self.wal_dir = osp.join(self.directory, "wal")
+        self.wal = wal.WriteAheadLog(self.wal_dir, generation=self.wal_checkpoint_generation) \
+            if self.write_ahead_log else None
+
+        self.spill_path = osp.join(self.directory, "frontier", "spill.bin")
+        if self.spill_queue and self.spill_checkpoint:
+            # spill.bin has been read from and appended to since the save, spill_state describes the copy.
+            utils.clone_file(self.spill_checkpoint_path(self.directory, self.spill_checkpoint), self.spill_path)
+        if self.spill_queue:
+            self.queue = Frontier.SpillingFrontier(self.spill_path, maxsize=max_queue_size, **spill_state)
+        else:
+            self.queue = Frontier.HostFrontier(maxsize=max_queue_size)
 
         self.strict_filter = strict_filter_recipe[self.filter_config]
         self.loose_filter = loose_filter_recipe[self.filter_config]
@@ -155,11 +307,34 @@ class Crawler:
         logger.info(f"Crawler's strict filter is {self.strict_filter}")
         logger.info(f"Crawler's loose filter is {self.loose_filter}")
 
+        self.configure_frontier()
+        self.restore_queue(queue_items)
+
+    @staticmethod
+    def spill_checkpoint_path(directory: str, checkpoint: int) -> str:
+        return osp.join(directory, "frontier", f"spill-{checkpoint:08d}.bin")
+
+    def configure_frontier(self,
+                           ):
+        """
+        Pass the politeness settings to the frontier.
+        Called at the start of every epoch too, as max_workers and interval_ms may be changed between epochs.
+        :return:
+        """
+        host_interval_ms = self.host_interval_ms
+        if host_interval_ms is None:
+            host_interval_ms = self.interval_ms / self.max_workers
+        self.queue.configure(default_interval_s=host_interval_ms / 1000,
+                             host_intervals_s={host: ms / 1000 for host, ms in self.host_intervals_ms.items()},
+                             max_per_host=self.max_per_host)
+
     def run(self,
             epoch_count: int = 2,
             secs: int = 30,
             start_epoch: int = 0,
-            make_snapshot: bool = True
+            make_snapshot: bool = True,
+            checkpoint_every: int = 1,
+            drain_timeout_s: float = 5.0,
             ):
         """
         Run the crawler.
@@ -167,145 +342,397 @@ class Crawler:
         :param secs:
         :param start_epoch:
         :param make_snapshot:
+        :param checkpoint_every: with the write-ahead log, save only every checkpoint_every epochs,
+               the log covers the epochs in between. The last epoch is always saved.
+        :param drain_timeout_s: how long the workers get to finish their pages at the end, see stop_workers.
         :return:
         """
         logger.info(f"Starting the crawler.")
-        for epoch in range(start_epoch, start_epoch + epoch_count):
-            self.stop_event.clear()
-            logger.info(f"Starting epoch {epoch}")
-            start_time = time.time()
-            workers = []
-            for i in range(self.max_workers):
-                # t = threading.Thread(target=self.worker, name=f"worker-{i}")
-                # t.start()
-                workers.append(threading.Thread(target=self.worker, name=f"worker-{i}"))
-
-            for worker in workers:
-                worker.start()
-
-            while True:
-                cur_time = time.time()
-                logger.info(
-                    f"MainThread : Epoch {epoch}, Tick: {cur_time - start_time:.3f} seconds passed. Queue length ~ {self.queue.qsize()}.")
-                if cur_time - start_time > secs:
-                    break
-                time.sleep(5)
-
-            logger.info(f"MainThread : set the Stopping flag...")
-            self.stop_event.set()
-
-            time.sleep(self.interval_ms / 800 + 2)
-            # if there are still unfinished workers, kill them.
-            for t in workers:
-                if t.is_alive():
-                    logger.info(f"MainThread : Killing worker {t.name}")
-                    t._stop()
-
-            logger.info(f"MainThread : All workers stopped.")
-
-            if make_snapshot:
-                snapshot_name = fs.get_snapshot_name()
-                self.make_snapshot(snapshot_name)
-
-            logger.info(f"Epoch {epoch} completed.")
-            logger.info(f"Total {self.saved_content.recorded_entries.__len__()} files saved.")
-
-            self.save()
+        try:
+            for epoch in range(start_epoch, start_epoch + epoch_count):
+                self.crawl_epoch(epoch, secs)
+
+                is_last_epoch = epoch == start_epoch + epoch_count - 1
+                if is_last_epoch:
+                    self.stop_workers(drain_timeout_s)
+
+                if make_snapshot:
+                    snapshot_name = fs.get_snapshot_name()
+                    # written in the background, the workers go on crawling meanwhile.
+                    self.make_snapshot(snapshot_name, background=True)
+
+                logger.info(f"Epoch {epoch} completed.")
+                logger.info(f"Total {self.file_count()} files saved.")
+                logger.info(f"Total {self.wire_bytes / 2 ** 20:.1f} MB fetched, "
+                            f"{self.decoded_bytes / 2 ** 20:.1f} MB decoded.")
+
+                if self.wal is None or is_last_epoch or (epoch + 1) % checkpoint_every == 0:
+                    self.save()
+        finally:
+            self.stop_workers(drain_timeout_s)
+            self.wait_for_snapshot()
+            self.close_parse_pool()
 
         logger.info(f"Completed the crawler.")
 
+    def restore_queue(self, queue_items):
+        """
+        Put the saved queue back into the frontier.
+        :param queue_items: [url, priority, depth] lists, or bare urls as saved before the frontier had
+               priorities, whose priority is then given by priority_of.
+        :return:
+        """
+        for queue_item in queue_items:
+            if isinstance(queue_item, str):
+                url, priority, depth = queue_item, self.priority_of(queue_item), 0
+                if priority is None:
+                    priority = HUB_PRIORITY
+            else:
+                url, priority, depth = queue_item
+            try:
+                self.queue.put(url, block=False, priority=priority, depth=depth)
+            except queue.Full:
+                logger.info(f"queue is full, {url} dropped.")
+
+    def crawl_epoch(self,
+                    epoch: int,
+                    secs: int,
+                    ):
+        """
+        Crawl for secs seconds with max_workers threads. The workers are started if they are not running,
+        and keep running when this returns.
+        :param epoch: for logging.
+        :param secs:
+        :return:
+        """
+        self.configure_frontier()
+        self.start_workers()
+        logger.info(f"Starting epoch {epoch}")
+        start_time = time.time()
+
+        while True:
+            cur_time = time.time()
+            logger.info(
+                f"MainThread : Epoch {epoch}, Tick: {cur_time - start_time:.3f} seconds passed. Queue length ~ {self.queue.qsize()}.")
+            if cur_time - start_time >= secs:
+                break
+            time.sleep(min(5, secs - (cur_time - start_time)))
+
+    def start_workers(self,
+                      ):
+        if self.workers:
+            return
+        # fresh events, so that workers abandoned by a previous stop_workers don't come back to life.
+        self.stop_event = threading.Event()
+        self.cancel_event = threading.Event()
+        # daemon threads, an abandoned worker must not keep the process alive.
+        self.workers = [threading.Thread(target=self.worker, args=(self.stop_event, self.cancel_event),
+                                         name=f"worker-{i}", daemon=True)
+                        for i in range(self.max_workers)]
+        for worker in self.workers:
+            worker.start()
+
+    def stop_workers(self,
+                     drain_timeout_s: float = 5.0,
+                     ):
+        """
+        Stop the workers: they take no new url, finish the page they are on, and exit.
+        Returns as soon as they all have, or after drain_timeout_s. The workers still fetching then
+        are abandoned: they drop their page when the fetch returns and put their url back to the queue.
+        :param drain_timeout_s:
+        :return:
+        """
+        if not self.workers:
+            return
+        logger.info(f"MainThread : set the Stopping flag...")
+        start_time = time.time()
+        self.stop_event.set()
+
+        deadline = start_time + drain_timeout_s
+        for t in self.workers:
+            t.join(timeout=max(deadline - time.time(), 0))
+        stragglers = [t.name for t in self.workers if t.is_alive()]
+        if stragglers:
+            self.cancel_event.set()
+            logger.warning(f"MainThread : {stragglers} still busy after {drain_timeout_s} seconds, abandoned. "
+                           f"Their urls stay in the queue.")
+        self.workers = []
+
+        logger.info(f"MainThread : All workers stopped in {time.time() - start_time:.3f} seconds.")
+
     def worker(self,
+               stop_event: Optional[threading.Event] = None,
+               cancel_event: Optional[threading.Event] = None,
                ):
-        bypass_bloomfilter_set = bypass_bloomfilter_recipe[self.filter_config]
+        stop_event = self.stop_event if stop_event is None else stop_event
+        cancel_event = self.cancel_event if cancel_event is None else cancel_event
         worker_name = threading.current_thread().name
         logger.info(f"{worker_name} started.")
         while True:
-            if self.stop_event.is_set():
+            if stop_event.is_set():
                 logger.info(f"{worker_name} sees the stop event.")
                 break
             try:
-                cur_url = self.queue.get(timeout=1)
+                # the frontier waits for a host to be ready, no need to sleep between pages.
+                # urls failing should_crawl are dropped without using up their host's turn.
+                # a short timeout, to see the stop event soon.
+                cur_item = self.queue.get_item(timeout=0.2, accept=lambda url: self.should_crawl(url, worker_name))
             except queue.Empty:
                 continue
 
-            if self.queue.qsize() > 0.5 * self.queue.maxsize:
-                # dropout some here
-                if not self.strict_filter(cur_url):
-                    if np.random.uniform() > 0.25:
-                        self.queue.task_done()
-                        continue
-
-            if cur_url not in bypass_bloomfilter_set:
-                with self.lock:
-                    if self.met_url_bf.__contains__(cur_url):
-                        logger.info(f"{worker_name} : {cur_url} has been met.")
-                        self.queue.task_done()
-                        continue
-
-            # logger.info(f"{worker_name} : {cur_url} to crawl.")
-
-            _content = self.get_content(cur_url)
-            if _content is None:
-                self.queue.task_done()
-                continue
+            # logger.info(f"{worker_name} : {cur_item.url} to crawl.")
 
-            logger.info(f"{worker_name} : {cur_url} : crawled success.")
-            # mark the url as met
-            self.met_url_bf.add(cur_url)
+            try:
+                self.crawl_item(cur_item, worker_name, cancel_event)
+            finally:
+                self.queue.task_done(cur_item.url)
 
-            if self.strict_filter(cur_url):
-                self.saved_url_bf.add(cur_url)
-                # save the file
-                self.save_file(_content, cur_url)
-                logger.info(f"{worker_name} : {cur_url} : saved.")
-            else:
-                logger.info(f"{worker_name} : {cur_url} : not saved.")
+        logger.info(f"{worker_name} stopped.")
 
+    def crawl_item(self,
+                   cur_item: Frontier.FrontierItem,
+                   worker_name,
+                   cancel_event: Optional[threading.Event] = None,
+                   ):
+        """
+        Fetch a url taken from the queue and process the page.
+        :param cur_item:
+        :param worker_name: for logging.
+        :param cancel_event: if set once the page is fetched, the page is dropped and the url put back to the queue.
+        :return:
+        """
+        cur_url = cur_item.url
+        if self.stream_pages and self.parse_workers <= 0:
+            result, page = self.fetch_streaming(cur_item, worker_name)
+        else:
+            result, page = self.fetch(cur_url, worker_name), None
+        if cancel_event is not None and cancel_event.is_set():
+            logger.info(f"{worker_name} : {cur_url} : abandoned, back to the queue.")
+            self.requeue(cur_item)
+        elif result is not None:
+            self.process_page(cur_url, result.content, worker_name, depth=cur_item.depth, page=page)
+            if self.http_cache is not None:
+                # only once processed, a cached page is never processed again.
+                self.http_cache.update(cur_url, result.content, result.etag, result.last_modified)
+
+    def should_crawl(self, cur_url, worker_name) -> bool:
+        """
+        Decide whether a url popped from the queue is to be fetched.
+        :param cur_url:
+        :param worker_name: for logging.
+        :return:
+        """
+        bypass_bloomfilter_set = bypass_bloomfilter_recipe[self.filter_config]
 
-            # logger.info(f"{worker_name} : {cur_url}, adding urls to the queue.")
-            # add the urls to the queue
-            new_urls = set(request_utils.parse_all_urls(_content, cur_url))
+        # the bloom filter is thread-safe on its own, no need to hold self.lock here.
+        if cur_url not in bypass_bloomfilter_set and self.is_met(cur_url):
+            logger.info(f"{worker_name} : {cur_url} has been met.")
+            return False
 
-            logger.info(f"{worker_name} : {cur_url} : found {len(new_urls)} urls.")
+        return True
 
-            max_insert_count = int(0.1 * self.queue.maxsize)
-            insert_count = 0
+    def requeue(self, item: Frontier.FrontierItem):
+        """
+        Put back a url that was taken from the queue but not crawled.
+        """
+        try:
+            self.queue.put(item.url, block=False, priority=item.priority, depth=item.depth)
+        except queue.Full:
+            logger.info(f"queue is full, {item.url} dropped.")
 
-            for new_url in new_urls:
+    def priority_of(self, url) -> Optional[int]:
+        """
+        The priority of a url in the frontier, None if it is not to be crawled.
+        """
+        if self.strict_filter(url):
+            return ARTICLE_PRIORITY
+        if self.loose_filter(url):
+            return HUB_PRIORITY
+        return None
 
-                # fuck I forgot this until halfway
-                new_url = utils.as_unique_url(new_url)
+    def get_parse_pool(self) -> Optional[concurrent.futures.ProcessPoolExecutor]:
+        """
+        The process pool of the parse stage, started on first use. None without parse_workers.
+        """
+        if self.parse_workers <= 0:
+            return None
+        with self.parse_pool_lock:
+            if self.parse_pool is None:
+                # spawn, as forking a process with running threads may copy held locks.
+                self.parse_pool = concurrent.futures.ProcessPoolExecutor(
+                    max_workers=self.parse_workers, mp_context=multiprocessing.get_context("spawn"))
+            return self.parse_pool
+
+    def close_parse_pool(self,
+                         ):
+        with self.parse_pool_lock:
+            if self.parse_pool is not None:
+                self.parse_pool.shutdown()
+                self.parse_pool = None
+
+    def parse_page(self, cur_url, _content):
+        """
+        The parse stage: the extract of a page, and the urls found in it, normalized and sorted out by the filters.
+        :return: the request_utils.PageExtract, the article urls and the hub urls, see request_utils.parse_page.
+        """
+        parse_pool = self.get_parse_pool()
+        if parse_pool is not None:
+            return parse_pool.submit(request_utils.parse_page_by_config,
+                                     _content, cur_url, self.filter_config).result()
+        page = request_utils.extract_page(_content, cur_url)
+        return (page,) + self.sort_links(page.links)
+
+    def sort_links(self, urls):
+        """
+        Normalize the urls found in a page and sort them out with the filters.
+        :return: the article urls and the hub urls.
+        """
+        if (self.strict_filter is strict_filter_recipe[self.filter_config]
+                and self.loose_filter is loose_filter_recipe[self.filter_config]):
+            # the filters of filter_config have compiled and cached counterparts.
+            return request_utils.sort_links_by_config(urls, self.filter_config)
+        return request_utils.sort_links(urls, self.strict_filter, self.loose_filter)
 
-                if self.met_url_bf.__contains__(new_url):
-                    continue
-                try:
-                    if self.strict_filter(new_url):
-                        self.queue.put(new_url, block=False)
-                        insert_count += 1
-                    elif self.loose_filter(new_url):
-                        # randomly dropout
-                        # the more elements in the queue, the more likely to drop out
-                        # this may change.
-                        _max_size = self.queue.maxsize
-                        _cur_size = self.queue.qsize()
-
-                        _prob = (_cur_size / _max_size) ** 2
-
-                        if np.random.uniform() > _prob:
-                            continue
-                        self.queue.put(new_url, block=False)
-                        insert_count += 1
-                except queue.Full:
-                    pass
-                if insert_count >= max_insert_count:
-                    break
+    def fetch(self, cur_url, worker_name) -> Optional[request_utils.FetchResult]:
+        """
+        Fetch a page, conditionally with conditional_get.
+        :return: the request_utils.FetchResult, None if the fetch failed or the page has not changed
+                 since it was processed.
+        """
+        headers = self.http_cache.validators(cur_url) if self.http_cache is not None else None
+        result = request_utils.fetch(cur_url, self.user_agent, headers=headers)
+        if result is None:
+            return None
+        self.record_transfer(result)
+        if self.http_cache is not None and not self.is_modified(result, worker_name):
+            return None
+        return result
+
+    def record_transfer(self, result: request_utils.FetchResult):
+        with self.transfer_lock:
+            self.wire_bytes += result.wire_bytes
+            self.decoded_bytes += result.decoded_bytes
+
+    def is_modified(self, result: request_utils.FetchResult, worker_name) -> bool:
+        if result.status == 304:
+            logger.info(f"{worker_name} : {result.url} : not modified.")
+            return False
+        if result.content is not None and self.http_cache.is_unchanged(result.url, result.content):
+            logger.info(f"{worker_name} : {result.url} : unchanged.")
+            return False
+        return True
+
+    def fetch_streaming(self, cur_item: Frontier.FrontierItem, worker_name):
+        """
+        Fetch a page chunk by chunk, and enqueue the links found in every chunk right away.
+        :return: the request_utils.FetchResult and the request_utils.PageExtract of the page,
+                 (None, None) if the fetch failed or the page has not changed since it was processed.
+        """
+        cur_url = cur_item.url
+        headers = self.http_cache.validators(cur_url) if self.http_cache is not None else None
+        opened = request_utils.open_content(cur_url, user_agent=self.user_agent, headers=headers)
+        if opened is None:
+            return None, None
+        result, chunks = opened
+        if result.status == 304:
+            self.is_modified(result, worker_name)
+            return None, None
+        extractor = request_utils.PageExtractor(cur_url)
+        content = bytearray()
+        seen_urls = set()
+        try:
+            for chunk in chunks:
+                content += chunk
+                article_urls, hub_urls = self.sort_links(extractor.feed(chunk))
+                article_urls = [url for url in article_urls if url not in seen_urls]
+                hub_urls = [url for url in hub_urls if url not in seen_urls]
+                seen_urls.update(article_urls)
+                seen_urls.update(hub_urls)
+                with self.gate.shared():
+                    self.enqueue_links(cur_url, article_urls, hub_urls, worker_name, depth=cur_item.depth)
+        except request_utils.FETCH_ERRORS as e:
+            # the links enqueued so far stay in the queue, the page is fetched again later.
+            logger.error(f"{worker_name} : {cur_url} : fetch broken off: {type(e).__name__}: {e}")
+            return None, None
+        result = result._replace(content=bytes(content), wire_bytes=chunks.wire_bytes,
+                                 decoded_bytes=chunks.decoded_bytes)
+        self.record_transfer(result)
+        if self.http_cache is not None and not self.is_modified(result, worker_name):
+            # its links were in the queue already.
+            return None, None
+        return result, extractor.close()
+
+    def enqueue_links(self, cur_url, article_urls, hub_urls, worker_name, depth: int = 0):
+        """
+        Add the urls found in a page to the queue, the ones not met yet. Called under the shared side of the gate.
+        :param cur_url: the page, for logging.
+        :param article_urls:
+        :param hub_urls:
+        :param worker_name: for logging.
+        :param depth: the depth of cur_url, the urls found are one deeper.
+        :return:
+        """
+        new_urls = article_urls + hub_urls
+        priorities = [ARTICLE_PRIORITY] * len(article_urls) + [HUB_PRIORITY] * len(hub_urls)
+        if not new_urls:
+            return
+
+        # check the whole page's links against the bloom filter at once.
+        met_mask = self.met_mask(new_urls)
+
+        # add the urls to the queue
+        # when the frontier is full, the lowest priority urls are evicted for higher ones.
+        rejected_count = 0
+        enqueued_items = []
+        for new_url, priority, met in zip(new_urls, priorities, met_mask):
+            if met:
+                continue
+            try:
+                self.queue.put(new_url, block=False, priority=priority, depth=depth + 1)
+                enqueued_items.append(Frontier.FrontierItem(new_url, priority, depth + 1))
+            except queue.Full:
+                rejected_count += 1
+        if self.wal is not None:
+            self.wal.log_enqueue(enqueued_items)
+        if rejected_count:
+            logger.info(f"{worker_name} : {cur_url} : queue is full, {rejected_count} urls rejected.")
+
+    def process_page(self, cur_url, _content, worker_name, depth: int = 0, page=None):
+        """
+        Handle a fetched page: mark it as met, save it if it passes the strict filter,
+        and add the urls found in it to the queue.
+        :param cur_url:
+        :param _content:
+        :param worker_name: for logging.
+        :param depth: the depth of cur_url, the urls found are one deeper.
+        :param page: the request_utils.PageExtract of a page parsed while it was fetched, see fetch_streaming.
+               Its links are in the queue already.
+        :return:
+        """
+        logger.info(f"{worker_name} : {cur_url} : crawled success.")
 
-            delay_ms = np.random.uniform(0.8, 1.2) * self.interval_ms
-            time.sleep(delay_ms / 1000)
+        if page is None:
+            # parse before entering the gate, only the changes to the state need it.
+            page, article_urls, hub_urls = self.parse_page(cur_url, _content)
+            logger.info(f"{worker_name} : {cur_url} : found {len(article_urls) + len(hub_urls)} urls to crawl.")
+        else:
+            article_urls, hub_urls = [], []
 
-            self.queue.task_done()
+        with self.gate.shared():
+            # mark the url as met
+            self.mark_met(cur_url)
+            if self.wal is not None:
+                self.wal.log_fetched(cur_url)
 
-        logger.info(f"{worker_name} stopped.")
+            if self.strict_filter(cur_url):
+                self.saved_url_bf.add(cur_url)
+                # save the file
+                self.save_file(_content, cur_url, title=page.title, sidecar=page._asdict())
+                logger.info(f"{worker_name} : {cur_url} : saved.")
+            else:
+                logger.info(f"{worker_name} : {cur_url} : not saved.")
+
+            self.enqueue_links(cur_url, article_urls, hub_urls, worker_name, depth=depth)
 
     # loading and saving stuff
 
@@ -330,10 +757,29 @@ class Crawler:
             "interval_ms": self.interval_ms,
             "filter_config": self.filter_config,
             "user_agent": self.user_agent,
-            "queue": list(self.queue.queue),
+            "mmap_bloom_filters": self.mmap_bloom_filters,
+            "exact_dedup": self.exact_dedup,
+            "host_interval_ms": self.host_interval_ms,
+            "host_intervals_ms": self.host_intervals_ms,
+            "max_per_host": self.max_per_host,
+            "spill_queue": self.spill_queue,
+            "write_ahead_log": self.write_ahead_log,
+            "parse_workers": self.parse_workers,
+            "stream_pages": self.stream_pages,
+            "conditional_get": self.conditional_get,
+            "segment_storage": self.segment_storage,
+            "content_codec": self.content_codec,
+            "wal_generation": self.wal.generation if self.wal is not None else 0,
+            "spill_checkpoint": self.spill_checkpoint,
+            # the entries saved after this are logged in the generations from wal_generation on.
+            "saved_entry_count": self.saved_content.entry_count(),
+            # the urls in flight are not done yet, they go back to the queue when loading.
+            "queue": [list(item) for item in self.queue.snapshot() + self.queue.in_flight_items()],
+            "queue_spill": self.queue.spill_state() if self.spill_queue else {},
             "met_url_bf": self.met_url_bf,
             "saved_url_bf": self.saved_url_bf,
             "saved_content": self.saved_content,
+            "met_url_store": self.met_url_store,
         }
         return state_dict
 
@@ -343,46 +789,132 @@ class Crawler:
         save the current state to the directory.
         :return:
         """
-        with self.lock:
+        with self.lock, self.gate.exclusive():
             logger.info(f"Saving crawler to {self.directory}")
+            if self.wal is not None:
+                # the records from now on go to the new generation, the older ones are covered by this save.
+                self.wal.rotate()
             state_dict = self.as_state_dict()
             state_dict_to_save = {k: v for k, v in state_dict.items()
-                                  if k not in ("met_url_bf", "saved_url_bf", "saved_content")}
-            with open(osp.join(self.directory, "CrawlerParams.json"), "w") as f:
-                json.dump(state_dict_to_save, f)
+                                  if k not in ("met_url_bf", "saved_url_bf", "saved_content", "met_url_store")}
+            if self.spill_queue:
+                # the workers keep reading from and appending to spill.bin after the save, keep a copy of it
+                # as it is now. a new file each time, the previous one stays valid until CrawlerParams.json is.
+                spill_checkpoint = self.spill_checkpoint + 1
+                state_dict_to_save["queue_spill"] = self.queue.copy_spill_to(
+                    self.spill_checkpoint_path(self.directory, spill_checkpoint))
+                state_dict_to_save["spill_checkpoint"] = spill_checkpoint
 
             self.met_url_bf.save_to(osp.join(self.directory, "met_urls"))
             self.saved_url_bf.save_to(osp.join(self.directory, "saved_urls"))
+            if self.met_url_store is not None:
+                self.met_url_store.save_to(self.met_url_store_dir)
+            if self.http_cache is not None:
+                self.http_cache.save_to(osp.join(self.directory, "http_cache"))
             self.saved_content.save()
+
+            # the checkpoint is CrawlerParams.json, written last and atomically: until it is replaced, a crash
+            # recovers from the previous one and replays the generations since, which the components saved
+            # above may already hold. replaying a record twice does no harm.
+            params_path = osp.join(self.directory, "CrawlerParams.json")
+            with open(params_path + ".tmp", "w") as f:
+                json.dump(state_dict_to_save, f)
+            os.replace(params_path + ".tmp", params_path)
+            if self.spill_queue:
+                if self.spill_checkpoint:
+                    os.remove(self.spill_checkpoint_path(self.directory, self.spill_checkpoint))
+                self.spill_checkpoint = state_dict_to_save["spill_checkpoint"]
+            if self.wal is not None:
+                self.wal_checkpoint_generation = self.wal.generation
+                self.wal_checkpoint_entry_count = state_dict_to_save["saved_entry_count"]
+                self.wal.remove_before(self.wal.generation)
             logger.info(f"Completed Saving crawler to {self.directory}")
 
     def make_snapshot(self,
                       snapshot_name: str,
+                      background: bool = False,
                       ):
         """
-
+        Copy the state in memory under the gate, then write it to snapshots/{snapshot_name}.
+        The workers may keep running meanwhile.
+        :param snapshot_name:
+        :param background: write the snapshot in a background thread, see wait_for_snapshot.
         :return:
         """
         logger.info(f"Making snapshot {snapshot_name}")
-        snapshot_dir = osp.join(self.directory, "snapshots")
-        snapshot_inner_dir = osp.join(snapshot_dir, snapshot_name)
+        # one snapshot at a time.
+        self.wait_for_snapshot()
+        snapshot_inner_dir = osp.join(self.directory, "snapshots", snapshot_name)
         os.makedirs(snapshot_inner_dir, exist_ok=True)
-        with self.lock:
+        state_dict = self.capture_state(snapshot_inner_dir)
+        if background:
+            self.snapshot_thread = threading.Thread(target=self.write_snapshot, args=(state_dict, snapshot_name),
+                                                    name="snapshot")
+            self.snapshot_thread.start()
+        else:
+            self.write_snapshot(state_dict, snapshot_name)
+
+    def capture_state(self,
+                      snapshot_inner_dir: str,
+                      ) -> dict:
+        """
+        A consistent copy of the state, in memory but for the spill file, which is copied into snapshot_inner_dir.
+        The gate is held for as long as the copies take, no page is processed meanwhile.
+        :param snapshot_inner_dir:
+        :return: a state_dict, with copies of the bloom filters, the FileSet and the FingerprintSet.
+        """
+        start_time = time.time()
+        with self.lock, self.gate.exclusive():
             state_dict = self.as_state_dict()
-            state_dict_to_save = {k: v for k, v in state_dict.items()
-                                  if k not in ("met_url_bf", "saved_url_bf", "saved_content")}
-            with open(osp.join(snapshot_inner_dir, "CrawlerParams.json"), "w") as f:
-                json.dump(state_dict_to_save, f)
+            if self.spill_queue:
+                state_dict["queue_spill"] = self.queue.copy_spill_to(osp.join(snapshot_inner_dir, "frontier", "spill.bin"))
+                state_dict["spill_checkpoint"] = 0
+            state_dict["met_url_bf"] = self.met_url_bf.copy()
+            state_dict["saved_url_bf"] = self.saved_url_bf.copy()
+            state_dict["saved_content"] = self.saved_content.frozen_copy()
+            if self.met_url_store is not None:
+                state_dict["met_url_store"] = self.met_url_store.copy()
+        logger.info(f"Captured the state in {time.time() - start_time:.3f} seconds.")
+        return state_dict
+
+    def write_snapshot(self,
+                       state_dict: dict,
+                       snapshot_name: str,
+                       ):
+        """
+        Write a state captured by capture_state to snapshots/{snapshot_name}.
+        :param state_dict:
+        :param snapshot_name:
+        :return:
+        """
+        snapshot_inner_dir = osp.join(self.directory, "snapshots", snapshot_name)
+        state_dict_to_save = {k: v for k, v in state_dict.items()
+                              if k not in ("met_url_bf", "saved_url_bf", "saved_content", "met_url_store")}
+        with open(osp.join(snapshot_inner_dir, "CrawlerParams.json"), "w") as f:
+            json.dump(state_dict_to_save, f)
 
-            self.met_url_bf.save_to(osp.join(snapshot_inner_dir, "met_urls"))
-            self.saved_url_bf.save_to(osp.join(snapshot_inner_dir, "saved_urls"))
+        state_dict["met_url_bf"].save_to(osp.join(snapshot_inner_dir, "met_urls"))
+        state_dict["saved_url_bf"].save_to(osp.join(snapshot_inner_dir, "saved_urls"))
+        if state_dict["met_url_store"] is not None:
+            state_dict["met_url_store"].save_to(osp.join(snapshot_inner_dir, "met_urls_exact"))
 
-            self.saved_content.make_snapshot(version_name=snapshot_name)
+        state_dict["saved_content"].make_snapshot(version_name=snapshot_name)
 
         logger.info(f"Completed making snapshot {snapshot_name}")
 
-    @staticmethod
+    def wait_for_snapshot(self,
+                          ):
+        """
+        Wait for the snapshot being written in the background, if any.
+        :return:
+        """
+        if self.snapshot_thread is not None:
+            self.snapshot_thread.join()
+            self.snapshot_thread = None
+
+    @classmethod
     def load(
+            cls,
             path: str,
     ):
         """
@@ -395,21 +927,21 @@ class Crawler:
         with open(osp.join(path, "CrawlerParams.json"), "r") as f:
             state_dict = json.load(f)
 
-        # state_dict["queue"] now is a list. convert it to a queue.Queue.
-        _queue = queue.Queue(maxsize=state_dict["max_queue_size"])
-        for url in state_dict["queue"]:
-            _queue.put(url)
+        mmap = state_dict.get("mmap_bloom_filters", False)
+        state_dict["met_url_bf"] = bf.BloomFilter.load_from(osp.join(path, "met_urls"), mmap=mmap)
+        state_dict["saved_url_bf"] = bf.BloomFilter.load_from(osp.join(path, "saved_urls"), mmap=mmap)
+        # the entries saved are not read, only the number of them. see replay_wal for the ones it needs.
+        state_dict["saved_content"] = fs.FileSet.load_from(osp.join(path, "saved_files"), mode="append")
+        if state_dict.get("exact_dedup", False):
+            state_dict["met_url_store"] = fps.FingerprintSet.load_from(osp.join(path, "met_urls_exact"))
+        if osp.exists(osp.join(path, "http_cache")):
+            state_dict["http_cache"] = hc.HttpCache.load_from(osp.join(path, "http_cache"))
 
-        state_dict["queue"] = _queue
+        return cls(state_dict=state_dict)
 
-        state_dict["met_url_bf"] = bf.BloomFilter.load_from(osp.join(path, "met_urls"))
-        state_dict["saved_url_bf"] = bf.BloomFilter.load_from(osp.join(path, "saved_urls"))
-        state_dict["saved_content"] = fs.FileSet.load_from(osp.join(path, "saved_files"), mode="append-full-load")
-
-        return Crawler(state_dict=state_dict)
-
-    @staticmethod
+    @classmethod
     def load_snapshot(
+            cls,
             path: str,
             snapshot_name: str,
     ):
@@ -425,15 +957,6 @@ class Crawler:
         with open(osp.join(snapshot_inner_dir, "CrawlerParams.json"), "r") as f:
             state_dict = json.load(f)
 
-        # state_dict["queue"] now is a list. convert it to a queue.Queue.
-        _queue = queue.Queue(maxsize=state_dict["max_queue_size"])
-        for url in state_dict["queue"]:
-            _queue.put(url)
-
-        state_dict["queue"] = _queue
-
-        state_dict["met_url_bf"] = bf.BloomFilter.load_from(osp.join(snapshot_inner_dir, "met_urls"))
-        state_dict["saved_url_bf"] = bf.BloomFilter.load_from(osp.join(snapshot_inner_dir, "saved_urls"))
         state_dict["saved_content"] = fs.FileSet.load_from_snapshot(snapshot_name, osp.join(path, "saved_files"))
 
         # replace the followings with what's in the snapshot
@@ -442,9 +965,35 @@ class Crawler:
         # | saved_urls/ (BloomFilter)
         shutil.copyfile(osp.join(snapshot_inner_dir, "CrawlerParams.json"), osp.join(path, "CrawlerParams.json"))
         shutil.rmtree(osp.join(path, "met_urls"))
-        shutil.copytree(osp.join(snapshot_inner_dir, "met_urls"), osp.join(path, "met_urls"))
+        shutil.copytree(osp.join(snapshot_inner_dir, "met_urls"), osp.join(path, "met_urls"),
+                        copy_function=utils.clone_file)
         shutil.rmtree(osp.join(path, "saved_urls"))
-        shutil.copytree(osp.join(snapshot_inner_dir, "saved_urls"), osp.join(path, "saved_urls"))
+        shutil.copytree(osp.join(snapshot_inner_dir, "saved_urls"), osp.join(path, "saved_urls"),
+                        copy_function=utils.clone_file)
+        if state_dict.get("exact_dedup", False):
+            shutil.rmtree(osp.join(path, "met_urls_exact"), ignore_errors=True)
+            shutil.copytree(osp.join(snapshot_inner_dir, "met_urls_exact"), osp.join(path, "met_urls_exact"),
+                            copy_function=utils.clone_file)
+        if state_dict.get("spill_queue", False):
+            # the copy in the snapshot becomes the checkpoint of the spill file, which is reopened from it.
+            shutil.rmtree(osp.join(path, "frontier"), ignore_errors=True)
+            os.makedirs(osp.join(path, "frontier"), exist_ok=True)
+            state_dict["spill_checkpoint"] = 1
+            utils.clone_file(osp.join(snapshot_inner_dir, "frontier", "spill.bin"),
+                             cls.spill_checkpoint_path(path, 1))
+            with open(osp.join(path, "CrawlerParams.json"), "w") as f:
+                json.dump({k: v for k, v in state_dict.items() if k != "saved_content"}, f)
+        # the log describes what happened after the latest save, not after the snapshot.
+        shutil.rmtree(osp.join(path, "wal"), ignore_errors=True)
+        # the cache would skip pages whose links the snapshot has not seen. start over with an empty one.
+        shutil.rmtree(osp.join(path, "http_cache"), ignore_errors=True)
+
+        # load the bloom filters from the copies, a memory-mapped filter must not write into the snapshot.
+        mmap = state_dict.get("mmap_bloom_filters", False)
+        state_dict["met_url_bf"] = bf.BloomFilter.load_from(osp.join(path, "met_urls"), mmap=mmap)
+        state_dict["saved_url_bf"] = bf.BloomFilter.load_from(osp.join(path, "saved_urls"), mmap=mmap)
+        if state_dict.get("exact_dedup", False):
+            state_dict["met_url_store"] = fps.FingerprintSet.load_from(osp.join(path, "met_urls_exact"))
 
         # clear newer snapshots
         snapshot_folders = os.listdir(snapshot_dir)
@@ -452,7 +1001,82 @@ class Crawler:
             if folder > snapshot_name:
                 shutil.rmtree(osp.join(snapshot_dir, folder))
 
-        return Crawler(state_dict=state_dict)
+        return cls(state_dict=state_dict)
+
+    @classmethod
+    def recover(
+            cls,
+            path: str,
+    ):
+        """
+        Load the crawler from the directory after a crash: load the last save and replay the write-ahead log since.
+        :param path:
+        :return:
+        """
+        crawler = cls.load(path)
+        if crawler.wal is None:
+            return crawler
+        start_time = time.time()
+        record_count = crawler.replay_wal()
+        logger.info(f"Replayed {record_count} records of the write-ahead log in {time.time() - start_time:.3f} seconds.")
+        return crawler
+
+    def replay_wal(self,
+                   ) -> int:
+        """
+        Apply the records logged since the last save. Replaying a record twice does no harm.
+        :return: the number of records replayed.
+        """
+        # the SAVED records may already be in the FileSet, saved after the checkpoint. only the entries past it
+        # are read to tell, not the whole FileSet.
+        recorded_filenames = {entry.content_filename
+                              for entry in self.saved_content.entries_from(self.wal_checkpoint_entry_count)}
+        record_count = 0
+        for record in wal.read_records(self.wal_dir, from_generation=self.wal_checkpoint_generation):
+            if record.type == wal.ENQUEUE:
+                try:
+                    self.queue.put(record.value.url, block=False, priority=record.value.priority,
+                                   depth=record.value.depth)
+                except queue.Full:
+                    pass
+            elif record.type == wal.FETCHED:
+                self.mark_met(record.value)
+            elif record.type == wal.SAVED:
+                if record.value.content_filename not in recorded_filenames:
+                    recorded_filenames.add(record.value.content_filename)
+                    self.saved_url_bf.add(record.value.url)
+                    self.saved_content.record(record.value)
+            record_count += 1
+        return record_count
+
+    # met-check stuff
+
+    def is_met(self, url) -> bool:
+        """
+        Whether the url has been crawled.
+        With exact_dedup, a "maybe" from the bloom filter is confirmed against the FingerprintSet.
+        """
+        if not self.met_url_bf.__contains__(url):
+            return False
+        if self.met_url_store is None:
+            return True
+        return url in self.met_url_store
+
+    def met_mask(self, urls) -> np.ndarray:
+        """
+        is_met for a batch of urls.
+        :return: a bool array.
+        """
+        mask = self.met_url_bf.contains_many(urls)
+        if self.met_url_store is not None and mask.any():
+            maybe_met = [url for url, met in zip(urls, mask) if met]
+            mask[mask] = self.met_url_store.contains_many(maybe_met)
+        return mask
+
+    def mark_met(self, url):
+        self.met_url_bf.add(url)
+        if self.met_url_store is not None:
+            self.met_url_store.add(url)
 
     # web request stuff
 
@@ -467,13 +1091,19 @@ class Crawler:
                   url: str,
                   title: str = None,
                   download_time: str = None,
+                  sidecar: Optional[dict] = None,
                   ):
-        _title = title if title is not None else "Untitled"
+        """
+        :param sidecar: what was extracted from the content, see fs.FileSet.read_sidecar.
+        """
+        _title = title if title else "Untitled"
         _download_time = download_time if download_time is not None else fs.get_timestamp_string()
         entry = fs.as_insert_entry(content, url, _title, _download_time)
-        self.saved_content.insert(entry)
+        recorded_entry = self.saved_content.insert(entry, sidecar=sidecar)
+        if self.wal is not None:
+            self.wal.log_saved(recorded_entry)
 
     # status stuff
     def file_count(self,
                    ):
-        return self.saved_content.recorded_entries.__len__()
+        return self.saved_content.entry_count()
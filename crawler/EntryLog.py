@@ -0,0 +1,314 @@
+"""
+An append-only log of the entries of a FileSet, in place of FileSetEntries.json.
+
+A save only appends the entries inserted since the last one, and opening the log reads nothing but its size:
+the entries are read when asked for, by their index.
+
+- the heap holds the entries one after the other, each as a json list like the SAVED records of the
+  WriteAheadLog.
+- the index holds a fixed-size slot per entry: where its record is in the heap, its length and its crc32.
+  The i-th slot is at a known offset, so any entry is found without reading the ones before it.
+
+The heap is written before the index. An index slot whose record is not in the heap, e.g. after a crash
+between the two writes, is dropped when the log is opened.
+
+EntryLogView reads the log through memory maps, without reading every entry, e.g. for FileSet.FileSetReader.
+
+The FileSet records how many entries it has saved, the watermark. A snapshot of the FileSet is just such a
+watermark, and rolling back to it truncates the log, see truncate.
+
+File structure:
+| FileSetEntries.idx: | magic | version (uint32) | then per entry: | heap offset (uint64) | length (uint32) | crc32 (uint32) |
+| FileSetEntries.heap: the records, back to back.
+"""
+import json
+import mmap
+import os
+import os.path as osp
+import struct
+import threading
+import zlib
+from typing import Iterator, List, Optional, Sequence
+
+import numpy as np
+
+MAGIC = b"FSEI"
+VERSION = 1
+INDEX_HEADER = struct.Struct("<4sI")
+INDEX_SLOT = struct.Struct("<QII")
+# the index slots as a numpy structured array, e.g. to memory-map them.
+INDEX_DTYPE = np.dtype([("offset", "<u8"), ("length", "<u4"), ("crc", "<u4")])
+
+
+def index_filename(name: str = "FileSetEntries") -> str:
+    return f"{name}.idx"
+
+
+def heap_filename(name: str = "FileSetEntries") -> str:
+    return f"{name}.heap"
+
+
+def exists(directory: str, name: str = "FileSetEntries") -> bool:
+    return osp.exists(osp.join(directory, index_filename(name)))
+
+
+def encode_entry(entry) -> bytes:
+    return json.dumps(list(entry), ensure_ascii=False).encode("utf-8")
+
+
+def valid_count(index_size: int, heap_size: int, read_slot) -> int:
+    """
+    The number of entries whose slot is complete and whose record is in the heap.
+    :param index_size:
+    :param heap_size:
+    :param read_slot: index -> (offset, length, crc) of the slot.
+    :return:
+    """
+    count = max(index_size - INDEX_HEADER.size, 0) // INDEX_SLOT.size
+    while count > 0:
+        offset, length, _ = read_slot(count - 1)
+        if offset + length <= heap_size:
+            break
+        count -= 1
+    return count
+
+
+class EntryLog:
+
+    def __init__(self,
+                 directory: str,
+                 entry_class: Optional[type] = None,
+                 count: Optional[int] = None,
+                 name: str = "FileSetEntries",
+                 ):
+        """
+        Open the log in directory, or start an empty one.
+        :param directory:
+        :param entry_class: what the entries read are made into, e.g. FileSet.FileSetRecordedEntry. Tuples if None.
+        :param count: the number of entries to keep, e.g. the watermark of the last save.
+               The entries past it are ignored, and cut off by the first append. None to keep all the valid ones.
+        :param name: of the files.
+        """
+        self.directory = directory
+        self.entry_class = entry_class
+        self.index_path = osp.join(directory, index_filename(name))
+        self.heap_path = osp.join(directory, heap_filename(name))
+        self.lock = threading.Lock()
+
+        if not osp.exists(self.index_path):
+            os.makedirs(directory, exist_ok=True)
+            with open(self.index_path, "wb") as f:
+                f.write(INDEX_HEADER.pack(MAGIC, VERSION))
+            open(self.heap_path, "wb").close()
+        with open(self.index_path, "rb") as f:
+            magic, version = INDEX_HEADER.unpack(f.read(INDEX_HEADER.size))
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{self.index_path} is not an entry log of version {VERSION}")
+
+        valid = valid_count(osp.getsize(self.index_path), osp.getsize(self.heap_path), self._read_slot)
+        if count is not None and count > valid:
+            raise ValueError(f"{self.index_path} holds {valid} entries, fewer than {count}")
+        self.count = valid if count is None else count
+        # whether the files may hold more than count entries, to cut off before appending.
+        self._has_tail = True
+
+    def _read_slot(self, i: int):
+        with open(self.index_path, "rb") as f:
+            f.seek(INDEX_HEADER.size + i * INDEX_SLOT.size)
+            return INDEX_SLOT.unpack(f.read(INDEX_SLOT.size))
+
+    def __len__(self):
+        return self.count
+
+    def __str__(self):
+        return f"EntryLog(directory={self.directory}, count={self.count})"
+
+    __repr__ = __str__
+
+    def _heap_end(self, count: int) -> int:
+        if count == 0:
+            return 0
+        offset, length, _ = self._read_slot(count - 1)
+        return offset + length
+
+    def truncate(self, count: int):
+        """
+        Cut the log back to its first count entries, e.g. to roll back to a snapshot.
+        """
+        with self.lock:
+            if count > self.count:
+                raise ValueError(f"Cannot truncate {self} to {count} entries")
+            os.truncate(self.heap_path, self._heap_end(count))
+            os.truncate(self.index_path, INDEX_HEADER.size + count * INDEX_SLOT.size)
+            self.count = count
+            self._has_tail = False
+
+    def append(self, entries: Sequence):
+        """
+        Append entries to the log, with a single write to each file.
+        """
+        with self.lock:
+            self._append(entries)
+
+    def _append(self, entries: Sequence):
+        if self._has_tail:
+            heap_end = self._heap_end(self.count)
+            os.truncate(self.heap_path, heap_end)
+            os.truncate(self.index_path, INDEX_HEADER.size + self.count * INDEX_SLOT.size)
+            self._has_tail = False
+        if not entries:
+            return
+        heap_end = osp.getsize(self.heap_path)
+        records = [encode_entry(entry) for entry in entries]
+        slots = []
+        for record in records:
+            slots.append(INDEX_SLOT.pack(heap_end, len(record), zlib.crc32(record)))
+            heap_end += len(record)
+        with open(self.heap_path, "ab") as f:
+            f.write(b"".join(records))
+        with open(self.index_path, "ab") as f:
+            f.write(b"".join(slots))
+        self.count += len(entries)
+
+    def sync(self, entries: Sequence, base_count: int = 0):
+        """
+        Append the entries not in the log yet.
+        :param entries: the entries from base_count on, some of them may be in the log already.
+               e.g. the recorded entries of a FileSet, or of a frozen copy of it sharing its log.
+        :param base_count: the index of entries[0] in the log.
+        :return: the number of entries appended.
+        """
+        with self.lock:
+            start = self.count - base_count
+            if start < 0:
+                raise ValueError(f"{self} is missing entries before index {base_count}")
+            new_entries = entries[start:]
+            self._append(new_entries)
+            return len(new_entries)
+
+    def read(self, i: int):
+        """
+        :return: the i-th entry.
+        """
+        if not 0 <= i < self.count:
+            raise IndexError(f"Entry {i} out of range of {self}")
+        offset, length, crc = self._read_slot(i)
+        with open(self.heap_path, "rb") as f:
+            f.seek(offset)
+            record = f.read(length)
+        if zlib.crc32(record) != crc:
+            raise ValueError(f"Corrupted entry {i} of {self}")
+        return self._make(json.loads(record))
+
+    def _make(self, fields):
+        return self.entry_class(*fields) if self.entry_class is not None else tuple(fields)
+
+    def read_all(self, start: int = 0) -> List:
+        """
+        The entries from start on, reading each file once.
+        """
+        count = self.count
+        with open(self.index_path, "rb") as f:
+            f.seek(INDEX_HEADER.size + start * INDEX_SLOT.size)
+            slots = np.frombuffer(f.read((count - start) * INDEX_SLOT.size), dtype=INDEX_DTYPE)
+        if len(slots) == 0:
+            return []
+        with open(self.heap_path, "rb") as f:
+            f.seek(int(slots["offset"][0]))
+            heap = f.read(int(slots["offset"][-1] + slots["length"][-1] - slots["offset"][0]))
+        base = int(slots["offset"][0])
+        entries = []
+        for i, (offset, length, crc) in enumerate(slots.tolist()):
+            record = heap[offset - base:offset - base + length]
+            if zlib.crc32(record) != crc:
+                raise ValueError(f"Corrupted entry {start + i} of {self}")
+            entries.append(self._make(json.loads(record)))
+        return entries
+
+    def __iter__(self) -> Iterator:
+        return iter(self.read_all())
+
+
+def _map_file(path: str) -> Optional[mmap.mmap]:
+    """
+    A read-only memory map of the whole file, None if it is empty.
+    """
+    if osp.getsize(path) == 0:
+        return None
+    with open(path, "rb") as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+class EntryLogView:
+    """
+    A read-only view of an entry log through memory maps of its files, e.g. while a FileSet keeps appending to it.
+    It holds the entries there were when it was opened or last refreshed. Opening it reads no entry.
+    It must not be used while the log is truncated, e.g. rolled back to a snapshot.
+    """
+
+    def __init__(self,
+                 directory: str,
+                 entry_class: Optional[type] = None,
+                 name: str = "FileSetEntries",
+                 ):
+        self.directory = directory
+        self.entry_class = entry_class
+        self.index_path = osp.join(directory, index_filename(name))
+        self.heap_path = osp.join(directory, heap_filename(name))
+        self.lock = threading.Lock()
+        if not osp.exists(self.index_path):
+            raise FileNotFoundError(f"File {self.index_path} not found!")
+        with open(self.index_path, "rb") as f:
+            magic, version = INDEX_HEADER.unpack(f.read(INDEX_HEADER.size))
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{self.index_path} is not an entry log of version {VERSION}")
+        self.slots = np.zeros(0, dtype=INDEX_DTYPE)
+        self._heap_map = None
+        self.refresh()
+
+    def refresh(self) -> int:
+        """
+        Map the files again, to see the entries appended since.
+        :return: the number of entries.
+        """
+        with self.lock:
+            index_map = _map_file(self.index_path)
+            heap_map = _map_file(self.heap_path)
+            slot_count = (len(index_map) - INDEX_HEADER.size) // INDEX_SLOT.size
+            slots = np.frombuffer(index_map, dtype=INDEX_DTYPE, count=slot_count, offset=INDEX_HEADER.size)
+            count = valid_count(len(index_map), len(heap_map) if heap_map is not None else 0,
+                                lambda i: slots[i].item())
+            # the maps stay open for as long as the arrays and the views of the readers refer to them.
+            self.slots = slots[:count]
+            self._heap_map = heap_map
+            return count
+
+    def __len__(self):
+        return len(self.slots)
+
+    def __str__(self):
+        return f"EntryLogView(directory={self.directory}, count={len(self)})"
+
+    __repr__ = __str__
+
+    def read(self, i: int):
+        slots, heap_map = self.slots, self._heap_map
+        offset, length, crc = slots[i].item()
+        record = heap_map[offset:offset + length]
+        if zlib.crc32(record) != crc:
+            raise ValueError(f"Corrupted entry {i} of {self}")
+        fields = json.loads(record)
+        return self.entry_class(*fields) if self.entry_class is not None else tuple(fields)
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return [self.read(i) for i in range(*item.indices(len(self)))]
+        if item < 0:
+            item += len(self)
+        if not 0 <= item < len(self):
+            raise IndexError(f"Entry {item} out of range of {self}")
+        return self.read(item)
+
+    def __iter__(self) -> Iterator:
+        for i in range(len(self)):
+            yield self.read(i)
@@ -5,7 +5,7 @@ import json
 import sys
 import time
 import datetime
-from typing import List
+from typing import List, Optional
 
 import loguru
 
@@ -13,6 +13,11 @@ import numpy as np
 import threading
 from collections import namedtuple
 
+import ContentCodec as cc
+import EntryLog as el
+import SegmentStore as ss
+import UrlIndex as ui
+
 # use loguru to log
 logger = loguru.logger
 
@@ -22,7 +27,12 @@ FileSetInsertEntry = namedtuple(
 )
 FileSetRecordedEntry = namedtuple(
     'FileSetRecordedEntry',
-    ['content_filename', 'url', 'title', 'download_time']
+    ['content_filename', 'url', 'title', 'download_time', 'codec', 'sidecar_location'],
+    # codec: the codec the content is stored with, see ContentCodec. None for the raw content,
+    # as for the entries recorded before there were codecs.
+    # sidecar_location: where the sidecar record is in the segments, with the 'segments' storage.
+    # None for no sidecar, or one in its own file under sidecars/.
+    defaults=(None, None)
 )
 
 
@@ -52,7 +62,48 @@ def as_insert_entry(content, url, title, download_time):
                               download_time=download_time)
 
 
-class FileSet:
+class _ContentAccess:
+    """
+    Reading the contents and the sidecars of the entries, for FileSet and FileSetReader.
+    """
+    directory: str
+    segments: ss.SegmentStore
+    dictionaries: cc.DictionaryStore
+
+    def read_content(self, recorded_entry: FileSetRecordedEntry) -> bytes:
+        """
+        The content of an entry, from its own file or from a segment, decompressed.
+        :param recorded_entry:
+        :return:
+        """
+        if ss.is_segment_location(recorded_entry.content_filename):
+            data = self.segments.read(recorded_entry.content_filename)
+        else:
+            with open(osp.join(self.directory, "contents", recorded_entry.content_filename), "rb") as f:
+                data = f.read()
+        codec, dictionary_id = cc.split_codec(recorded_entry.codec)
+        dictionary = self.dictionaries.get(dictionary_id) if dictionary_id is not None else None
+        return cc.decompress(data, codec, dictionary)
+
+    def _sidecar_path(self, content_filename: str) -> str:
+        return osp.join(self.directory, "sidecars", f"{content_filename}.json")
+
+    def read_sidecar(self, recorded_entry: FileSetRecordedEntry) -> Optional[dict]:
+        """
+        The sidecar record inserted with an entry.
+        :param recorded_entry:
+        :return: None if the entry was inserted without one.
+        """
+        if recorded_entry.sidecar_location is not None:
+            return json.loads(self.segments.read(recorded_entry.sidecar_location))
+        sidecar_path = self._sidecar_path(recorded_entry.content_filename)
+        if not osp.exists(sidecar_path):
+            return None
+        with open(sidecar_path, "r") as f:
+            return json.load(f)
+
+
+class FileSet(_ContentAccess):
     """
     A set-like data structure that stores data in files.
 
@@ -60,33 +111,62 @@ class FileSet:
     and several small fields of data (time, title, etc.).
 
     the big file will be given a unique name,
-    and the filename, together with other fields, will be stored in a json file.
+    and the filename, together with other fields, will be stored in an append-only entry log, see EntryLog.
 
     Feature:
         1. support multi-threading insert
         2. support saving and loading
 
+    The large files are stored by one of two backends, the storage of the FileSet:
+    - 'files': each in a file of its own under contents/, the content_filename of an entry is its filename.
+    - 'segments': appended to large segment files under segments/, see SegmentStore.
+      the content_filename of an entry is the location of its content, e.g. "segment-000000.seg@0+20480".
+    read_content reads the content of an entry whatever the backend.
+
+    With the 'segments' storage, the contents may be compressed, by the codec of the FileSet, see ContentCodec.
+    The files of the 'files' storage stay plain html. The codec is recorded with each entry, read_content decompresses the content with it. With a codec using a dictionary, the dictionary
+    is trained from the first dictionary_samples contents, the contents before are compressed without one.
+
+    get_by_url finds the latest entry of a url without scanning the entries, see UrlIndex.
+
     File structure by default:
     | FileSet.json: the parameters of the FileSet.
     |
-    | FileSetEntries.json: the entries of the FileSet.
+    | FileSetEntries.idx, FileSetEntries.heap: the entries of the FileSet, see EntryLog.
+    |
+    | url_index/: the entries by url, see UrlIndex.
+    |
+    | dictionaries/: the compression dictionaries, see ContentCodec.
     |
-    | contents/: the directory that contains the large files.
+    | contents/: the directory that contains the large files, with the 'files' storage.
     | | xxx.html: the large file.
     | | ...
     |
+    | segments/: the segment files, with the 'segments' storage.
+    | | segment-000000.seg
+    | | ...
+    |
+    | sidecars/: what was extracted from the large files, so that they need not be parsed again, with the 'files'
+    | |          storage. With the 'segments' storage, the sidecar records are in the segments, after their contents.
+    | | xxx.html.json: the sidecar record of contents/xxx.html, a json dict. Only for the entries inserted with one.
+    | | ...
+    |
     | snapshots/: the directory that contains the snapshots.
       | some_snapshot_name/: the directory that contains the snapshot.
-        | FileSet.json: the parameters of the FileSet.
-        | FileSetEntries.json: the entries of the FileSet.
+        | FileSet.json: the parameters of the FileSet, with the number of entries in the log at the snapshot.
 
+    A FileSet saved before the entry log, with a FileSetEntries.json, is moved to a log when loaded.
     """
 
     def __init__(self,
                  directory: str = None,
                  insert_entry_class: type = FileSetInsertEntry,
                  state_dict=None,
-                 mode='append'
+                 mode='append',
+                 storage='files',
+                 segment_size: int = ss.DEFAULT_SEGMENT_SIZE,
+                 codec='raw',
+                 dictionary_samples: int = 64,
                  ):
         """
 
@@ -97,10 +177,14 @@ class FileSet:
                 Otherwise, it will be defaulted to 'overwrite' i.e. initialize a new FileSet.
                 'append', 'append-full-load' or 'overwrite'
                 'append' means that the FileSet will not load the existing entries into memory when initialized,
-                and will update the json file with the new entries when the FileSet is saved.
+                and will append the new entries to the entry log when the FileSet is saved.
                 'append-full-load' means that the FileSet will load the existing entries into memory when initialized.
                 'overwrite' means that the FileSet will overwrite the json file, clearing all existing entries and contents.
                 This is actually the same as initializing a new FileSet with the same directory.
+        :param storage: 'files' or 'segments', where the contents are stored. Only for a new FileSet.
+        :param segment_size: the size of the segment files, with the 'segments' storage.
+        :param codec: how the contents are compressed, one of ContentCodec.CODECS. Only 'raw' with the 'files' storage.
+        :param dictionary_samples: the number of contents a dictionary is trained from, with a -dict codec.
         """
         self.lock = threading.Lock()
         self.insert_entry_class = insert_entry_class
@@ -111,21 +195,112 @@ class FileSet:
             self.directory = state_dict['directory']
             self.recorded_entries = state_dict['recorded_entries']
             self.filename_counter = state_dict['filename_counter']
+            # the entries in the log before recorded_entries[0], i.e. not loaded in 'append' mode.
+            self.base_count = state_dict.get('base_count', 0)
+            self.entry_log = state_dict.get('entry_log')
+            self.url_index = state_dict.get('url_index')
+            # saved before there were segments.
+            self.storage = state_dict.get('storage', 'files')
+            self.segment_size = state_dict.get('segment_size', ss.DEFAULT_SEGMENT_SIZE)
+            # saved before there were codecs.
+            self.codec = state_dict.get('codec', 'raw')
+            self.dictionary_samples = state_dict.get('dictionary_samples', 64)
+            self.dictionary_id = state_dict.get('dictionary_id')
         else:
+            if storage not in ['files', 'segments']:
+                raise ValueError(f"Invalid storage {storage}")
+            cc.check_codec(codec)
+            if codec != 'raw' and storage != 'segments':
+                # contents/xxx.html must stay html for whatever opens them.
+                raise ValueError(f"The codec {codec} needs the 'segments' storage")
             self.directory = directory
             self.recorded_entries: List[FileSetRecordedEntry] = []
             self.filename_counter = 0
+            self.base_count = 0
+            self.entry_log = None
+            self.url_index = None
+            self.storage = storage
+            self.segment_size = segment_size
+            self.codec = codec
+            self.dictionary_samples = dictionary_samples
+            self.dictionary_id = None
             self._clear_and_init_directory()
 
+        if self.entry_log is None:
+            self.entry_log = el.EntryLog(self.directory, entry_class=FileSetRecordedEntry, count=self.base_count)
+
+        # also with the 'files' storage, it opens nothing until used.
+        self.segments = ss.SegmentStore(osp.join(self.directory, "segments"), self.segment_size)
+        self.dictionaries = cc.DictionaryStore(osp.join(self.directory, "dictionaries"))
+        # the contents collected to train the dictionary from, not saved.
+        self._dictionary_samples_collected: List[bytes] = []
+
+        if self.url_index is None:
+            url_index_dir = osp.join(self.directory, "url_index")
+            if osp.exists(osp.join(url_index_dir, "UrlIndex.json")):
+                self.url_index = ui.UrlIndex.load_from(url_index_dir)
+            else:
+                # a new FileSet, or one saved before it had a url index.
+                self.url_index = ui.UrlIndex(url_index_dir)
+            self._catch_up_url_index()
+
     def as_state_dict(self):
         return {
             'directory': self.directory,
             'recorded_entries': self.recorded_entries,
-            'filename_counter': self.filename_counter
+            'filename_counter': self.filename_counter,
+            'storage': self.storage,
+            'segment_size': self.segment_size,
+            'codec': self.codec,
+            'dictionary_samples': self.dictionary_samples,
+            'dictionary_id': self.dictionary_id,
+            'base_count': self.base_count,
+            'entry_log': self.entry_log,
+            'url_index': self.url_index,
         }
 
+    def _catch_up_url_index(self):
+        """
+        Make the url index cover the entries, no more and no less: the entries past what was saved of it
+        are indexed, e.g. those of a FileSet saved before it had one, and those past the entries are dropped,
+        e.g. after a crash or a rollback to a snapshot.
+        """
+        total = self.entry_count()
+        self.url_index.truncate(total)
+        indexed = self.url_index.indexed_count
+        if indexed < total:
+            self.url_index.add_many([entry.url for entry in self.entries_from(indexed)], indexed)
+
+    def entry_count(self) -> int:
+        """
+        The number of entries of the FileSet, loaded or not, unlike len.
+        """
+        return self.base_count + len(self.recorded_entries)
+
+    def entries_from(self, start: int) -> List[FileSetRecordedEntry]:
+        """
+        The entries from the index start on, among all the entries of the FileSet.
+        Those not loaded are read from the entry log, and only those.
+        """
+        logged = self.entry_log.read_all(start)[:self.base_count - start] if start < self.base_count else []
+        return logged + self.recorded_entries[max(start - self.base_count, 0):]
+
+    def frozen_copy(self):
+        """
+        A copy of the FileSet holding the entries recorded so far, e.g. to save a snapshot from
+        while this one keeps recording. The entries are never modified, only appended,
+        so the copy only needs the entry-count watermark, i.e. the list of the entries up to now.
+        The copy shares the entry log, saving either appends to it the entries it is missing.
+        Inserting into the copy is not supported.
+        :return:
+        """
+        with self.lock:
+            state_dict = self.as_state_dict()
+            state_dict['recorded_entries'] = self.recorded_entries[:len(self.recorded_entries)]
+        return FileSet(state_dict=state_dict, mode=self.cur_mode)
+
     def __str__(self):
-        return f"FileSet(directory={self.directory}, mode={self.cur_mode}, filename_counter={self.filename_counter}, cur_size={len(self.recorded_entries)})"
+        return f"FileSet(directory={self.directory}, mode={self.cur_mode}, storage={self.storage}, codec={self.codec}, filename_counter={self.filename_counter}, cur_size={len(self.recorded_entries)})"
 
     __repr__ = __str__
 
@@ -138,12 +313,13 @@ class FileSet:
         return len(self.recorded_entries)
 
 
-    def save(self, _path=None, filename_params="FileSet.json", filename_entries="FileSetEntries.json"):
+    def save(self, _path=None, filename_params="FileSet.json"):
         """
-        Save the FileSet parameters and entries to a directory.
+        Save the FileSet: append the entries recorded since the last save to the entry log,
+        and write the parameters with the number of entries in the log, the watermark.
+        The log is always in the directory of the FileSet, a _path elsewhere, e.g. a snapshot, only gets the parameters.
         :param _path:
         :param filename_params:
-        :param filename_entries:
         :return:
         """
         with self.lock:
@@ -151,23 +327,19 @@ class FileSet:
             logger.info(f"Saving FileSet to {path}")
             os.makedirs(path, exist_ok=True)
             _filepath_params = osp.join(path, filename_params)
-            _filepath_entries = osp.join(path, filename_entries)
 
-            state_dict = self.as_state_dict()
-            state_dict_to_save = {k: v for k, v in state_dict.items() if k != 'recorded_entries'}
+            self.entry_log.sync(self.recorded_entries, self.base_count)
 
-            if self.cur_mode == 'append':
-                # read the existing entries into a list and append the new entries
-                with open(_filepath_entries, "r") as f:
-                    recorded_entries_to_save = json.load(f)
-                recorded_entries_to_save.extend(self.recorded_entries)
-            else:
-                recorded_entries_to_save = self.recorded_entries
+            state_dict = self.as_state_dict()
+            state_dict_to_save = {k: v for k, v in state_dict.items()
+                                  if k not in ('recorded_entries', 'base_count', 'entry_log', 'url_index')}
+            state_dict_to_save['entry_count'] = self.base_count + len(self.recorded_entries)
 
             with open(_filepath_params, "w") as f:
                 json.dump(state_dict_to_save, f)
-            with open(_filepath_entries, "w") as f:
-                json.dump(recorded_entries_to_save, f, indent=4)
+            if _path is None:
+                # derived from the entries, a snapshot needs none of its own.
+                self.url_index.save()
 
     def make_snapshot(self, version_name, _path: str = None, ) -> str:
         """
@@ -196,7 +368,7 @@ class FileSet:
         :param path: the directory of the FileSet.
         :param mode: 'append', 'append-full-load' or 'overwrite'
         :param filename_params:
-        :param filename_entries:
+        :param filename_entries: the entries saved before the entry log, moved to a log if there is no log yet.
         :return:
         """
         if mode not in ['append', 'append-full-load', 'overwrite']:
@@ -206,30 +378,46 @@ class FileSet:
             return FileSet(directory=path, mode=mode)
 
         _filepath_params = osp.join(path, filename_params)
-        _filepath_entries = osp.join(path, filename_entries)
         if not osp.exists(path):
             raise FileNotFoundError(f"Directory {path} not found!")
         if not osp.exists(_filepath_params):
             raise FileNotFoundError(f"File {_filepath_params} not found!")
-        if not osp.exists(_filepath_entries):
-            raise FileNotFoundError(f"File {_filepath_entries} not found!")
 
         with open(_filepath_params, "r") as f:
             state_dict = json.load(f)
 
+        if 'entry_count' in state_dict:
+            # the entries logged after the watermark, e.g. by a crawler saving meanwhile, are not part of this save.
+            entry_log = el.EntryLog(path, entry_class=FileSetRecordedEntry, count=state_dict.pop('entry_count'))
+        else:
+            entry_log = FileSet._migrate_entries(path, osp.join(path, filename_entries))
+
         if mode == 'append':
             recorded_entries = []
+            state_dict['base_count'] = len(entry_log)
         else:
-            with open(_filepath_entries, "r") as f:
-                _recorded_entries = json.load(f)
-                # convert the list[list[Any...]] to list[FileSetRecordedEntry]
-                recorded_entries = [FileSetRecordedEntry(*entry) for entry in _recorded_entries]
+            recorded_entries = entry_log.read_all()
 
         state_dict['recorded_entries'] = recorded_entries
+        state_dict['entry_log'] = entry_log
 
         ret = FileSet(directory=path, state_dict=state_dict, mode=mode)
         return ret
 
+    @staticmethod
+    def _migrate_entries(path, _filepath_entries) -> el.EntryLog:
+        """
+        Move the entries of a FileSetEntries.json to a new entry log.
+        """
+        if not osp.exists(_filepath_entries):
+            raise FileNotFoundError(f"File {_filepath_entries} not found!")
+        with open(_filepath_entries, "r") as f:
+            recorded_entries = [FileSetRecordedEntry(*entry) for entry in json.load(f)]
+        logger.info(f"Moving {len(recorded_entries)} entries from {_filepath_entries} to an entry log")
+        entry_log = el.EntryLog(path, entry_class=FileSetRecordedEntry, count=0)
+        entry_log.append(recorded_entries)
+        return entry_log
+
     @staticmethod
     def load_from_snapshot(version_name: str, _path: str = None):
         """
@@ -237,7 +425,7 @@ class FileSet:
         This means that the files that now exist in the contents folder must have been covering what's in the snapshot entries.
         Since we don't keep a copy of the contents when making snapshots, when loading them, the contents folder will
         fall back to the state w.r.t. the snapshot entries.
-        All files that are not in the snapshot entries will be deleted.
+        All files that are not in the snapshot entries will be deleted, and the entry log is truncated to them.
         :param version_name:
         :param _path: the directory of the FileSet. It should contain a "snapshots" folder, in which there should be a folder "{version_name}".
         :return:
@@ -245,35 +433,49 @@ class FileSet:
         snapshot_dir = osp.join(_path, "snapshots") if _path is not None else "snapshots"
         snapshot_inner_dir = osp.join(snapshot_dir, version_name)
         _filepath_params = osp.join(snapshot_inner_dir, "FileSet.json")
-        _filepath_entries = osp.join(snapshot_inner_dir, "FileSetEntries.json")
         if not osp.exists(snapshot_dir):
             raise FileNotFoundError(f"Directory {snapshot_dir} not found!")
         if not osp.exists(snapshot_inner_dir):
             raise FileNotFoundError(f"Directory {snapshot_inner_dir} not found!")
         if not osp.exists(_filepath_params):
             raise FileNotFoundError(f"File {_filepath_params} not found!")
-        if not osp.exists(_filepath_entries):
-            raise FileNotFoundError(f"File {_filepath_entries} not found!")
 
         with open(_filepath_params, "r") as f:
             state_dict = json.load(f)
 
-        with open(_filepath_entries, "r") as f:
-            _recorded_entries: List[FileSetRecordedEntry] = json.load(f)
-            recorded_entries = [FileSetRecordedEntry(*entry) for entry in _recorded_entries]
+        if 'entry_count' in state_dict:
+            entry_log = el.EntryLog(state_dict['directory'], entry_class=FileSetRecordedEntry)
+            entry_log.truncate(state_dict.pop('entry_count'))
+        else:
+            # a snapshot from before the entry log, with the entries in a json.
+            entry_log = FileSet._migrate_entries(state_dict['directory'],
+                                                 osp.join(snapshot_inner_dir, "FileSetEntries.json"))
+        recorded_entries = entry_log.read_all()
 
         state_dict['recorded_entries'] = recorded_entries
+        state_dict['entry_log'] = entry_log
 
-        # replace the FileSet.json and FileSetEntries.json in the directory
-        shutil.copy(_filepath_params, osp.join(_path, "FileSet.json"))
-        shutil.copy(_filepath_entries, osp.join(_path, "FileSetEntries.json"))
+        # replace the FileSet.json in the directory, with the watermark of the log as it is now.
+        with open(osp.join(_path, "FileSet.json"), "w") as f:
+            json.dump({**{k: v for k, v in state_dict.items() if k not in ('recorded_entries', 'entry_log')},
+                       'entry_count': len(entry_log)}, f)
 
         # delete all files that are not in the snapshot entries
         contained_filenames = set([entry.content_filename for entry in recorded_entries])
+        contained_filenames.update(entry.sidecar_location for entry in recorded_entries
+                                   if entry.sidecar_location is not None)
         contents_dir = osp.join(state_dict['directory'], "contents")
-        for filename in os.listdir(contents_dir):
-            if filename not in contained_filenames:
-                os.remove(osp.join(contents_dir, filename))
+        if osp.exists(contents_dir):
+            for filename in os.listdir(contents_dir):
+                if filename not in contained_filenames:
+                    os.remove(osp.join(contents_dir, filename))
+        # and the records appended to the segments after them.
+        ss.SegmentStore.truncate_to(osp.join(state_dict['directory'], "segments"), contained_filenames)
+        sidecars_dir = osp.join(state_dict['directory'], "sidecars")
+        if osp.exists(sidecars_dir):
+            for filename in os.listdir(sidecars_dir):
+                if filename[:-len(".json")] not in contained_filenames:
+                    os.remove(osp.join(sidecars_dir, filename))
 
         # remove newer snapshots. compare the timestamp metadata of the snapshots.
         for snapshot_name in os.listdir(snapshot_dir):
@@ -284,37 +486,148 @@ class FileSet:
         ret = FileSet(state_dict=state_dict, mode='append-full-load')
         return ret
 
-    def insert(self, entry: FileSetInsertEntry):
+    def insert(self, entry: FileSetInsertEntry, sidecar: Optional[dict] = None):
         """
         Insert an entry into the FileSet.
+
+        With the 'files' storage, the lock is only held to assign the filename and to take the record,
+        the content is written without it so that inserts from several threads overlap.
+        With the 'segments' storage, the contents are appended one after the other.
         :param entry:
-        :return:
+        :param sidecar: a json-serializable dict to keep next to the content, see read_sidecar.
+        :return: the recorded entry.
         """
-        with self.lock:
+        # content may be str or bytes
+        if isinstance(entry.content, str):
+            content = entry.content.encode()
+        else:
+            content = entry.content
+        content, codec = self._compress(content)
+
+        sidecar_location = None
+        if self.storage == 'segments':
+            filename = self.segments.append(content)
+            if sidecar is not None:
+                # a record of its own in the segments, no file per page.
+                sidecar_location = self.segments.append(json.dumps(sidecar, ensure_ascii=False).encode("utf-8"))
+        else:
+            with self.lock:
+                filename = self._assign_filename_for(entry)
+
             # write the content to a file
-            filename = self._assign_filename_for(entry)
             contents_folder = osp.join(self.directory, "contents")
             filepath = osp.join(self.directory, "contents", filename)
-            # content may be str or bytes
-            if isinstance(entry.content, str):
-                content = entry.content.encode()
-            else:
-                content = entry.content
-
             if not osp.exists(contents_folder):
                 os.makedirs(contents_folder, exist_ok=True)
             with open(filepath, "wb") as f:
                 f.write(content)
+        if sidecar is not None and sidecar_location is None:
+            # written before the record is taken, so a recorded entry's sidecar is always complete.
+            os.makedirs(osp.join(self.directory, "sidecars"), exist_ok=True)
+            with open(self._sidecar_path(filename), "w") as f:
+                json.dump(sidecar, f, ensure_ascii=False)
+
+        # take a record
+        recorded_entry = FileSetRecordedEntry(
+            content_filename=filename,
+            url=entry.url,
+            title=entry.title,
+            download_time=entry.download_time,
+            codec=codec,
+            sidecar_location=sidecar_location,
+        )
+        self.record(recorded_entry)
+        return recorded_entry
+
+    def _compress(self, content: bytes):
+        """
+        Compress a content with the codec of the FileSet.
+        :return: the compressed content, and the codec to record with its entry.
+        """
+        if self.codec == 'raw':
+            return content, None
+        if not cc.uses_dictionary(self.codec):
+            return cc.compress(content, self.codec), self.codec
+        if self.dictionary_id is None:
+            self._collect_dictionary_sample(content)
+        dictionary_id = self.dictionary_id
+        if dictionary_id is None:
+            # until the dictionary is trained, without one.
+            codec = self.codec[:-len("-dict")]
+            return cc.compress(content, codec), codec
+        return (cc.compress(content, self.codec, self.dictionaries.get(dictionary_id)),
+                f"{self.codec}:{dictionary_id}")
+
+    def _collect_dictionary_sample(self, content: bytes):
+        with self.lock:
+            if len(self._dictionary_samples_collected) >= self.dictionary_samples:
+                return
+            self._dictionary_samples_collected.append(content)
+            if len(self._dictionary_samples_collected) < self.dictionary_samples:
+                return
+            samples = self._dictionary_samples_collected
+        # only the thread adding the last sample gets here.
+        self.train_dictionary(samples)
+        with self.lock:
+            # no more samples are collected once there is a dictionary.
+            self._dictionary_samples_collected = []
 
-            # take a record
-            recorded_entry = FileSetRecordedEntry(
-                content_filename=filename,
-                url=entry.url,
-                title=entry.title,
-                download_time=entry.download_time
-            )
+    def train_dictionary(self, samples: List[bytes]) -> str:
+        """
+        Train the dictionary of the codec from samples of the contents, e.g. pages of the site crawled.
+        The contents inserted from now on are compressed with it, the ones before keep theirs.
+        :param samples:
+        :return: the id of the dictionary.
+        """
+        if not cc.uses_dictionary(self.codec):
+            raise ValueError(f"The codec {self.codec} uses no dictionary")
+        dictionary = cc.train_dictionary(self.codec, samples)
+        dictionary_id = self.dictionaries.add(dictionary)
+        with self.lock:
+            self.dictionary_id = dictionary_id
+        logger.info(f"Trained a {len(dictionary)}-byte dictionary {dictionary_id} from {len(samples)} contents")
+        return dictionary_id
+
+    def close(self):
+        """
+        Close the segment being appended to and the memory maps of the segments.
+        """
+        self.segments.close()
+
+    def record(self, recorded_entry: FileSetRecordedEntry):
+        """
+        Take a record of a content file that is already in the contents folder, e.g. when replaying a log.
+        :param recorded_entry:
+        :return:
+        """
+        with self.lock:
+            self.url_index.add(recorded_entry.url, self.base_count + len(self.recorded_entries))
             self.recorded_entries.append(recorded_entry)
 
+    def _entry_at(self, entry_id: int) -> FileSetRecordedEntry:
+        """
+        :param entry_id: the index of the entry, among all the entries of the FileSet, loaded or not.
+        """
+        if entry_id >= self.base_count:
+            return self.recorded_entries[entry_id - self.base_count]
+        return self.entry_log.read(entry_id)
+
+    def get_by_url(self, url: str) -> Optional[FileSetRecordedEntry]:
+        """
+        The latest entry of a url, looked up in the url index.
+        :param url: as recorded, e.g. normalized by the crawler with utils.as_unique_url.
+        :return: None if the url has no entry.
+        """
+        entry_id = self.url_index.lookup(url)
+        if entry_id is None:
+            return None
+        entry = self._entry_at(entry_id)
+        # another url with the same fingerprint.
+        return entry if entry.url == url else None
+
+    def contains_url(self, url: str) -> bool:
+        return self.get_by_url(url) is not None
+
     def _assign_filename_for(self, entry: FileSetInsertEntry):
         """
         Assign a filename for the entry's content.
@@ -340,10 +653,62 @@ class FileSet:
         shutil.rmtree(self.directory, ignore_errors=True)
         # clear the directory
         os.makedirs(self.directory, exist_ok=True)
-        os.makedirs(osp.join(self.directory, "contents"), exist_ok=True)
+        os.makedirs(osp.join(self.directory, "contents" if self.storage == 'files' else "segments"), exist_ok=True)
         os.makedirs(osp.join(self.directory, "snapshots"), exist_ok=True)
 
 
+class FileSetReader(_ContentAccess):
+    """
+    A read-only FileSet, for the jobs downstream of the crawler, e.g. image retrieval and indexing.
+
+    Opening it maps the entry log, whatever the number of entries: len, reader[i], slices and iteration
+    read only the entries they are asked for. It can be opened while a crawler is saving to the FileSet,
+    it then holds the entries saved so far, and refresh picks up the ones saved since.
+    """
+
+    def __init__(self,
+                 directory: str,
+                 ):
+        """
+        :param directory: the directory of the FileSet.
+        """
+        if not osp.exists(directory):
+            raise FileNotFoundError(f"Directory {directory} not found!")
+        if not el.exists(directory):
+            # saved before the entry log. Moved to a log once.
+            FileSet.load_from(directory, mode='append')
+        self.directory = directory
+        self.entries = el.EntryLogView(directory, entry_class=FileSetRecordedEntry)
+        self.segments = ss.SegmentStore(osp.join(directory, "segments"))
+        self.dictionaries = cc.DictionaryStore(osp.join(directory, "dictionaries"))
+
+    def refresh(self) -> int:
+        """
+        :return: the number of entries, with the ones saved since the reader was opened.
+        """
+        return self.entries.refresh()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __getitem__(self, item):
+        """
+        :param item: an index, or a slice for a list of entries.
+        """
+        return self.entries[item]
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def close(self):
+        self.segments.close()
+
+    def __str__(self):
+        return f"FileSetReader(directory={self.directory}, cur_size={len(self)})"
+
+    __repr__ = __str__
+
+
 def random_string(length=10):
     ret = ""
     for _ in range(length):
@@ -0,0 +1,214 @@
+"""
+An exact set of urls, for when a "maybe" from the bloom filter is not good enough.
+
+Each url is stored as its 64-bit blake2b fingerprint, 8 bytes per url.
+At a million urls the chance of any two fingerprints colliding is about 3e-8.
+
+- the bulk of the fingerprints is a sorted uint64 array in a .npy file, memory-mapped read-only.
+  membership is a binary search.
+- new fingerprints go into an in-memory delta set,
+  which is merged into the sorted file once it holds merge_threshold fingerprints, or on save.
+
+File structure:
+| FingerprintSet.json: the parameters of the FingerprintSet.
+| fingerprints.npy: the sorted fingerprints.
+"""
+import hashlib
+import json
+import os
+import os.path as osp
+import threading
+from typing import Optional
+
+import numpy as np
+
+import utils
+
+
+def fingerprint(url: str) -> int:
+    return int.from_bytes(hashlib.blake2b(url.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def fingerprints(urls) -> np.ndarray:
+    """
+    :return: uint64 array of the fingerprints of the urls.
+    """
+    buffer = b"".join(hashlib.blake2b(url.encode("utf-8"), digest_size=8).digest() for url in urls)
+    return np.frombuffer(buffer, dtype="<u8").astype(np.uint64)
+
+
+def _sorted_contains(sorted_array: np.ndarray, values: np.ndarray) -> np.ndarray:
+    """
+    Check which values are in the sorted array, by binary search.
+    """
+    if len(sorted_array) == 0:
+        return np.zeros(len(values), dtype=bool)
+    indices = np.searchsorted(sorted_array, values)
+    indices[indices == len(sorted_array)] = 0
+    return sorted_array[indices] == values
+
+
+class FingerprintSet:
+
+    def __init__(self,
+                 directory: str = None,
+                 merge_threshold: int = 65536,
+                 state_dict: Optional[dict] = None,
+                 ):
+        """
+        :param directory: where the sorted fingerprints file lives. A new FingerprintSet starts empty.
+        :param merge_threshold: the size of the delta set that triggers a merge into the sorted file.
+        :param state_dict: used when loading, see load_from.
+        """
+        self.lock = threading.Lock()
+        self.delta = set()
+
+        if state_dict is not None:
+            self.directory = state_dict["directory"]
+            self.merge_threshold = state_dict["merge_threshold"]
+            self.sorted = state_dict["sorted"]
+        else:
+            self.directory = directory
+            self.merge_threshold = merge_threshold
+            os.makedirs(directory, exist_ok=True)
+            self.sorted = np.zeros(0, dtype=np.uint64)
+            self._write_sorted(self.sorted)
+
+    @property
+    def _sorted_filepath(self):
+        return osp.join(self.directory, "fingerprints.npy")
+
+    def _write_sorted(self, array: np.ndarray):
+        """
+        Replace the sorted file and map the new one. The file is replaced atomically,
+        readers of the old mapping keep working on the old file.
+        """
+        tmp_filepath = self._sorted_filepath + ".tmp.npy"
+        np.save(tmp_filepath, array)
+        os.replace(tmp_filepath, self._sorted_filepath)
+        self.sorted = np.load(self._sorted_filepath, mmap_mode="r")
+
+    def _merge(self):
+        """
+        Merge the delta set into the sorted file. Must be called with self.lock held.
+        """
+        if not self.delta:
+            return
+        delta = np.fromiter(self.delta, dtype=np.uint64, count=len(self.delta))
+        self._write_sorted(np.union1d(self.sorted, delta))
+        self.delta = set()
+
+    def add(self, url: str):
+        with self.lock:
+            self.delta.add(fingerprint(url))
+            if len(self.delta) >= self.merge_threshold:
+                self._merge()
+
+    def add_many(self, urls):
+        with self.lock:
+            self.delta.update(fingerprints(urls).tolist())
+            if len(self.delta) >= self.merge_threshold:
+                self._merge()
+
+    def __contains__(self, url: str) -> bool:
+        fp = fingerprint(url)
+        with self.lock:
+            if fp in self.delta:
+                return True
+            return bool(_sorted_contains(self.sorted, np.array([fp], dtype=np.uint64))[0])
+
+    def contains_many(self, urls) -> np.ndarray:
+        """
+        :return: a bool array, True where the url is in the set.
+        """
+        fps = fingerprints(urls)
+        with self.lock:
+            ret = _sorted_contains(self.sorted, fps)
+            if self.delta:
+                ret |= np.array([fp in self.delta for fp in fps.tolist()], dtype=bool)
+            return ret
+
+    def copy(self):
+        """
+        An in-memory copy, not tied to a directory, e.g. to save a snapshot from while this one is still written to.
+        save_to must then be given a path.
+        """
+        with self.lock:
+            state_dict = self.as_state_dict()
+            state_dict["sorted"] = np.array(self.sorted)
+            delta = set(self.delta)
+        state_dict["directory"] = None
+        ret = FingerprintSet(state_dict=state_dict)
+        ret.delta = delta
+        return ret
+
+    def __len__(self):
+        with self.lock:
+            # the delta set never holds a fingerprint twice, but may hold one that is already merged.
+            if not self.delta:
+                return len(self.sorted)
+            delta = np.fromiter(self.delta, dtype=np.uint64, count=len(self.delta))
+            return len(self.sorted) + int(np.count_nonzero(~_sorted_contains(self.sorted, delta)))
+
+    def __str__(self):
+        return f"FingerprintSet(directory={self.directory}, sorted={len(self.sorted)}, delta={len(self.delta)})"
+
+    __repr__ = __str__
+
+    def as_state_dict(self):
+        return {
+            "directory": self.directory,
+            "merge_threshold": self.merge_threshold,
+            "sorted": self.sorted,
+        }
+
+    def save_to(self, path: str = None, filename="FingerprintSet.json"):
+        """
+        Merge the delta set and save the FingerprintSet to a directory.
+        Saving to its own directory only writes the parameters, saving elsewhere clones the sorted file.
+        :param path: defaults to self.directory.
+        :param filename:
+        :return:
+        """
+        path = self.directory if path is None else path
+        os.makedirs(path, exist_ok=True)
+        if self.directory is None:
+            # a copy, the sorted array lives in memory.
+            with self.lock:
+                _sorted = self.sorted
+                if self.delta:
+                    _sorted = np.union1d(_sorted, np.fromiter(self.delta, dtype=np.uint64, count=len(self.delta)))
+                with open(osp.join(path, filename), "w") as f:
+                    json.dump({"merge_threshold": self.merge_threshold}, f)
+                np.save(osp.join(path, "fingerprints.npy"), _sorted)
+            return
+
+        with self.lock:
+            self._merge()
+            state_dict = self.as_state_dict()
+            state_dict_to_json = {k: v for k, v in state_dict.items() if k not in ("directory", "sorted")}
+            with open(osp.join(path, filename), "w") as f:
+                json.dump(state_dict_to_json, f)
+
+            _filepath = osp.join(path, "fingerprints.npy")
+            if not (osp.exists(_filepath) and osp.samefile(_filepath, self._sorted_filepath)):
+                utils.clone_file(self._sorted_filepath, _filepath)
+
+    @staticmethod
+    def load_from(path, filename="FingerprintSet.json"):
+        """
+        Load the FingerprintSet from a directory, memory-mapping the sorted file.
+        The loaded FingerprintSet keeps working in that directory.
+        """
+        _filepath = osp.join(path, filename)
+        _sorted_filepath = osp.join(path, "fingerprints.npy")
+        if not osp.exists(_filepath):
+            raise FileNotFoundError(f"File {_filepath} not found!")
+        if not osp.exists(_sorted_filepath):
+            raise FileNotFoundError(f"File {_sorted_filepath} not found!")
+        with open(_filepath, "r") as f:
+            state_dict = json.load(f)
+
+        state_dict["directory"] = path
+        state_dict["sorted"] = np.load(_sorted_filepath, mmap_mode="r")
+        return FingerprintSet(state_dict=state_dict)
@@ -0,0 +1,500 @@
+"""
+The crawl frontier: the urls waiting to be crawled.
+
+HostFrontier is a drop-in replacement for the queue.Queue the crawler used (put, get, task_done,
+qsize, maxsize, queue.Empty and queue.Full), that also enforces politeness per host:
+- get() only hands out a url whose host is ready, i.e. the host's interval has passed since
+  the previous url of that host was handed out.
+- at most max_per_host urls of a host are handed out and not yet task_done(url) at the same time.
+
+so workers never sleep for politeness, they just wait in get() for the next ready host.
+crawling several hosts then runs at the sum of their rates.
+
+The urls are prioritized:
+- every url comes with a priority (higher first) and a depth (the number of links followed from a seed).
+- a host hands out its highest priority url first, then the shallowest, then the most recently added.
+- when the frontier is full, a new url evicts the lowest priority url held, the deepest, then the oldest,
+  if it has a strictly higher priority, or the same priority and a smaller depth. Otherwise put() raises queue.Full.
+  the eviction is deterministic, and the memory used is bounded by maxsize.
+
+SpillingFrontier adds a second tier on disk: what does not fit in memory is appended to a spill file
+instead of being lost, and read back in large sequential batches when the memory runs low.
+"""
+import heapq
+import os
+import os.path as osp
+import queue
+import struct
+import threading
+import time
+import urllib.parse
+from typing import Callable, Dict, List, NamedTuple, Optional, Set, Tuple
+
+import utils
+
+
+def host_of(url: str) -> str:
+    return urllib.parse.urlparse(url).netloc.lower()
+
+
+class FrontierItem(NamedTuple):
+    url: str
+    priority: int = 0
+    depth: int = 0
+
+
+class _Entry:
+    """
+    A url held by the frontier. It is in both its host's heap and the eviction heap,
+    removing it from one marks it dead, and the other drops it lazily.
+    """
+    __slots__ = ("item", "seq", "host", "alive")
+
+    def __init__(self, item: FrontierItem, seq: int, host: str):
+        self.item = item
+        self.seq = seq
+        self.host = host
+        self.alive = True
+
+    def fetch_key(self):
+        # smallest is handed out first: highest priority, shallowest, newest.
+        return -self.item.priority, self.item.depth, -self.seq
+
+    def eviction_key(self):
+        # smallest is evicted first: lowest priority, deepest, oldest.
+        return self.item.priority, -self.item.depth, self.seq
+
+
+class HostFrontier:
+
+    def __init__(self,
+                 maxsize: int = 0,
+                 default_interval_s: float = 0.0,
+                 host_intervals_s: Optional[Dict[str, float]] = None,
+                 max_per_host: int = 0,
+                 ):
+        """
+        :param maxsize: the maximum number of urls held, 0 for no limit.
+        :param default_interval_s: the minimum time between two urls of the same host being handed out.
+        :param host_intervals_s: per-host overrides of default_interval_s.
+        :param max_per_host: the maximum number of urls of a host handed out and not yet done, 0 for no limit.
+        """
+        self.maxsize = maxsize
+        self.default_interval_s = default_interval_s
+        self.host_intervals_s = dict(host_intervals_s) if host_intervals_s is not None else {}
+        self.max_per_host = max_per_host
+
+        # an RLock, so that the accept callback of get() may call qsize() and the like.
+        self.cond = threading.Condition(threading.RLock())
+        # per-host heaps of (fetch key, entry), and the number of live entries in them.
+        self._host_heaps: Dict[str, List[Tuple[tuple, _Entry]]] = {}
+        self._host_counts: Dict[str, int] = {}
+        # (eviction key, entry) of all the entries.
+        self._eviction_heap: List[Tuple[tuple, _Entry]] = []
+        self._seq = 0
+        # (time the host is ready, host) of the hosts that have urls and are below max_per_host.
+        self._ready_heap: List[Tuple[float, str]] = []
+        self._in_heap: Set[str] = set()
+        self._next_time: Dict[str, float] = {}
+        self._active: Dict[str, int] = {}
+        # the items handed out and not done yet, by url.
+        self._in_flight: Dict[str, List[FrontierItem]] = {}
+        self._size = 0
+
+    def configure(self,
+                  default_interval_s: Optional[float] = None,
+                  host_intervals_s: Optional[Dict[str, float]] = None,
+                  max_per_host: Optional[int] = None,
+                  ):
+        """
+        Change the politeness settings. Takes effect from the next url handed out.
+        """
+        with self.cond:
+            if default_interval_s is not None:
+                self.default_interval_s = default_interval_s
+            if host_intervals_s is not None:
+                self.host_intervals_s = dict(host_intervals_s)
+            if max_per_host is not None:
+                self.max_per_host = max_per_host
+                for host in self._host_heaps:
+                    self._schedule(host)
+            self.cond.notify_all()
+
+    def interval_of(self, host: str) -> float:
+        return self.host_intervals_s.get(host, self.default_interval_s)
+
+    # the followings must be called with self.cond held.
+
+    def _schedule(self, host):
+        """
+        Push the host into the ready heap if it has urls and may take one more request.
+        """
+        if host in self._in_heap or not self._host_counts.get(host):
+            return
+        if 0 < self.max_per_host <= self._active.get(host, 0):
+            return
+        heapq.heappush(self._ready_heap, (self._next_time.get(host, 0.0), host))
+        self._in_heap.add(host)
+
+    def _push(self, item: FrontierItem):
+        host = host_of(item.url)
+        entry = _Entry(item, self._seq, host)
+        self._seq += 1
+        if host not in self._host_heaps:
+            self._host_heaps[host] = []
+            self._host_counts[host] = 0
+        heapq.heappush(self._host_heaps[host], (entry.fetch_key(), entry))
+        heapq.heappush(self._eviction_heap, (entry.eviction_key(), entry))
+        self._host_counts[host] += 1
+        self._size += 1
+        self._schedule(host)
+
+    def _kill(self, entry: _Entry):
+        entry.alive = False
+        self._size -= 1
+        self._host_counts[entry.host] -= 1
+        if self._host_counts[entry.host] == 0:
+            del self._host_counts[entry.host]
+            del self._host_heaps[entry.host]
+            if entry.host in self._in_heap:
+                # the last url of a host waiting in the ready heap was evicted, the host has nothing to hand out.
+                self._in_heap.discard(entry.host)
+                self._ready_heap = [pair for pair in self._ready_heap if pair[1] != entry.host]
+                heapq.heapify(self._ready_heap)
+        # the dead entries are dropped lazily, don't let them pile up in the eviction heap.
+        if len(self._eviction_heap) > 2 * self._size + 1024:
+            self._eviction_heap = [pair for pair in self._eviction_heap if pair[1].alive]
+            heapq.heapify(self._eviction_heap)
+
+    def _pop_host(self, host) -> FrontierItem:
+        host_heap = self._host_heaps[host]
+        while True:
+            _, entry = heapq.heappop(host_heap)
+            if entry.alive:
+                self._kill(entry)
+                return entry.item
+
+    def _lowest(self) -> Optional[_Entry]:
+        while self._eviction_heap and not self._eviction_heap[0][1].alive:
+            heapq.heappop(self._eviction_heap)
+        return self._eviction_heap[0][1] if self._eviction_heap else None
+
+    def _evict_for(self, item: FrontierItem) -> Optional[FrontierItem]:
+        """
+        Evict the lowest entry if item outranks it.
+        :return: the evicted item, None if nothing was evicted.
+        """
+        lowest = self._lowest()
+        if lowest is None or (item.priority, -item.depth) <= (lowest.item.priority, -lowest.item.depth):
+            return None
+        heapq.heappop(self._eviction_heap)
+        self._kill(lowest)
+        return lowest.item
+
+    def _refill(self):
+        """
+        Called before handing out a url, for subclasses to top up the frontier.
+        """
+        pass
+
+    # queue.Queue-like interface
+
+    def put(self,
+            url: str,
+            block: bool = True,
+            timeout: Optional[float] = None,
+            priority: int = 0,
+            depth: int = 0,
+            ):
+        """
+        Add a url. When the frontier is full, the url evicts the lowest entry if it outranks it.
+        :raise queue.Full: if the frontier is full, the url outranks nothing,
+               and block is False or the timeout expires.
+        """
+        item = FrontierItem(url, priority, depth)
+        with self.cond:
+            if 0 < self.maxsize <= self._size and self._evict_for(item) is None:
+                if not block:
+                    raise queue.Full
+                if not self.cond.wait_for(lambda: self._size < self.maxsize, timeout=timeout):
+                    raise queue.Full
+            self._push(item)
+            self.cond.notify_all()
+
+    def put_nowait(self, url: str, priority: int = 0, depth: int = 0):
+        return self.put(url, block=False, priority=priority, depth=depth)
+
+    def get(self,
+            block: bool = True,
+            timeout: Optional[float] = None,
+            accept: Optional[Callable[[str], bool]] = None,
+            ) -> str:
+        """
+        Hand out a url whose host is ready, waiting for one if needed.
+        The caller must call task_done(url) once it is done with the url.
+        :param accept: urls for which accept(url) is False are dropped without using up their host's turn.
+        :raise queue.Empty: if no url is ready and block is False or the timeout expires.
+        """
+        return self.get_item(block=block, timeout=timeout, accept=accept).url
+
+    def get_item(self,
+                 block: bool = True,
+                 timeout: Optional[float] = None,
+                 accept: Optional[Callable[[str], bool]] = None,
+                 ) -> FrontierItem:
+        """
+        Like get(), but also return the priority and the depth the url was put with.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.cond:
+            while True:
+                self._refill()
+                now = time.monotonic()
+                while self._ready_heap and self._ready_heap[0][0] <= now:
+                    _, host = heapq.heappop(self._ready_heap)
+                    self._in_heap.discard(host)
+                    item = self._pop_host(host)
+                    self.cond.notify_all()
+                    if accept is not None and not accept(item.url):
+                        self._schedule(host)
+                        continue
+                    self._active[host] = self._active.get(host, 0) + 1
+                    self._in_flight.setdefault(item.url, []).append(item)
+                    self._next_time[host] = now + self.interval_of(host)
+                    self._schedule(host)
+                    return item
+
+                if not block:
+                    raise queue.Empty
+                wait_s = None
+                if self._ready_heap:
+                    wait_s = self._ready_heap[0][0] - now
+                if deadline is not None:
+                    remaining = deadline - now
+                    if remaining <= 0:
+                        raise queue.Empty
+                    wait_s = remaining if wait_s is None else min(wait_s, remaining)
+                self.cond.wait(wait_s)
+
+    def get_nowait(self, accept: Optional[Callable[[str], bool]] = None) -> str:
+        return self.get(block=False, accept=accept)
+
+    def get_item_nowait(self, accept: Optional[Callable[[str], bool]] = None) -> FrontierItem:
+        return self.get_item(block=False, accept=accept)
+
+    def task_done(self, url: Optional[str] = None):
+        """
+        Report that a url handed out by get() is done, which frees its host for max_per_host.
+        Without a url this does nothing, like queue.Queue.task_done for callers that don't track hosts.
+        """
+        if url is None:
+            return
+        host = host_of(url)
+        with self.cond:
+            in_flight = self._in_flight.get(url)
+            if in_flight:
+                in_flight.pop()
+                if not in_flight:
+                    del self._in_flight[url]
+            self._active[host] = self._active.get(host, 1) - 1
+            if self._active[host] <= 0:
+                del self._active[host]
+            self._schedule(host)
+            self.cond.notify_all()
+
+    def time_until_ready(self) -> Optional[float]:
+        """
+        Seconds until get() would hand out a url, None if there are no urls to hand out.
+        """
+        with self.cond:
+            if not self._ready_heap:
+                return None
+            return max(self._ready_heap[0][0] - time.monotonic(), 0.0)
+
+    def qsize(self) -> int:
+        with self.cond:
+            return self._size
+
+    def empty(self) -> bool:
+        return self.qsize() == 0
+
+    def full(self) -> bool:
+        return 0 < self.maxsize <= self.qsize()
+
+    def in_flight_items(self) -> List[FrontierItem]:
+        """
+        The items handed out and not done yet. They belong in a snapshot of the queue taken while crawling.
+        """
+        with self.cond:
+            return [item for items in self._in_flight.values() for item in items]
+
+    def snapshot(self) -> List[FrontierItem]:
+        """
+        All the items held, in the order they were put, for saving.
+        """
+        with self.cond:
+            entries = [entry for host_heap in self._host_heaps.values() for _, entry in host_heap if entry.alive]
+            entries.sort(key=lambda entry: entry.seq)
+            return [entry.item for entry in entries]
+
+    def __str__(self):
+        return f"HostFrontier(size={self.qsize()}, maxsize={self.maxsize}, hosts={len(self._host_heaps)}, " \
+               f"default_interval_s={self.default_interval_s}, max_per_host={self.max_per_host})"
+
+    __repr__ = __str__
+
+
+# the header of a record of the spill file: the length of the url in bytes, the priority and the depth.
+SPILL_RECORD_HEADER = struct.Struct("<Iii")
+
+
+class SpillingFrontier(HostFrontier):
+    """
+    A HostFrontier whose put() never raises queue.Full: the urls that don't fit in memory are spilled to disk.
+
+    - the memory holds at most maxsize urls, with the same priorities and eviction as HostFrontier.
+      an evicted url, or a new url that outranks nothing, is appended to the spill file.
+    - when the memory holds fewer than refill_watermark urls, up to refill_bytes of the spill file
+      are read back in one sequential read. the spilled urls come back in the order they were spilled.
+    - once everything spilled has been read back, the spill file is truncated.
+
+    File structure of the spill file, records of:
+    | url length (uint32) | priority (int32) | depth (int32) | url (utf-8) |
+    """
+
+    def __init__(self,
+                 spill_path: str,
+                 maxsize: int = 10000,
+                 refill_watermark: Optional[int] = None,
+                 refill_bytes: int = 1 << 20,
+                 read_offset: int = 0,
+                 spilled_count: int = 0,
+                 **kwargs,
+                 ):
+        """
+        See HostFrontier for the other parameters.
+        :param spill_path: the spill file, created if needed.
+        :param maxsize: the maximum number of urls held in memory, must be positive.
+        :param refill_watermark: read the spill file back when fewer urls are in memory. Defaults to maxsize // 2, at least 1.
+        :param refill_bytes: the size of a read of the spill file.
+        :param read_offset: where the records not read back yet start, used when loading.
+        :param spilled_count: the number of records not read back yet, used when loading.
+        """
+        if maxsize <= 0:
+            raise ValueError(f"SpillingFrontier needs a positive maxsize, got {maxsize}")
+        super().__init__(maxsize=maxsize, **kwargs)
+        self.spill_path = spill_path
+        self.refill_watermark = refill_watermark if refill_watermark is not None else max(maxsize // 2, 1)
+        self.refill_bytes = refill_bytes
+        self._read_offset = read_offset
+        self._spilled_count = spilled_count
+
+        os.makedirs(osp.dirname(osp.abspath(spill_path)), exist_ok=True)
+        # in append mode, writes go to the end of the file whatever the position the reads left.
+        self._spill_file = open(spill_path, "a+b")
+        if spilled_count == 0:
+            # whatever is left in the file has been read back already.
+            self._spill_file.truncate(0)
+            self._read_offset = 0
+
+    def _spill(self, item: FrontierItem):
+        url_bytes = item.url.encode("utf-8")
+        self._spill_file.write(SPILL_RECORD_HEADER.pack(len(url_bytes), item.priority, item.depth) + url_bytes)
+        self._spilled_count += 1
+
+    def _refill(self):
+        if self._spilled_count == 0 or self._size >= self.refill_watermark:
+            return
+        self._spill_file.flush()
+        self._spill_file.seek(self._read_offset)
+        data = self._spill_file.read(self.refill_bytes)
+        pos = 0
+        header_size = SPILL_RECORD_HEADER.size
+        while self._spilled_count > 0 and self._size < self.maxsize and pos + header_size <= len(data):
+            length, priority, depth = SPILL_RECORD_HEADER.unpack_from(data, pos)
+            end = pos + header_size + length
+            if end > len(data):
+                if pos > 0:
+                    break
+                # a single record longer than refill_bytes.
+                data += self._spill_file.read(end - len(data))
+            url = data[pos + header_size:end].decode("utf-8")
+            self._push(FrontierItem(url, priority, depth))
+            self._spilled_count -= 1
+            pos = end
+        self._read_offset += pos
+
+        if self._spilled_count == 0:
+            self._spill_file.truncate(0)
+            self._read_offset = 0
+        self.cond.notify_all()
+
+    def put(self,
+            url: str,
+            block: bool = True,
+            timeout: Optional[float] = None,
+            priority: int = 0,
+            depth: int = 0,
+            ):
+        """
+        Add a url. When the memory is full, the url evicts the lowest entry to disk if it outranks it,
+        otherwise the url itself goes to disk. Never blocks.
+        """
+        item = FrontierItem(url, priority, depth)
+        with self.cond:
+            if self._size >= self.maxsize:
+                evicted = self._evict_for(item)
+                if evicted is None:
+                    self._spill(item)
+                    return
+                self._spill(evicted)
+            self._push(item)
+            self.cond.notify_all()
+
+    def qsize(self) -> int:
+        """
+        The number of urls held, in memory and on disk.
+        """
+        with self.cond:
+            return self._size + self._spilled_count
+
+    def spilled_count(self) -> int:
+        with self.cond:
+            return self._spilled_count
+
+    def full(self) -> bool:
+        return False
+
+    def spill_state(self) -> dict:
+        """
+        Flush the spill file and return what is needed to reopen it, see the parameters of __init__.
+        snapshot() only holds the urls in memory, the others are in the spill file.
+        """
+        with self.cond:
+            self._spill_file.flush()
+            return {
+                "read_offset": self._read_offset,
+                "spilled_count": self._spilled_count,
+            }
+
+    def copy_spill_to(self, path: str) -> dict:
+        """
+        Copy the spill file as it is now, with nothing appended meanwhile.
+        :param path: the file to copy to.
+        :return: the spill_state of the copy.
+        """
+        with self.cond:
+            spill_state = self.spill_state()
+            os.makedirs(osp.dirname(osp.abspath(path)), exist_ok=True)
+            utils.clone_file(self.spill_path, path)
+            return spill_state
+
+    def close(self):
+        with self.cond:
+            self._spill_file.close()
+
+    def __str__(self):
+        return f"SpillingFrontier(size={self._size}, spilled={self._spilled_count}, maxsize={self.maxsize}, " \
+               f"hosts={len(self._host_heaps)}, spill_path={self.spill_path})"
+
+    __repr__ = __str__
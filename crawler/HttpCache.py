@@ -0,0 +1,131 @@
+"""
+The validators of the pages fetched, for conditional GETs when they are fetched again.
+
+Hub pages (the seeds of zhibo8, the listing pages) are fetched again and again, on every resumed crawl.
+For every page fetched, the cache keeps, by the url normalized with utils.as_unique_url, query kept
+(the seeds of zhibo8 differ only in their query):
+- the ETag and Last-Modified headers of the response, sent back as If-None-Match and If-Modified-Since,
+  so that a server honouring them answers 304 Not Modified without the body.
+- a hash of the body, so that a page sent again in full but unchanged is not parsed again.
+
+The cache is bounded: past max_entries, the least recently used urls are dropped.
+
+File structure:
+| HttpCache.json: the parameters and the entries of the HttpCache.
+"""
+import collections
+import hashlib
+import json
+import os
+import os.path as osp
+import threading
+from typing import NamedTuple, Optional
+
+import utils
+
+
+class HttpCacheEntry(NamedTuple):
+    etag: Optional[str]
+    last_modified: Optional[str]
+    content_hash: str
+
+
+def content_hash(content: bytes) -> str:
+    return hashlib.blake2b(content, digest_size=16).hexdigest()
+
+
+class HttpCache:
+
+    def __init__(self,
+                 max_entries: int = 100000,
+                 state_dict: Optional[dict] = None,
+                 ):
+        """
+        :param max_entries: the number of urls kept, the least recently used ones are dropped first.
+        :param state_dict: used when loading, see load_from.
+        """
+        self.lock = threading.Lock()
+        if state_dict is not None:
+            self.max_entries = state_dict["max_entries"]
+            self.entries = collections.OrderedDict(
+                (url, HttpCacheEntry(*entry)) for url, entry in state_dict["entries"])
+        else:
+            self.max_entries = max_entries
+            self.entries = collections.OrderedDict()
+
+    def get(self, url: str) -> Optional[HttpCacheEntry]:
+        key = utils.as_unique_url(url, keep_query=True)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+            return entry
+
+    def validators(self, url: str) -> dict:
+        """
+        The headers making a GET of the url conditional, empty if the url is not cached.
+        """
+        entry = self.get(url)
+        headers = {}
+        if entry is not None:
+            if entry.etag:
+                headers["If-None-Match"] = entry.etag
+            if entry.last_modified:
+                headers["If-Modified-Since"] = entry.last_modified
+        return headers
+
+    def is_unchanged(self, url: str, content: bytes) -> bool:
+        """
+        Whether a body fetched in full is the one cached, i.e. the page need not be parsed again.
+        """
+        entry = self.get(url)
+        return entry is not None and entry.content_hash == content_hash(content)
+
+    def update(self, url: str, content: bytes, etag: Optional[str] = None, last_modified: Optional[str] = None):
+        """
+        Record a page fetched in full.
+        """
+        key = utils.as_unique_url(url, keep_query=True)
+        entry = HttpCacheEntry(etag, last_modified, content_hash(content))
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def copy(self):
+        """
+        A copy of the cache, e.g. to save a snapshot from while this one keeps being updated.
+        """
+        with self.lock:
+            return HttpCache(state_dict=self.as_state_dict())
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __str__(self):
+        return f"HttpCache(max_entries={self.max_entries}, entries={len(self.entries)})"
+
+    __repr__ = __str__
+
+    def as_state_dict(self):
+        return {
+            "max_entries": self.max_entries,
+            "entries": [(url, list(entry)) for url, entry in self.entries.items()],
+        }
+
+    def save_to(self, path: str, filename="HttpCache.json"):
+        os.makedirs(path, exist_ok=True)
+        with self.lock:
+            state_dict = self.as_state_dict()
+        with open(osp.join(path, filename), "w") as f:
+            json.dump(state_dict, f)
+
+    @staticmethod
+    def load_from(path, filename="HttpCache.json"):
+        _filepath = osp.join(path, filename)
+        if not osp.exists(_filepath):
+            raise FileNotFoundError(f"File {_filepath} not found!")
+        with open(_filepath, "r") as f:
+            state_dict = json.load(f)
+        return HttpCache(state_dict=state_dict)
@@ -83,8 +83,8 @@ class ImageRetriever:
         if self.fileset_directory is not None and load_fileset:
             # None means this ImageRetriever is only used for reading.
             # Not None means this ImageRetriever is to be run.
-            self.fileset = fs.FileSet.load_from(self.fileset_directory,
-                                                mode='append-full-load', )
+            # opened without reading the entries, the ones processed already are not read at all.
+            self.fileset = fs.FileSetReader(self.fileset_directory)
 
         logger.info(f'ImageRetriever {"initialized" if state_dict is None else "loaded"}: {self}')
 
@@ -115,10 +115,12 @@ class ImageRetriever:
     def run(self, iterations=None):
         cur_done_count = self.done_count
         this_count = 0
+        # the entries saved since, e.g. by a crawler still running.
+        self.fileset.refresh()
 
         for entry_index in range(cur_done_count, len(self.fileset)):
             logger.info(f'Processing entry {entry_index:4d}...')
-            entry: fs.FileSetRecordedEntry = self.fileset.recorded_entries[entry_index]
+            entry: fs.FileSetRecordedEntry = self.fileset[entry_index]
 
             self._process_entry(entry)
 
@@ -165,13 +167,13 @@ class ImageRetriever:
         self.save()
 
     def _process_entry(self, entry: fs.FileSetRecordedEntry, skip_failed=False):
-        filename = entry.content_filename
-        url = entry.url
-        filepath = osp.join(self.fileset_directory, 'contents', filename)
-        with open(filepath, 'rb') as f:
-            content = f.read()
-
-        new_image_srcs = set(ru.parse_all_img_src(content, url))
+        sidecar = self.fileset.read_sidecar(entry)
+        if sidecar is not None:
+            # extracted when the page was crawled, no need to parse it again.
+            new_image_srcs = set(sidecar['img_srcs'])
+        else:
+            content = self.fileset.read_content(entry)
+            new_image_srcs = set(ru.parse_all_img_src(content, entry.url))
 
         filtered_image_srcs = set(filter(self._filter, new_image_srcs))
 
@@ -0,0 +1,187 @@
+"""
+Append-only segment files holding the contents of a FileSet, instead of one file per content.
+
+Each content is appended to the current segment as a record. A new segment is started once the current one
+would grow past segment_size. A content is located by its segment, the offset of its record and its length,
+which the FileSet records as the content_filename of the entry, e.g. "segment-000003.seg@1048576+20480".
+The contents are read through read-only memory maps of the segments.
+
+Inserting is a sequential append, and the corpus is a few large files, cheap to list and to back up.
+
+Record framing:
+| payload length (uint32) | crc32 of payload (uint32) | payload |
+
+File structure:
+| segment-{n:06d}.seg
+"""
+import mmap
+import os
+import os.path as osp
+import re
+import struct
+import threading
+import zlib
+from typing import Dict, Iterable, List, NamedTuple, Optional
+
+RECORD_HEADER = struct.Struct("<II")
+
+DEFAULT_SEGMENT_SIZE = 256 * 1024 * 1024
+
+_SEGMENT_FILENAME_PATTERN = re.compile(r"^segment-(\d{6})\.seg$")
+_LOCATION_PATTERN = re.compile(r"^(segment-\d{6}\.seg)@(\d+)\+(\d+)$")
+
+
+class SegmentLocation(NamedTuple):
+    segment_filename: str
+    # of the record, i.e. of its header.
+    offset: int
+    # of the payload.
+    length: int
+
+
+def segment_filename(index: int) -> str:
+    return f"segment-{index:06d}.seg"
+
+
+def list_segments(directory) -> List[int]:
+    if not osp.exists(directory):
+        return []
+    indices = []
+    for filename in os.listdir(directory):
+        match = _SEGMENT_FILENAME_PATTERN.match(filename)
+        if match:
+            indices.append(int(match.group(1)))
+    return sorted(indices)
+
+
+def format_location(location: SegmentLocation) -> str:
+    return f"{location.segment_filename}@{location.offset}+{location.length}"
+
+
+def parse_location(content_filename: str) -> Optional[SegmentLocation]:
+    """
+    :return: None if content_filename is not a segment location, e.g. "12.html" of a content in its own file.
+    """
+    match = _LOCATION_PATTERN.match(content_filename)
+    if match is None:
+        return None
+    return SegmentLocation(match.group(1), int(match.group(2)), int(match.group(3)))
+
+
+def is_segment_location(content_filename: str) -> bool:
+    return parse_location(content_filename) is not None
+
+
+class SegmentStore:
+
+    def __init__(self,
+                 directory: str,
+                 segment_size: int = DEFAULT_SEGMENT_SIZE,
+                 ):
+        """
+        Nothing is opened before the first append or read.
+        :param directory: where the segments live.
+        :param segment_size: the size past which a new segment is started. A larger content gets a segment of its own.
+        """
+        self.directory = directory
+        self.segment_size = segment_size
+        self.lock = threading.Lock()
+        self.maps_lock = threading.Lock()
+        self._maps: Dict[str, mmap.mmap] = {}
+        # the segment appended to, opened on the first append.
+        self._file = None
+        self._segment_index = 0
+        self._segment_bytes = 0
+
+    def _open_segment(self, index: int):
+        os.makedirs(self.directory, exist_ok=True)
+        path = osp.join(self.directory, segment_filename(index))
+        self._file = open(path, "ab")
+        self._segment_index = index
+        self._segment_bytes = osp.getsize(path)
+
+    def append(self, content: bytes) -> str:
+        """
+        Append a content to the current segment.
+        :return: its location, for read.
+        """
+        record = RECORD_HEADER.pack(len(content), zlib.crc32(content)) + content
+        with self.lock:
+            if self._file is None:
+                indices = list_segments(self.directory)
+                self._open_segment(indices[-1] if indices else 0)
+            if self._segment_bytes > 0 and self._segment_bytes + len(record) > self.segment_size:
+                self._file.close()
+                self._open_segment(self._segment_index + 1)
+            offset = self._segment_bytes
+            self._file.write(record)
+            # readers map the file, the record must not sit in the buffer.
+            self._file.flush()
+            self._segment_bytes += len(record)
+            return format_location(SegmentLocation(segment_filename(self._segment_index), offset, len(content)))
+
+    def read(self, content_filename: str) -> bytes:
+        """
+        :param content_filename: a location returned by append.
+        :return: the content.
+        """
+        location = parse_location(content_filename)
+        if location is None:
+            raise ValueError(f"{content_filename} is not a segment location")
+        start = location.offset + RECORD_HEADER.size
+        segment_map = self._map_covering(location.segment_filename, start + location.length)
+        length, crc = RECORD_HEADER.unpack_from(segment_map, location.offset)
+        content = segment_map[start:start + length]
+        if length != location.length or zlib.crc32(content) != crc:
+            raise ValueError(f"Corrupted record at {content_filename}")
+        return content
+
+    def _map_covering(self, filename: str, end: int) -> mmap.mmap:
+        with self.maps_lock:
+            segment_map = self._maps.get(filename)
+            if segment_map is None or len(segment_map) < end:
+                # the segment appended to has grown since it was mapped. The old map is left to the readers
+                # still holding it, and closed when they drop it.
+                with open(osp.join(self.directory, filename), "rb") as f:
+                    segment_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                if len(segment_map) < end:
+                    raise ValueError(f"{filename} ends before byte {end}")
+                self._maps[filename] = segment_map
+            return segment_map
+
+    def close(self):
+        with self.lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+        with self.maps_lock:
+            self._maps = {}
+
+    def __str__(self):
+        return f"SegmentStore(directory={self.directory}, segment_size={self.segment_size})"
+
+    __repr__ = __str__
+
+    @staticmethod
+    def truncate_to(directory: str, content_filenames: Iterable[str]):
+        """
+        Roll the segments back to the contents located by content_filenames, e.g. the entries of a snapshot:
+        the records appended after the last of them are removed. Not to be called while a store appends.
+        :param directory:
+        :param content_filenames: the locations kept. Those that are not segment locations are ignored.
+        :return:
+        """
+        ends = {}
+        for content_filename in content_filenames:
+            location = parse_location(content_filename)
+            if location is not None:
+                end = location.offset + RECORD_HEADER.size + location.length
+                ends[location.segment_filename] = max(ends.get(location.segment_filename, 0), end)
+        last_index = max((int(_SEGMENT_FILENAME_PATTERN.match(filename).group(1)) for filename in ends),
+                         default=-1)
+        for index in list_segments(directory):
+            path = osp.join(directory, segment_filename(index))
+            if index > last_index:
+                os.remove(path)
+            elif index == last_index and osp.getsize(path) > ends[segment_filename(index)]:
+                os.truncate(path, ends[segment_filename(index)])
@@ -0,0 +1,224 @@
+"""
+The entries of a FileSet by url, so that the saved page of a url is found without scanning the entries.
+
+Each url is kept as its 64-bit fingerprint (see FingerprintSet.fingerprint) with the index of its entry in the
+FileSet. A url saved more than once has a pair per entry, a lookup gives the latest one.
+- the bulk of the pairs is an array sorted by fingerprint then entry id, in a .npy file, memory-mapped read-only.
+  a lookup is a binary search.
+- new pairs go into an in-memory delta, which is merged into the sorted file once it holds merge_threshold pairs.
+  a save writes the delta as a small sorted run of its own, loaded back into the delta, so that a save costs
+  the size of the delta and not of the whole index.
+
+A lookup may give the entry of another url with the same fingerprint: the FileSet checks the url of the entry.
+
+The index is derived from the entries: indexed_count is the number of entries it covers. The FileSet indexes the
+entries past it when loaded, and a rollback to a snapshot drops the entries past the snapshot, see truncate.
+
+File structure:
+| UrlIndex.json: the parameters of the UrlIndex.
+| url_index.npy: the sorted (fingerprint, entry id) pairs.
+| url_index_delta.npy: the delta as of the last save, sorted the same way. Removed when the delta is merged.
+"""
+import json
+import os
+import os.path as osp
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+import FingerprintSet as fps
+
+PAIR_DTYPE = np.dtype([("fingerprint", "<u8"), ("entry_id", "<i8")])
+
+
+class UrlIndex:
+
+    def __init__(self,
+                 directory: str = None,
+                 merge_threshold: int = 65536,
+                 state_dict: Optional[dict] = None,
+                 ):
+        """
+        :param directory: where the sorted file lives. A new UrlIndex starts empty.
+        :param merge_threshold: the size of the delta that triggers a merge into the sorted file.
+        :param state_dict: used when loading, see load_from.
+        """
+        self.lock = threading.Lock()
+        # the pairs not merged yet, and the latest entry id of each of their fingerprints.
+        self.delta: List[Tuple[int, int]] = []
+        self.delta_latest: Dict[int, int] = {}
+
+        if state_dict is not None:
+            self.directory = state_dict["directory"]
+            self.merge_threshold = state_dict["merge_threshold"]
+            self.indexed_count = state_dict["indexed_count"]
+            self.sorted = state_dict["sorted"]
+        else:
+            self.directory = directory
+            self.merge_threshold = merge_threshold
+            self.indexed_count = 0
+            os.makedirs(directory, exist_ok=True)
+            self._write_sorted(np.zeros(0, dtype=PAIR_DTYPE))
+
+    @property
+    def _sorted_filepath(self):
+        return osp.join(self.directory, "url_index.npy")
+
+    @property
+    def _delta_filepath(self):
+        return osp.join(self.directory, "url_index_delta.npy")
+
+    def _write_sorted(self, array: np.ndarray):
+        """
+        Replace the sorted file and map the new one, see FingerprintSet._write_sorted.
+        """
+        tmp_filepath = self._sorted_filepath + ".tmp.npy"
+        np.save(tmp_filepath, array)
+        os.replace(tmp_filepath, self._sorted_filepath)
+        self.sorted = np.load(self._sorted_filepath, mmap_mode="r")
+
+    def _merge(self):
+        """
+        Merge the delta into the sorted file. Must be called with self.lock held.
+        """
+        if not self.delta:
+            return
+        delta = np.array(self.delta, dtype=PAIR_DTYPE)
+        merged = np.concatenate([self.sorted, delta])
+        merged = merged[np.lexsort((merged["entry_id"], merged["fingerprint"]))]
+        self._write_sorted(merged)
+        # its pairs are in the sorted file now.
+        if osp.exists(self._delta_filepath):
+            os.remove(self._delta_filepath)
+        self.delta = []
+        self.delta_latest = {}
+
+    def _write_delta(self):
+        """
+        Write the delta as a sorted run. Must be called with self.lock held.
+        """
+        delta = np.array(self.delta, dtype=PAIR_DTYPE)
+        delta = delta[np.lexsort((delta["entry_id"], delta["fingerprint"]))]
+        tmp_filepath = self._delta_filepath + ".tmp.npy"
+        np.save(tmp_filepath, delta)
+        os.replace(tmp_filepath, self._delta_filepath)
+
+    def _add(self, fp: int, entry_id: int):
+        self.delta.append((fp, entry_id))
+        if entry_id >= self.delta_latest.get(fp, -1):
+            self.delta_latest[fp] = entry_id
+        self.indexed_count = max(self.indexed_count, entry_id + 1)
+
+    def add(self, url: str, entry_id: int):
+        with self.lock:
+            self._add(fps.fingerprint(url), entry_id)
+            if len(self.delta) >= self.merge_threshold:
+                self._merge()
+
+    def add_many(self, urls, start_id: int):
+        """
+        Index the urls of consecutive entries.
+        :param urls:
+        :param start_id: the entry id of the first url.
+        """
+        with self.lock:
+            for i, fp in enumerate(fps.fingerprints(urls).tolist()):
+                self._add(fp, start_id + i)
+            if len(self.delta) >= self.merge_threshold:
+                self._merge()
+
+    def lookup(self, url: str) -> Optional[int]:
+        """
+        :return: the latest entry id of the url, None if it is not indexed.
+                 Possibly the entry of another url with the same fingerprint.
+        """
+        fp = fps.fingerprint(url)
+        with self.lock:
+            entry_id = self.delta_latest.get(fp)
+            if entry_id is not None:
+                # the delta only holds entries newer than the sorted ones.
+                return entry_id
+            _sorted = self.sorted
+        fingerprints = _sorted["fingerprint"]
+        right = int(np.searchsorted(fingerprints, np.uint64(fp), side="right"))
+        if right == 0 or int(fingerprints[right - 1]) != fp:
+            return None
+        return int(_sorted["entry_id"][right - 1])
+
+    def truncate(self, count: int):
+        """
+        Drop the entries from count on, e.g. those rolled back to a snapshot.
+        """
+        with self.lock:
+            if any(entry_id >= count for entry_id in self.delta_latest.values()):
+                self.delta = [(fp, entry_id) for fp, entry_id in self.delta if entry_id < count]
+                self.delta_latest = {}
+                for fp, entry_id in self.delta:
+                    if entry_id >= self.delta_latest.get(fp, -1):
+                        self.delta_latest[fp] = entry_id
+            # the sorted file may hold entries past indexed_count, merged after the last save.
+            if len(self.sorted) > 0 and self.sorted["entry_id"].max() >= count:
+                self._write_sorted(np.array(self.sorted[self.sorted["entry_id"] < count]))
+            self.indexed_count = min(self.indexed_count, count)
+
+    def __len__(self):
+        return len(self.sorted) + len(self.delta)
+
+    def __str__(self):
+        return f"UrlIndex(directory={self.directory}, indexed_count={self.indexed_count}, " \
+               f"sorted={len(self.sorted)}, delta={len(self.delta)})"
+
+    __repr__ = __str__
+
+    def as_state_dict(self):
+        return {
+            "directory": self.directory,
+            "merge_threshold": self.merge_threshold,
+            "indexed_count": self.indexed_count,
+            "sorted": self.sorted,
+        }
+
+    def save(self, filename="UrlIndex.json"):
+        """
+        Save the delta as a sorted run and the parameters, in the directory of the UrlIndex.
+        The sorted file is only rewritten by a merge, once the delta holds merge_threshold pairs.
+        """
+        with self.lock:
+            if len(self.delta) >= self.merge_threshold:
+                self._merge()
+            elif self.delta:
+                self._write_delta()
+            elif osp.exists(self._delta_filepath):
+                # e.g. all truncated away.
+                os.remove(self._delta_filepath)
+            state_dict = self.as_state_dict()
+            state_dict_to_json = {k: v for k, v in state_dict.items() if k not in ("directory", "sorted")}
+            with open(osp.join(self.directory, filename), "w") as f:
+                json.dump(state_dict_to_json, f)
+
+    @staticmethod
+    def load_from(path, filename="UrlIndex.json"):
+        """
+        Load the UrlIndex from a directory, memory-mapping the sorted file and reading the delta run back
+        into the delta. The loaded UrlIndex keeps working in that directory.
+        """
+        _filepath = osp.join(path, filename)
+        _sorted_filepath = osp.join(path, "url_index.npy")
+        if not osp.exists(_filepath):
+            raise FileNotFoundError(f"File {_filepath} not found!")
+        if not osp.exists(_sorted_filepath):
+            raise FileNotFoundError(f"File {_sorted_filepath} not found!")
+        with open(_filepath, "r") as f:
+            state_dict = json.load(f)
+
+        state_dict["directory"] = path
+        state_dict["sorted"] = np.load(_sorted_filepath, mmap_mode="r")
+        url_index = UrlIndex(state_dict=state_dict)
+
+        _delta_filepath = osp.join(path, "url_index_delta.npy")
+        if osp.exists(_delta_filepath):
+            delta = np.load(_delta_filepath)
+            for fp, entry_id in zip(delta["fingerprint"].tolist(), delta["entry_id"].tolist()):
+                url_index._add(fp, entry_id)
+        return url_index
@@ -0,0 +1,218 @@
+"""
+An append-only write-ahead log of what the crawler did since its last checkpoint.
+
+The workers append a record for every url enqueued, every url fetched and every file saved.
+A checkpoint (Crawler.save) rotates the log to a new generation, and once the checkpoint is on disk
+the older generations are removed. After a crash, the last checkpoint is loaded and the generations
+since are replayed, so that the crawler recovers to its last record.
+
+Record framing:
+| payload length (uint32) | crc32 of type and payload (uint32) | type (uint8) | payload |
+
+Payloads:
+- ENQUEUE: | priority (int32) | depth (int32) | url (utf-8) |
+- FETCHED: | url (utf-8) |
+- SAVED: the FileSetRecordedEntry as a json list.
+
+A record cut short by a crash fails its length or crc check, reading stops there and the tail is truncated.
+
+File structure:
+| wal-{generation:08d}.log
+"""
+import json
+import os
+import os.path as osp
+import re
+import struct
+import threading
+import zlib
+from typing import Iterator, List, NamedTuple, Tuple
+
+import FileSet as fs
+import Frontier
+
+ENQUEUE = 1
+FETCHED = 2
+SAVED = 3
+
+RECORD_HEADER = struct.Struct("<IIB")
+ENQUEUE_HEADER = struct.Struct("<ii")
+
+_WAL_FILENAME_PATTERN = re.compile(r"^wal-(\d{8})\.log$")
+
+
+class WalRecord(NamedTuple):
+    generation: int
+    type: int
+    # a Frontier.FrontierItem for ENQUEUE, a url for FETCHED, a fs.FileSetRecordedEntry for SAVED.
+    value: object
+
+
+def wal_filename(generation: int) -> str:
+    return f"wal-{generation:08d}.log"
+
+
+def list_generations(directory) -> List[int]:
+    if not osp.exists(directory):
+        return []
+    generations = []
+    for filename in os.listdir(directory):
+        match = _WAL_FILENAME_PATTERN.match(filename)
+        if match:
+            generations.append(int(match.group(1)))
+    return sorted(generations)
+
+
+def encode_record(record_type: int, payload: bytes) -> bytes:
+    crc = zlib.crc32(payload, zlib.crc32(bytes([record_type])))
+    return RECORD_HEADER.pack(len(payload), crc, record_type) + payload
+
+
+def encode_enqueue(item: Frontier.FrontierItem) -> bytes:
+    return encode_record(ENQUEUE, ENQUEUE_HEADER.pack(item.priority, item.depth) + item.url.encode("utf-8"))
+
+
+def encode_fetched(url: str) -> bytes:
+    return encode_record(FETCHED, url.encode("utf-8"))
+
+
+def encode_saved(entry: fs.FileSetRecordedEntry) -> bytes:
+    return encode_record(SAVED, json.dumps(list(entry)).encode("utf-8"))
+
+
+def decode_payload(record_type: int, payload: bytes):
+    if record_type == ENQUEUE:
+        priority, depth = ENQUEUE_HEADER.unpack_from(payload)
+        return Frontier.FrontierItem(payload[ENQUEUE_HEADER.size:].decode("utf-8"), priority, depth)
+    if record_type == FETCHED:
+        return payload.decode("utf-8")
+    if record_type == SAVED:
+        return fs.FileSetRecordedEntry(*json.loads(payload.decode("utf-8")))
+    raise ValueError(f"Unknown record type {record_type}")
+
+
+def scan_records(data: bytes) -> Tuple[List[Tuple[int, bytes]], int]:
+    """
+    Split the content of a log file into records, stopping at the first torn or corrupted one.
+    :return: the (type, payload) of the valid records, and the length of the valid prefix of data.
+    """
+    records = []
+    pos = 0
+    while pos + RECORD_HEADER.size <= len(data):
+        length, crc, record_type = RECORD_HEADER.unpack_from(data, pos)
+        end = pos + RECORD_HEADER.size + length
+        if end > len(data):
+            break
+        payload = data[pos + RECORD_HEADER.size:end]
+        if zlib.crc32(payload, zlib.crc32(bytes([record_type]))) != crc:
+            break
+        records.append((record_type, payload))
+        pos = end
+    return records, pos
+
+
+def read_records(directory, from_generation: int = 0) -> Iterator[WalRecord]:
+    """
+    Read the records of the generations from from_generation on, in the order they were written.
+    """
+    for generation in list_generations(directory):
+        if generation < from_generation:
+            continue
+        with open(osp.join(directory, wal_filename(generation)), "rb") as f:
+            records, _ = scan_records(f.read())
+        for record_type, payload in records:
+            yield WalRecord(generation, record_type, decode_payload(record_type, payload))
+
+
+class WriteAheadLog:
+
+    def __init__(self,
+                 directory: str,
+                 generation: int = 0,
+                 fsync: bool = False,
+                 ):
+        """
+        Open the log for appending, at the latest generation found in the directory, at least generation.
+        A torn record at the end of that generation is truncated.
+        :param directory:
+        :param generation: the generation of the last checkpoint.
+        :param fsync: fsync after every append, so that records also survive a power loss, not only a crash.
+        """
+        self.directory = directory
+        self.fsync = fsync
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+        self.generation = max(list_generations(directory) + [generation])
+        self._truncate_torn_tail()
+        self._file = open(self._filepath(self.generation), "ab")
+
+    def _filepath(self, generation):
+        return osp.join(self.directory, wal_filename(generation))
+
+    def _truncate_torn_tail(self):
+        filepath = self._filepath(self.generation)
+        if not osp.exists(filepath):
+            return
+        with open(filepath, "rb") as f:
+            data = f.read()
+        _, valid_length = scan_records(data)
+        if valid_length < len(data):
+            with open(filepath, "r+b") as f:
+                f.truncate(valid_length)
+
+    def _write(self, data: bytes):
+        with self.lock:
+            self._file.write(data)
+            # flushed to the OS at once, so that a crash of the process loses nothing.
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+
+    def log_enqueue(self, items):
+        """
+        :param items: FrontierItems, written in a single write.
+        """
+        data = b"".join(encode_enqueue(item) for item in items)
+        if data:
+            self._write(data)
+
+    def log_fetched(self, url: str):
+        self._write(encode_fetched(url))
+
+    def log_saved(self, entry: fs.FileSetRecordedEntry):
+        self._write(encode_saved(entry))
+
+    def rotate(self) -> int:
+        """
+        Start a new generation. The records appended from now on belong to it.
+        :return: the new generation.
+        """
+        with self.lock:
+            self._file.close()
+            self.generation += 1
+            self._file = open(self._filepath(self.generation), "ab")
+            return self.generation
+
+    def remove_before(self, generation: int):
+        """
+        Remove the generations older than generation, once a checkpoint covers them.
+        """
+        for old_generation in list_generations(self.directory):
+            if old_generation < generation:
+                os.remove(self._filepath(old_generation))
+
+    def size(self) -> int:
+        """
+        The total size of the log files in bytes.
+        """
+        return sum(osp.getsize(self._filepath(generation)) for generation in list_generations(self.directory))
+
+    def close(self):
+        with self.lock:
+            self._file.close()
+
+    def __str__(self):
+        return f"WriteAheadLog(directory={self.directory}, generation={self.generation}, fsync={self.fsync})"
+
+    __repr__ = __str__
@@ -28,8 +28,9 @@ def start_crawler(seed):
                                 interval_ms=3600,
                                 met_url_bf_capacity=1000000,
                                 saved_url_bf_capacity=1000000,
+                                scalable_bloom_filters=True,
                                 filter_config="sina")
-    d_crawler.queue.put(seed)
+    d_crawler.queue.put(seed, priority=Crawler.SEED_PRIORITY)
     d_crawler.run(epoch_count=1, secs=10, make_snapshot=True)
     d_crawler.save()
 
@@ -57,12 +58,14 @@ def start_zhibo8_crawler():
                                 interval_ms=4800,
                                 met_url_bf_capacity=1000000,
                                 saved_url_bf_capacity=1000000,
+                                scalable_bloom_filters=True,
                                 filter_config="zhibo8",
                                 max_queue_size=4000,
+                                spill_queue=True,
                                 )
-    d_crawler.queue.put(Crawler.zhibo8_seeds_quoted[0])
-    d_crawler.queue.put(Crawler.zhibo8_seeds_quoted[1])
-    d_crawler.queue.put(Crawler.zhibo8_seeds_quoted[-1])
+    d_crawler.queue.put(Crawler.zhibo8_seeds_quoted[0], priority=Crawler.SEED_PRIORITY)
+    d_crawler.queue.put(Crawler.zhibo8_seeds_quoted[1], priority=Crawler.SEED_PRIORITY)
+    d_crawler.queue.put(Crawler.zhibo8_seeds_quoted[-1], priority=Crawler.SEED_PRIORITY)
 
     d_crawler.run(epoch_count=2, secs=10, make_snapshot=True)
 
@@ -89,7 +92,7 @@ def resume_zhibo8_crawler(cache_path="./crawler_zhibo8_cache", epoch_count=30, s
         for _ in range(5):
             random_seed = random.choice(seeds)
             try:
-                crawler.queue.put(random_seed, block=False)
+                crawler.queue.put(random_seed, block=False, priority=Crawler.SEED_PRIORITY)
             except queue.Full:
                 pass
 
@@ -0,0 +1,55 @@
+"""
+Throughput of BloomFilter.add / __contains__ from several threads, under its single lock.
+
+Each thread works on its own slice of the keys, the same amount of work is split among the threads.
+
+usage: python benchmark_bloom_filter.py [key_count]
+"""
+import sys
+import threading
+import time
+
+import BloomFilter as bf
+
+THREAD_COUNTS = [1, 4, 8, 16]
+
+
+def make_keys(count):
+    return [f"https://news.zhibo8.com/zuqiu/2024-01-11/{i:013x}native.htm" for i in range(count)]
+
+
+def run_threads(thread_count, target, keys):
+    chunk = len(keys) // thread_count
+    threads = [threading.Thread(target=target, args=(keys[i * chunk:(i + 1) * chunk],))
+               for i in range(thread_count)]
+    start_time = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return chunk * thread_count / (time.perf_counter() - start_time)
+
+
+def bench(key_count):
+    keys = make_keys(key_count)
+
+    print(f"{key_count} keys, capacity 1e6, error rate 1e-5. Throughput in keys per second.")
+    print(f"{'threads':>8} {'add':>12} {'contains':>12}")
+    for thread_count in THREAD_COUNTS:
+        bloom_filter = bf.bloom_filter_maker(capacity=1000000, error_rate=1e-5)
+
+        def add(_keys):
+            for key in _keys:
+                bloom_filter.add(key)
+
+        def contains(_keys):
+            for key in _keys:
+                bloom_filter.__contains__(key)
+
+        add_rate = run_threads(thread_count, add, keys)
+        contains_rate = run_threads(thread_count, contains, keys)
+        print(f"{thread_count:>8} {add_rate:>12.0f} {contains_rate:>12.0f}")
+
+
+if __name__ == "__main__":
+    bench(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
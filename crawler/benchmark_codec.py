@@ -0,0 +1,85 @@
+"""
+Insert and read throughput of a FileSet per content codec, and the size of the contents on disk.
+
+For every codec of ContentCodec.CODECS (the zstd ones only with the zstandard package), the pages are
+inserted into a new FileSet with the 'segments' storage, then all read back with read_content.
+The -dict codecs train their dictionary from the first dictionary_samples pages.
+
+Without a directory, synthetic sina pages are generated: the same head, navigation and footer on every page,
+around an article of its own.
+
+usage: python benchmark_codec.py [directory of .html/.shtml files]
+"""
+import os
+import os.path as osp
+import random
+import sys
+import tempfile
+import time
+
+import ContentCodec as cc
+import FileSet as fs
+from benchmark_parse import load_pages
+
+
+def make_pages(page_count=2000):
+    rng = random.Random(0)
+    words = ["球队", "比赛", "进球", "教练", "转会", "联赛", "the", "match", "goal", "season", "coach", "league"]
+    head = ('<html><head><meta charset="utf-8"><title>{title}</title>'
+            '<link rel="stylesheet" href="https://n.sinaimg.cn/sports/css/main.css">'
+            '<script src="https://n.sinaimg.cn/sports/js/main.js"></script></head><body>\n')
+    navigation = "".join(f'<li class="nav-item"><a href="https://sports.sina.com.cn/{channel}/" target="_blank">'
+                         f'{channel}</a></li>\n' for channel in ("g/pl", "g/laliga", "china", "global/france", "nba",
+                                                                 "cba", "tennis", "golf", "others") * 8)
+    footer = "".join(f'<p class="footer-link"><a href="https://www.sina.com.cn/about/{i}.html">link {i}</a></p>\n'
+                     for i in range(40))
+    pages = []
+    for i in range(page_count):
+        paragraphs = "".join("<p>" + " ".join(rng.choice(words) for _ in range(80)) + "</p>\n"
+                             for _ in range(rng.randint(3, 12)))
+        article = (f'<div class="article" id="artibody"><h1 class="main-title">news {i}</h1>\n{paragraphs}'
+                   f'<img src="//n.sinaimg.cn/sports/{i}.jpg"></div>\n')
+        pages.append((head.format(title=f"news {i}") + f"<ul>{navigation}</ul>\n" + article + footer +
+                      "</body></html>").encode())
+    return pages
+
+
+def directory_size(directory):
+    return sum(osp.getsize(osp.join(root, filename))
+               for root, _, filenames in os.walk(directory) for filename in filenames)
+
+
+def bench_codec(pages, codec, directory):
+    fileset = fs.FileSet(directory=directory, storage="segments", codec=codec)
+    start_time = time.perf_counter()
+    entries = [fileset.insert(fs.as_insert_entry(page, f"https://sports.sina.com.cn/{i}", "", ""))
+               for i, page in enumerate(pages)]
+    insert_seconds = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    read_bytes = sum(len(fileset.read_content(entry)) for entry in entries)
+    read_seconds = time.perf_counter() - start_time
+    fileset.close()
+    assert read_bytes == sum(map(len, pages))
+    return insert_seconds, read_seconds, directory_size(osp.join(directory, "segments"))
+
+
+def bench(pages):
+    total_mb = sum(map(len, pages)) / 2 ** 20
+    print(f"{len(pages)} pages, {total_mb:.1f} MB. Throughputs in MB/s of the pages as they are.")
+    print(f"{'codec':>10} {'insert':>10} {'read':>10} {'on disk MB':>12} {'ratio':>8}")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for codec in cc.CODECS:
+            insert_seconds, read_seconds, disk_bytes = bench_codec(pages, codec, osp.join(tmp_dir, codec))
+            print(f"{codec:>10} {total_mb / insert_seconds:>10.1f} {total_mb / read_seconds:>10.1f} "
+                  f"{disk_bytes / 2 ** 20:>12.2f} {total_mb * 2 ** 20 / disk_bytes:>8.2f}")
+
+
+if __name__ == "__main__":
+    import loguru
+
+    loguru.logger.remove()
+    if len(sys.argv) > 1:
+        bench(load_pages(sys.argv[1]))
+    else:
+        bench(make_pages())
@@ -0,0 +1,92 @@
+"""
+Throughput of the parse stage of the crawler: lxml, the page extract, as_unique_url and the filters,
+over a directory of saved pages.
+
+The pages are parsed by:
+- threads: n threads calling request_utils.parse_page, as the workers do without parse_workers.
+- processes: a ProcessPoolExecutor of n processes fed with the raw bytes, as the workers do with parse_workers=n.
+
+Parsing holds the GIL, so threads don't parse faster than one, while the processes scale with the cores.
+Without a directory, synthetic sina pages with 200 links each are generated.
+
+usage: python benchmark_parse.py [directory of .html/.shtml files] [filter_config]
+"""
+import concurrent.futures
+import multiprocessing
+import os
+import os.path as osp
+import sys
+import tempfile
+import time
+
+import request_utils
+import utils
+
+
+def make_pages(directory, page_count=500):
+    for i in range(page_count):
+        links = "".join(f'<li><a href="/g/pl/2024-01-09/doc-{i:06d}{j:03d}.shtml?from=list">news {j}</a></li>'
+                        for j in range(200))
+        with open(osp.join(directory, f"doc-{i:06d}.shtml"), "w") as f:
+            f.write(f"<html><head><title>page {i}</title></head><body><ul>{links}</ul></body></html>")
+
+
+def load_pages(directory):
+    pages = []
+    for filename in sorted(os.listdir(directory)):
+        if filename.endswith((".html", ".shtml", ".htm")):
+            with open(osp.join(directory, filename), "rb") as f:
+                pages.append(f.read())
+    return pages
+
+
+def bench_threads(pages, home_url, filter_config, thread_count):
+    strict_filter = utils.strict_filter_recipe[filter_config]
+    loose_filter = utils.loose_filter_recipe[filter_config]
+    with concurrent.futures.ThreadPoolExecutor(thread_count) as executor:
+        start_time = time.perf_counter()
+        results = list(executor.map(
+            lambda content: request_utils.parse_page(content, home_url, strict_filter, loose_filter), pages))
+        return time.perf_counter() - start_time, results
+
+
+def bench_processes(pages, home_url, filter_config, process_count):
+    with concurrent.futures.ProcessPoolExecutor(process_count, mp_context=multiprocessing.get_context("spawn")) \
+            as executor:
+        # start the processes before timing.
+        list(executor.map(request_utils.parse_page_by_config, pages[:process_count],
+                          [home_url] * process_count, [filter_config] * process_count))
+        start_time = time.perf_counter()
+        results = list(executor.map(request_utils.parse_page_by_config, pages,
+                                    [home_url] * len(pages), [filter_config] * len(pages)))
+        return time.perf_counter() - start_time, results
+
+
+def bench(directory, filter_config):
+    home_url = "https://sports.sina.com.cn/" if filter_config == "sina" else "https://news.zhibo8.com/"
+    pages = load_pages(directory)
+    total_mb = sum(map(len, pages)) / 2 ** 20
+    print(f"{len(pages)} pages, {total_mb:.1f} MB, {os.cpu_count()} cores. Times in seconds.")
+    print(f"{'stage':>12} {'n':>4} {'time':>10} {'pages/s':>10} {'urls':>10}")
+
+    def report(stage, n, seconds, results):
+        url_count = sum(len(article_urls) + len(hub_urls) for _, article_urls, hub_urls in results)
+        print(f"{stage:>12} {n:>4} {seconds:>10.3f} {len(pages) / seconds:>10.1f} {url_count:>10}")
+
+    for thread_count in (1, 4):
+        report("threads", thread_count, *bench_threads(pages, home_url, filter_config, thread_count))
+    for process_count in sorted({1, 2, os.cpu_count() or 1}):
+        report("processes", process_count, *bench_processes(pages, home_url, filter_config, process_count))
+
+
+if __name__ == "__main__":
+    import loguru
+
+    loguru.logger.remove()
+    config = sys.argv[2] if len(sys.argv) > 2 else "sina"
+    if len(sys.argv) > 1:
+        bench(sys.argv[1], config)
+    else:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            make_pages(tmp_dir)
+            bench(tmp_dir, config)
@@ -0,0 +1,70 @@
+"""
+Save time and recovery time of the crawler state, with and without the write-ahead log.
+
+A crawler processes page_count synthetic pages, each saved and linking to 20 new urls, then:
+- process: the time of processing the pages, logging included with the write-ahead log.
+- save: the time of a full Crawler.save, paid every epoch without the write-ahead log,
+  every checkpoint_every epochs with it.
+- log MB: the size of the write-ahead log of the pages.
+- recover: the time of Crawler.recover, loading the last save and replaying the log since.
+
+usage: python benchmark_wal.py [page_count]
+"""
+import os.path as osp
+import sys
+import tempfile
+import time
+
+import loguru
+
+import Crawler
+
+
+def make_page(i):
+    url = f"https://sports.sina.com.cn/g/pl/2024-01-09/doc-{i:09d}.shtml"
+    links = "".join(f'<a href="https://sports.sina.com.cn/g/pl/2024-01-09/doc-{i:09d}{j:02d}.shtml">x</a>'
+                    for j in range(20))
+    return url, f"<html><body>{links}</body></html>".encode()
+
+
+def process_pages(crawler, pages):
+    start_time = time.perf_counter()
+    for url, content in pages:
+        crawler.process_page(url, content, "benchmark")
+    return time.perf_counter() - start_time
+
+
+def bench(page_count):
+    pages = [make_page(i) for i in range(page_count)]
+    print(f"{page_count} pages, 20 links each. Times in seconds.")
+    print(f"{'wal':>6} {'process':>10} {'save':>10} {'log MB':>10} {'recover':>10}")
+    for write_ahead_log in (False, True):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            directory = osp.join(tmp_dir, "crawler")
+            crawler = Crawler.Crawler(directory=directory, max_queue_size=100000,
+                                      met_url_bf_capacity=10 * page_count, saved_url_bf_capacity=10 * page_count,
+                                      write_ahead_log=write_ahead_log)
+            crawler.save()
+            process_s = process_pages(crawler, pages)
+
+            log_mb = crawler.wal.size() / 2 ** 20 if write_ahead_log else 0
+            if write_ahead_log:
+                # crash: nothing saved since the first save, recover from the log.
+                crawler.wal.close()
+                start_time = time.perf_counter()
+                recovered = Crawler.Crawler.recover(directory)
+                recover_s = time.perf_counter() - start_time
+                assert len(recovered.saved_content) == page_count
+                crawler = recovered
+            else:
+                recover_s = float("nan")
+
+            start_time = time.perf_counter()
+            crawler.save()
+            save_s = time.perf_counter() - start_time
+            print(f"{str(write_ahead_log):>6} {process_s:>10.3f} {save_s:>10.3f} {log_mb:>10.2f} {recover_s:>10.3f}")
+
+
+if __name__ == "__main__":
+    loguru.logger.remove()
+    bench(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
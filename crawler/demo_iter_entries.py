@@ -3,22 +3,25 @@ import os.path as osp
 import FileSet as fs
 
 """
-在FileSet中并没有直接建立从网页url到文件或entry的映射。使用了顺序存储，在entry组成的列表中，每个entry记录了网页的url，以及网页内容的文件名。
+FileSet使用了顺序存储，在entry组成的列表中，每个entry记录了网页的url，以及网页内容的文件名。
+若要按url查找已保存的网页，可以用FileSet.get_by_url(url)或FileSet.contains_url(url)，它们查询url到entry的索引(UrlIndex)，无需遍历。
 
-你可以顺序遍历FileSet中的entry，然后根据entry中的url，和用文件名拼接出的文件路径，在处理网页内容的时候知道原文url是什么。
+你可以顺序遍历FileSet中的entry，然后根据entry中的url，和用fileset.read_content读出的网页内容，在处理网页内容的时候知道原文url是什么。
+网页内容可能存放在contents/下的单独文件中，也可能存放在segments/下的段文件中，read_content对两者都适用。
 """
 
 
 def do_something(_fileset, _entry: fs.FileSetRecordedEntry):
-    file_path = osp.join(_fileset.directory, "contents", _entry.content_filename)
-    print(f"Url: {_entry.url}, File at: {file_path}")
+    content = _fileset.read_content(_entry)
+    print(f"Url: {_entry.url}, {len(content)} bytes at: {_entry.content_filename}")
 
 
 if __name__ == "__main__":
     crawler_file_directory = "./crawler_test_cache"
     fileset_directory = osp.join(crawler_file_directory, "saved_files")
 
-    fileset = fs.FileSet.load_from(fileset_directory, mode="append-full-load")
+    # 只读打开，不会一次性读入所有条目，爬虫运行时也可以打开。
+    fileset = fs.FileSetReader(fileset_directory)
 
-    for entry in fileset: # 其实是遍历fileset.recorded_entries
+    for entry in fileset: # 逐条读取条目
         do_something(fileset, entry)
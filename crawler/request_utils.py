@@ -1,15 +1,343 @@
+import http.client
 import urllib.parse
 import urllib.request
 import urllib.response
 import urllib.error
-from typing import Optional
+import zlib
+from collections import namedtuple
+from typing import Callable, Iterator, List, Optional, Tuple
 
 import loguru
 
-from lxml import html
+from lxml import etree
+
+import utils
+
+try:
+    import brotli
+except ImportError:
+    # optional, without it br is not accepted.
+    brotli = None
 
 logger = loguru.logger
 
+PageExtract = namedtuple(
+    'PageExtract',
+    ['links', 'img_srcs', 'title', 'text']
+)
+
+# the size of the chunks read from a response and fed to a PageExtractor.
+CHUNK_SIZE = 16 * 1024
+
+
+def _classes(attrib) -> set:
+    return set(attrib.get('class', '').split())
+
+
+# where the title and the body text are, the first rule matching wins, then the first element matching it:
+# sina: <h1 class="main-title">, <div class="article" id="artibody">
+# dongqiudi: <div class="news-left"> <h1 class="news-title">, <div class="con">
+# zhibo8: <div class="title"> <h1>, <div class="content">
+# anything else: <title>, and the paragraphs of the whole page.
+# a rule is (tag, attrib, ancestors, parent) -> bool, ancestors and parent being (tag, attrib) of the open elements.
+TITLE_RULES = [
+    lambda tag, attrib, ancestors, parent: tag == 'h1' and 'main-title' in _classes(attrib),
+    lambda tag, attrib, ancestors, parent: tag == 'h1' and 'news-title' in _classes(attrib) and any(
+        a_tag == 'div' and 'news-left' in _classes(a_attrib) for a_tag, a_attrib in ancestors),
+    lambda tag, attrib, ancestors, parent: tag == 'h1' and parent is not None and parent[0] == 'div' and
+                                           'title' in _classes(parent[1]),
+    lambda tag, attrib, ancestors, parent: tag == 'title',
+]
+BODY_RULES = [
+    lambda tag, attrib, ancestors, parent: tag == 'div' and attrib.get('id') == 'artibody',
+    lambda tag, attrib, ancestors, parent: tag == 'div' and 'con' in _classes(attrib) and any(
+        a_tag == 'div' and 'news-left' in _classes(a_attrib) for a_tag, a_attrib in ancestors),
+    lambda tag, attrib, ancestors, parent: tag == 'div' and 'content' in _classes(attrib),
+]
+
+
+def _absolute_url(ref: str, home_url: str) -> Optional[str]:
+    _new_url = urllib.parse.urljoin(home_url, ref)
+    _parse_result = urllib.parse.urlparse(_new_url)
+    if _parse_result.scheme not in ('http', 'https'):
+        return None
+    if _parse_result.netloc == '':
+        return None
+    return _new_url
+
+
+def _normalize_space(text: str) -> str:
+    return " ".join(text.split())
+
+
+class _Capture:
+    """
+    The text of an element being parsed: all of it, and its paragraphs.
+    """
+
+    def __init__(self, depth):
+        self.depth = depth
+        self.texts = []
+        self.paragraphs = []
+
+    def as_text(self) -> str:
+        if self.paragraphs:
+            return "\n".join(self.paragraphs)
+        return _normalize_space("".join(self.texts))
+
+
+class _ParserTarget:
+    """
+    The target of the lxml parser of a PageExtractor, forwarding the events to it.
+    """
+
+    def __init__(self, extractor):
+        self.start = extractor._start
+        self.end = extractor._end
+        self.data = extractor._data
+
+    def close(self):
+        pass
+
+
+class PageExtractor:
+    """
+    Extracts a page while it is being downloaded: the bytes are fed chunk by chunk to an lxml parser
+    with a target, no tree is built. The links and image srcs are known as soon as
+    their tags have been parsed, the title and text once the page is complete.
+
+    usage:
+        extractor = PageExtractor(url)
+        for chunk in chunks:
+            new_links = extractor.feed(chunk)  # enqueue them right away
+        page = extractor.close()
+    """
+
+    def __init__(self, home_url: str):
+        self.home_url = home_url
+        self.links = []
+        self.img_srcs = []
+        self._new_links = []
+        # the (tag, attrib) of the open elements.
+        self._stack = []
+        self._title_captures = [None] * len(TITLE_RULES)
+        self._body_captures = [None] * len(BODY_RULES)
+        # the captures of the open elements, the innermost last.
+        self._open_captures = []
+        self._page_paragraphs = []
+        self._paragraph: Optional[_Capture] = None
+        self._parser = etree.HTMLParser(target=_ParserTarget(self))
+
+    def feed(self, chunk: bytes) -> List[str]:
+        """
+        :return: the absolute links found since the last call.
+        """
+        self._parser.feed(chunk)
+        new_links, self._new_links = self._new_links, []
+        return new_links
+
+    def close(self) -> PageExtract:
+        """
+        End of the page.
+        :return: the PageExtract of the whole page. An empty one if it was not html.
+        """
+        try:
+            self._parser.close()
+        except etree.XMLSyntaxError as e:
+            logger.error(f"Failed to parse {self.home_url}: {e}")
+        title = next((_normalize_space("".join(c.texts)) for c in self._title_captures if c is not None), "")
+        text = next((c.as_text() for c in self._body_captures if c is not None and c.as_text()), "")
+        if not text:
+            text = "\n".join(self._page_paragraphs)
+        return PageExtract(self.links, self.img_srcs, title, text)
+
+    # the parser events.
+
+    def _start(self, tag, attrib):
+        if tag == 'a' and 'href' in attrib:
+            url = _absolute_url(attrib['href'], self.home_url)
+            if url is not None:
+                self.links.append(url)
+                self._new_links.append(url)
+        elif tag == 'img' and 'src' in attrib:
+            url = _absolute_url(attrib['src'], self.home_url)
+            if url is not None:
+                self.img_srcs.append(url)
+
+        parent = self._stack[-1] if self._stack else None
+        for captures, rules in ((self._title_captures, TITLE_RULES), (self._body_captures, BODY_RULES)):
+            for i, rule in enumerate(rules):
+                if captures[i] is None and rule(tag, attrib, self._stack, parent):
+                    captures[i] = _Capture(len(self._stack))
+                    self._open_captures.append(captures[i])
+        if tag == 'p' and self._paragraph is None:
+            self._paragraph = _Capture(len(self._stack))
+
+        self._stack.append((tag, dict(attrib)))
+
+    def _end(self, tag):
+        self._stack.pop()
+        depth = len(self._stack)
+        if self._paragraph is not None and self._paragraph.depth == depth:
+            paragraph_text = _normalize_space("".join(self._paragraph.texts))
+            if paragraph_text:
+                self._page_paragraphs.append(paragraph_text)
+                for capture in self._open_captures:
+                    capture.paragraphs.append(paragraph_text)
+            self._paragraph = None
+        while self._open_captures and self._open_captures[-1].depth >= depth:
+            self._open_captures.pop()
+
+    def _data(self, data):
+        for capture in self._open_captures:
+            capture.texts.append(data)
+        if self._paragraph is not None:
+            self._paragraph.texts.append(data)
+
+
+def iter_chunks(content: bytes, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+    for pos in range(0, len(content), chunk_size):
+        yield content[pos:pos + chunk_size]
+
+
+def extract_page(content: bytes, home_url: str) -> PageExtract:
+    """
+    Extract everything the later stages need from a page, in a single pass:
+    the links, the image srcs (both absolute), the title and the body text.
+    See TITLE_RULES and BODY_RULES for the page structures known, and PageExtractor to extract while downloading.
+    :param content:
+    :param home_url:
+    :return: a PageExtract. An empty one if the content is not html.
+    """
+    extractor = PageExtractor(home_url)
+    for chunk in iter_chunks(content):
+        extractor.feed(chunk)
+    return extractor.close()
+
+
+FetchResult = namedtuple(
+    'FetchResult',
+    ['url', 'status', 'content', 'etag', 'last_modified', 'wire_bytes', 'decoded_bytes'],
+    # the bytes of the body as sent, i.e. compressed, and once decoded.
+    defaults=(0, 0)
+)
+
+# a body larger than this once decoded is not read to the end.
+MAX_BODY_BYTES = 16 * 1024 * 1024
+
+ACCEPT_ENCODING = "gzip, deflate, br" if brotli is not None else "gzip, deflate"
+
+
+class BodyTooLargeError(ValueError):
+    pass
+
+
+# the errors of a request that are the server's or the network's fault, not ours.
+FETCH_ERRORS = (OSError, http.client.HTTPException, ValueError)
+
+
+class BodyReader:
+    """
+    Reads the body of a response chunk by chunk as it arrives, and decodes its Content-Encoding
+    (gzip, deflate, and br if the brotli package is installed) on the fly.
+    Iterating over it yields the decoded chunks, wire_bytes and decoded_bytes count the bytes so far.
+    Raises BodyTooLargeError past max_bytes decoded, ValueError if the body cannot be decoded.
+    """
+
+    def __init__(self, response, max_bytes: int = MAX_BODY_BYTES):
+        self.response = response
+        self.max_bytes = max_bytes
+        self.content_encoding = (response.headers.get("Content-Encoding") or "identity").strip().lower()
+        self.wire_bytes = 0
+        self.decoded_bytes = 0
+        self._zlib = None
+        self._brotli = None
+        if self.content_encoding in ("gzip", "x-gzip"):
+            self._zlib = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        elif self.content_encoding == "br" and brotli is not None:
+            self._brotli = brotli.Decompressor()
+        # deflate should be zlib-wrapped, but some servers send it raw. decided on the first bytes.
+
+    def _decode(self, data: bytes) -> bytes:
+        if self.content_encoding == "identity":
+            return data
+        if self.content_encoding == "br":
+            return self._brotli.process(data)
+        if self._zlib is None:
+            # a zlib header: CMF 0x78 and (CMF * 256 + FLG) a multiple of 31.
+            is_zlib = len(data) >= 2 and data[0] == 0x78 and (data[0] * 256 + data[1]) % 31 == 0
+            self._zlib = zlib.decompressobj(zlib.MAX_WBITS if is_zlib else -zlib.MAX_WBITS)
+        # never inflate past the limit, whatever the ratio of the data.
+        return self._zlib.decompress(data, self.max_bytes - self.decoded_bytes + 1)
+
+    def __iter__(self) -> Iterator[bytes]:
+        with self.response:
+            if self.content_encoding not in ("identity", "gzip", "x-gzip", "deflate") \
+                    and not (self.content_encoding == "br" and brotli is not None):
+                raise ValueError(f"Unsupported Content-Encoding {self.content_encoding}")
+            while True:
+                data = self.response.read1(CHUNK_SIZE)
+                if not data:
+                    return
+                self.wire_bytes += len(data)
+                try:
+                    chunk = self._decode(data)
+                except zlib.error as e:
+                    raise ValueError(f"Failed to decode the {self.content_encoding} body: {e}") from e
+                self.decoded_bytes += len(chunk)
+                if self.decoded_bytes > self.max_bytes:
+                    raise BodyTooLargeError(f"Body larger than {self.max_bytes} bytes")
+                if chunk:
+                    yield chunk
+
+
+def _open(url: str, user_agent, headers: Optional[dict] = None, timeout: float = 0.5):
+    """
+    Send a GET, accepting the compressed encodings BodyReader decodes.
+    :return: the response, or the FetchResult of a 304 Not Modified.
+    """
+    request = urllib.request.Request(url, headers=headers or {})
+    request.add_header("User-Agent", user_agent)
+    if not request.has_header("Accept-encoding"):
+        request.add_header("Accept-Encoding", ACCEPT_ENCODING)
+    try:
+        return urllib.request.urlopen(request, timeout=timeout)
+    except urllib.error.HTTPError as e:
+        if e.code == 304:
+            e.close()
+            return FetchResult(url, 304, None, e.headers.get("ETag"), e.headers.get("Last-Modified"))
+        raise
+
+
+def _result_of(url: str, response) -> FetchResult:
+    return FetchResult(url, response.status, None, response.headers.get("ETag"), response.headers.get("Last-Modified"))
+
+
+def fetch(url: str, user_agent, headers: Optional[dict] = None, max_bytes: int = MAX_BODY_BYTES) \
+        -> Optional[FetchResult]:
+    """
+    GET the url.
+    :param url:
+    :param user_agent:
+    :param headers: more request headers, e.g. the validators of HttpCache.HttpCache.validators.
+    :param max_bytes: the largest body to accept, once decoded.
+    :return: a FetchResult, with no content if the status is 304. None if the request failed.
+    """
+    try:
+        response = _open(url, user_agent, headers)
+        if isinstance(response, FetchResult):
+            return response
+        reader = BodyReader(response, max_bytes)
+        content = b"".join(reader)
+    except FETCH_ERRORS as e:
+        logger.error(f"{type(e).__name__}: {e} with url {url}")
+        return None
+    logger.debug(f"{url} : {reader.wire_bytes} bytes on the wire, {reader.decoded_bytes} decoded "
+                 f"({reader.content_encoding}).")
+    return _result_of(url, response)._replace(content=content, wire_bytes=reader.wire_bytes,
+                                              decoded_bytes=reader.decoded_bytes)
+
+
 @logger.catch()
 def get_content(url:str, user_agent) -> Optional[bytes]:
     """
@@ -19,23 +347,31 @@ def get_content(url:str, user_agent) -> Optional[bytes]:
     :param user_agent:
     :return:
     """
-    try:
-        request = urllib.request.Request(url)
-        request.add_header("User-Agent", user_agent)
-        response = urllib.request.urlopen(url, timeout=0.5)
-
-    except urllib.error.HTTPError as e:
-        logger.error(f"HTTPError: {e}")
+    result = fetch(url, user_agent)
+    if result is None:
         return None
-    except urllib.error.URLError as e:
-        logger.error(f"URLError: {e}")
-        return None
-    except Exception as e:
-        logger.error(f"Exception: {e}")
-        raise e
-        # return None
+    return result.content
+
 
-    return response.read()
+def open_content(url: str, user_agent, headers: Optional[dict] = None, max_bytes: int = MAX_BODY_BYTES) \
+        -> Optional[Tuple[FetchResult, Iterator[bytes]]]:
+    """
+    Like fetch, but the content is read chunk by chunk as it arrives, e.g. to feed a PageExtractor.
+    :param url:
+    :param user_agent:
+    :param headers: more request headers.
+    :param max_bytes: the largest body to accept, once decoded.
+    :return: the FetchResult without content, and a BodyReader (an empty iterator if the status is 304).
+             None if the request failed. Reading the chunks may raise one of FETCH_ERRORS if the connection breaks.
+    """
+    try:
+        response = _open(url, user_agent, headers)
+        if isinstance(response, FetchResult):
+            return response, iter(())
+        return _result_of(url, response), BodyReader(response, max_bytes)
+    except FETCH_ERRORS as e:
+        logger.error(f"{type(e).__name__}: {e} with url {url}")
+        return None
 
 
 @logger.catch()
@@ -43,42 +379,89 @@ def parse_all_urls(content: bytes, home_url: str):
     """
     Parse all urls in the content.
 
-    use bs4 to parse the content.
+    the urls are yielded as the content is parsed, see PageExtractor.
 
     :param content:
     :param home_url:
     :return:
     """
-    tree = html.fromstring(content)
-    for href in tree.xpath('//a/@href'):
-        _new_url = urllib.parse.urljoin(home_url, href)
-        _parse_result = urllib.parse.urlparse(_new_url)
-        if _parse_result.scheme not in ('http', 'https'):
-            continue
-        if _parse_result.netloc == '':
-            continue
-        yield _new_url
+    extractor = PageExtractor(home_url)
+    for chunk in iter_chunks(content):
+        yield from extractor.feed(chunk)
+    extractor.close()
+
 
 @logger.catch()
 def parse_all_img_src(content: bytes, home_url: str):
     """
     Parse all img src in the content.
 
-    use bs4 to parse the content.
-
     :param content:
     :param home_url:
     :return:
     """
-    tree = html.fromstring(content)
-    for src in tree.xpath('//img/@src'):
-        _new_url = urllib.parse.urljoin(home_url, src)
-        _parse_result = urllib.parse.urlparse(_new_url)
-        if _parse_result.scheme not in ('http', 'https'):
-            continue
-        if _parse_result.netloc == '':
-            continue
-        yield _new_url
+    return iter(extract_page(content, home_url).img_srcs)
+
+
+def sort_links(urls,
+               strict_filter: Callable[[str], bool],
+               loose_filter: Callable[[str], bool],
+               ) -> Tuple[List[str], List[str]]:
+    """
+    Normalize urls with utils.as_unique_url and sort them out with the filters.
+    :return: the urls passing the strict filter, and the other ones passing the loose filter. Without duplicates.
+    """
+    new_urls = set(map(utils.as_unique_url, urls))
+    strict_urls = []
+    loose_urls = []
+    for new_url in new_urls:
+        if strict_filter(new_url):
+            strict_urls.append(new_url)
+        elif loose_filter(new_url):
+            loose_urls.append(new_url)
+    return strict_urls, loose_urls
+
+
+def sort_links_by_config(urls, filter_config: str) -> Tuple[List[str], List[str]]:
+    """
+    sort_links with the filters of a filter_config, through the compiled and cached utils.classify_urls.
+    :return: the articles and the other urls in the domain, without duplicates, in the order they came.
+    """
+    normalized, is_article, is_in_domain = utils.classify_urls(urls, filter_config)
+    strict_urls = {}
+    loose_urls = {}
+    for url, article, in_domain in zip(normalized, is_article.tolist(), is_in_domain.tolist()):
+        if article:
+            strict_urls[url] = None
+        elif in_domain:
+            loose_urls[url] = None
+    return list(strict_urls), list(loose_urls)
+
+
+def parse_page(content: bytes,
+               home_url: str,
+               strict_filter: Callable[[str], bool],
+               loose_filter: Callable[[str], bool],
+               ) -> Tuple[PageExtract, List[str], List[str]]:
+    """
+    extract_page, then sort_links of its links.
+    :return: the PageExtract, the urls passing the strict filter and the other ones passing the loose filter.
+    """
+    page = extract_page(content, home_url)
+    strict_urls, loose_urls = sort_links(page.links, strict_filter, loose_filter)
+    return page, strict_urls, loose_urls
+
+
+def parse_page_by_config(content: bytes, home_url: str, filter_config: str) \
+        -> Tuple[PageExtract, List[str], List[str]]:
+    """
+    parse_page with the filters of a filter_config, see utils.strict_filter_recipe.
+    Only takes picklable arguments, for a process pool.
+    """
+    page = extract_page(content, home_url)
+    strict_urls, loose_urls = sort_links_by_config(page.links, filter_config)
+    return page, strict_urls, loose_urls
+
 
 def get_extension_from_image_src(image_src: str):
     parse_result = urllib.parse.urlparse(image_src)
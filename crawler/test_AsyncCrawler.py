@@ -0,0 +1,86 @@
+import http.server
+import os.path as osp
+import tempfile
+import threading
+import time
+from unittest import TestCase
+
+import AsyncCrawler
+
+HUB_COUNT = 5
+ARTICLES_PER_HUB = 5
+
+
+class SyntheticSiteHandler(http.server.BaseHTTPRequestHandler):
+    """
+    /hub/{i}: links to /article/{i}-{j} and to the other hubs.
+    /article/{i}-{j}: links back to its hub.
+    """
+
+    def do_GET(self):
+        if self.path.startswith("/hub/"):
+            i = int(self.path.split("/")[-1])
+            links = [f"/article/{i}-{j}" for j in range(ARTICLES_PER_HUB)]
+            links += [f"/hub/{k}" for k in range(HUB_COUNT)]
+        elif self.path.startswith("/article/"):
+            links = [f"/hub/{self.path.split('/')[-1].split('-')[0]}"]
+        else:
+            self.send_error(404)
+            return
+
+        body = "<html><body>" + "".join(f'<a href="{link}">{link}</a>' for link in links) + "</body></html>"
+        body = body.encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestAsyncCrawler(TestCase):
+
+    def setUp(self):
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), SyntheticSiteHandler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.base_url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.tmp_dir.cleanup()
+
+    def make_crawler(self, **kwargs):
+        crawler = AsyncCrawler.AsyncCrawler(directory=osp.join(self.tmp_dir.name, "crawler"), **kwargs)
+        crawler.strict_filter = lambda url: url.startswith(self.base_url + "/article/")
+        crawler.loose_filter = lambda url: False
+        for i in range(HUB_COUNT):
+            crawler.queue.put(f"{self.base_url}/hub/{i}")
+        return crawler
+
+    def test_crawls_synthetic_site(self):
+        crawler = self.make_crawler(host_interval_ms=0)
+        crawler.run(epoch_count=1, secs=2, make_snapshot=False)
+
+        saved_urls = sorted(entry.url for entry in crawler.saved_content)
+        expected = sorted(f"{self.base_url}/article/{i}-{j}"
+                          for i in range(HUB_COUNT) for j in range(ARTICLES_PER_HUB))
+        self.assertEqual(expected, saved_urls)
+
+        loaded = AsyncCrawler.AsyncCrawler.load(crawler.directory)
+        self.assertIsInstance(loaded, AsyncCrawler.AsyncCrawler)
+        self.assertEqual(0, loaded.host_interval_ms)
+
+    def test_host_interval_bounds_rate(self):
+        # 200 ms between requests to the only host: at most 6 requests in 1 second, starting at 0.
+        crawler = self.make_crawler(host_interval_ms=200)
+        start_time = time.time()
+        crawler.run(epoch_count=1, secs=1, make_snapshot=False)
+        self.assertLess(time.time() - start_time, 1 + crawler.request_timeout_s + 1)
+        self.assertLessEqual(len(crawler.saved_content), 6)
+        # the hubs that were not fetched are still in the queue.
+        self.assertGreater(crawler.queue.qsize(), 0)
@@ -0,0 +1,253 @@
+import json
+import os.path as osp
+import tempfile
+from unittest import TestCase
+
+import numpy as np
+
+import BloomFilter as bf
+
+
+class TestBitArray(TestCase):
+
+    def test_set_get(self):
+        bitarray = bf.BitArray(100)
+        self.assertEqual(104, bitarray.size)
+        for n in (0, 7, 8, 50, 103):
+            self.assertFalse(bitarray.get(n))
+            bitarray.set(n)
+            self.assertTrue(bitarray.get(n))
+        self.assertFalse(bitarray.get(1))
+
+    def test_layout_matches_bytearray(self):
+        # bit n is stored in byte n // 8, counting from the most significant bit.
+        bitarray = bf.BitArray(16)
+        bitarray.set(0)
+        bitarray.set(9)
+        self.assertEqual([0x80, 0x40], bitarray.array.tolist())
+
+    def test_set_many_same_byte(self):
+        bitarray = bf.BitArray(64)
+        bitarray.set_many([0, 1, 2, 3, 3, 63])
+        self.assertEqual(0xF0, bitarray.array[0])
+        self.assertEqual(0x01, bitarray.array[7])
+
+    def test_get_many_keeps_shape(self):
+        bitarray = bf.BitArray(64)
+        bitarray.set_many([5, 17])
+        res = bitarray.get_many(np.array([[5, 6], [17, 18]]))
+        self.assertEqual((2, 2), res.shape)
+        self.assertEqual([[True, False], [True, False]], res.tolist())
+
+    def test_save_load(self):
+        bitarray = bf.BitArray(1000)
+        bitarray.set_many([1, 500, 999])
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            bitarray.save(tmp_dir)
+            loaded = bf.BitArray.load(tmp_dir)
+        self.assertEqual(bitarray.size, loaded.size)
+        self.assertTrue(np.array_equal(bitarray.array, loaded.array))
+
+    def test_load_legacy_bytearray(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            np.save(f"{tmp_dir}/bitarray.npy", bytearray([0x80, 0x01]))
+            loaded = bf.BitArray.load(tmp_dir)
+        self.assertTrue(loaded.get(0))
+        self.assertTrue(loaded.get(15))
+        self.assertFalse(loaded.get(1))
+
+
+class TestBloomFilter(TestCase):
+
+    def test_add_contains(self):
+        bloom_filter = bf.bloom_filter_maker(capacity=1000, error_rate=1e-5)
+        urls = [f"https://news.zhibo8.com/zuqiu/{i}native.htm" for i in range(200)]
+        for url in urls:
+            bloom_filter.add(url)
+        for url in urls:
+            self.assertIn(url, bloom_filter)
+        self.assertNotIn("https://sports.sina.com.cn/", bloom_filter)
+
+    def test_add_many_contains_many(self):
+        bloom_filter = bf.bloom_filter_maker(capacity=1000, error_rate=1e-5)
+        urls = [f"https://news.zhibo8.com/zuqiu/{i}native.htm" for i in range(200)]
+        bloom_filter.add_many(urls[:100])
+        res = bloom_filter.contains_many(urls)
+        self.assertEqual([True] * 100 + [False] * 100, res.tolist())
+        for url in urls[:100]:
+            self.assertIn(url, bloom_filter)
+        self.assertEqual((0,), bloom_filter.contains_many([]).shape)
+
+    def test_save_load(self):
+        bloom_filter = bf.bloom_filter_maker(capacity=1000, error_rate=1e-5)
+        bloom_filter.add("hello")
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            bloom_filter.save_to(tmp_dir)
+            loaded = bf.BloomFilter.load_from(tmp_dir)
+        self.assertIn("hello", loaded)
+        self.assertNotIn("world", loaded)
+
+    def test_hash_strategy_persisted(self):
+        bloom_filter = bf.bloom_filter_maker(capacity=1000, error_rate=1e-5, hash_strategy="bkdr")
+        bloom_filter.add("hello")
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            bloom_filter.save_to(tmp_dir)
+            loaded = bf.BloomFilter.load_from(tmp_dir)
+        self.assertEqual("bkdr", loaded.hash_strategy)
+        self.assertIn("hello", loaded)
+
+    def test_legacy_filter_loads_with_bkdr(self):
+        bloom_filter = bf.bloom_filter_maker(capacity=1000, error_rate=1e-5, hash_strategy="bkdr")
+        bloom_filter.add("hello")
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            bloom_filter.save_to(tmp_dir)
+            # files written before hash strategies existed have no "hash_strategy" key.
+            with open(osp.join(tmp_dir, "BloomFilter.json"), "w") as f:
+                json.dump({"size": bloom_filter.size, "hash_num": bloom_filter.hash_num}, f)
+            loaded = bf.BloomFilter.load_from(tmp_dir)
+        self.assertEqual("bkdr", loaded.hash_strategy)
+        self.assertIn("hello", loaded)
+
+
+class TestHashStrategy(TestCase):
+
+    keys = ["hello", "https://news.zhibo8.com/zuqiu/more.htm?label=中超",
+            "https://sports.sina.com.cn/g/pl/2024-01-09/doc-inaaxhfz7551761.shtml"]
+
+    def test_bkdr_matches_generator(self):
+        size = 23962645
+        strategy = bf.BKDRHashStrategy(16)
+        hash_funcs = list(bf.BKDRHashGenerator(16))
+        for key in self.keys:
+            expected = [hash_func(key) % size for hash_func in hash_funcs]
+            self.assertEqual(expected, strategy.positions(key, size).tolist())
+
+    def test_positions_many(self):
+        size = 1000003
+        for strategy in (bf.BKDRHashStrategy(7), bf.Blake2bHashStrategy(7)):
+            res = strategy.positions_many(self.keys, size)
+            self.assertEqual((3, 7), res.shape)
+            self.assertTrue((res >= 0).all() and (res < size).all())
+            for key, row in zip(self.keys, res):
+                self.assertEqual(strategy.positions(key, size).tolist(), row.tolist())
+
+
+class TestBloomFilterCopy(TestCase):
+
+    def test_copy_is_independent(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            bloom_filter = bf.bloom_filter_maker(capacity=1000, error_rate=1e-5, mmap_path=tmp_dir)
+            bloom_filter.add("hello")
+            copied = bloom_filter.copy()
+            bloom_filter.add("world")
+            self.assertIsNone(copied.bitarray.backing_file)
+            self.assertIn("hello", copied)
+            self.assertNotIn("world", copied)
+
+    def test_scalable_copy(self):
+        bloom_filter = bf.ScalableBloomFilter(initial_capacity=10, error_rate=1e-3)
+        urls = [f"https://news.zhibo8.com/zuqiu/{i}native.htm" for i in range(100)]
+        bloom_filter.add_many(urls[:50])
+        copied = bloom_filter.copy()
+        bloom_filter.add_many(urls[50:])
+        self.assertEqual(50, len(copied))
+        self.assertTrue(copied.contains_many(urls[:50]).all())
+        self.assertLess(copied.contains_many(urls[50:]).mean(), 0.1)
+
+
+class TestMemmapBloomFilter(TestCase):
+
+    def test_create_save_load(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            bloom_filter = bf.bloom_filter_maker(capacity=1000, error_rate=1e-5, mmap_path=tmp_dir)
+            self.assertIsNotNone(bloom_filter.bitarray.backing_file)
+            bloom_filter.add("hello")
+            bloom_filter.save_to(tmp_dir)
+
+            loaded = bf.BloomFilter.load_from(tmp_dir, mmap=True)
+            self.assertIn("hello", loaded)
+            loaded.add("world")
+            loaded.bitarray.flush()
+
+            # the file is updated in place, no save_to needed.
+            reloaded = bf.BloomFilter.load_from(tmp_dir)
+            self.assertIn("world", reloaded)
+
+    def test_save_elsewhere_copies(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            bloom_filter = bf.bloom_filter_maker(capacity=1000, error_rate=1e-5, mmap_path=osp.join(tmp_dir, "a"))
+            bloom_filter.add("hello")
+            bloom_filter.save_to(osp.join(tmp_dir, "b"))
+            bloom_filter.add("world")
+
+            copied = bf.BloomFilter.load_from(osp.join(tmp_dir, "b"))
+            self.assertIn("hello", copied)
+            self.assertNotIn("world", copied)
+
+
+class TestScalableBloomFilter(TestCase):
+
+    urls = [f"https://news.zhibo8.com/zuqiu/{i}native.htm" for i in range(2000)]
+
+    def test_grows(self):
+        bloom_filter = bf.ScalableBloomFilter(initial_capacity=100, error_rate=1e-3)
+        for url in self.urls[:1000]:
+            bloom_filter.add(url)
+        bloom_filter.add_many(self.urls[1000:])
+        self.assertGreater(len(bloom_filter.slices), 3)
+        self.assertTrue(bloom_filter.contains_many(self.urls).all())
+        for url in self.urls[::97]:
+            self.assertIn(url, bloom_filter)
+        self.assertLess(bloom_filter.estimated_error_rate(), 1e-3)
+        self.assertLess(bloom_filter.fill_ratio(), 0.6)
+        # duplicates are not counted.
+        count = len(bloom_filter)
+        bloom_filter.add(self.urls[0])
+        bloom_filter.add_many(self.urls[:10])
+        self.assertEqual(count, len(bloom_filter))
+
+    def test_false_positive_rate_bounded(self):
+        bloom_filter = bf.ScalableBloomFilter(initial_capacity=100, error_rate=1e-2)
+        bloom_filter.add_many(self.urls)
+        others = [f"https://sports.sina.com.cn/{i}.shtml" for i in range(5000)]
+        self.assertLess(bloom_filter.contains_many(others).mean(), 2e-2)
+
+    def test_save_load_through_bloom_filter(self):
+        bloom_filter = bf.bloom_filter_maker(capacity=100, error_rate=1e-3, scalable=True)
+        bloom_filter.add_many(self.urls[:500])
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            bloom_filter.save_to(tmp_dir)
+            loaded = bf.BloomFilter.load_from(tmp_dir, mmap=True)
+            self.assertIsInstance(loaded, bf.ScalableBloomFilter)
+            self.assertEqual(len(bloom_filter.slices), len(loaded.slices))
+            self.assertEqual(500, len(loaded))
+            self.assertTrue(loaded.contains_many(self.urls[:500]).all())
+
+            loaded.add_many(self.urls[500:])
+            loaded.save_to(tmp_dir)
+            reloaded = bf.BloomFilter.load_from(tmp_dir)
+            self.assertTrue(reloaded.contains_many(self.urls).all())
+
+
+class TestConcurrentBloomFilter(TestCase):
+
+    def test_concurrent_adds(self):
+        import threading
+        bloom_filter = bf.bloom_filter_maker(capacity=10000, error_rate=1e-5)
+        urls = [f"https://news.zhibo8.com/zuqiu/{i}native.htm" for i in range(4000)]
+
+        def add(_urls):
+            for url in _urls:
+                bloom_filter.add(url)
+
+        threads = [threading.Thread(target=add, args=(urls[i::8],)) for i in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertTrue(bloom_filter.contains_many(urls).all())
+        # no bit may be lost to a concurrent write into the same byte.
+        expected = bf.bloom_filter_maker(capacity=10000, error_rate=1e-5)
+        expected.add_many(urls)
+        self.assertTrue(np.array_equal(expected.bitarray.array, bloom_filter.bitarray.array))
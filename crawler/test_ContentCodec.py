@@ -0,0 +1,80 @@
+import os.path as osp
+import tempfile
+import unittest
+from unittest import TestCase
+
+import ContentCodec as cc
+import FileSet as fs
+
+
+def make_page(i):
+    boilerplate = "".join(f'<li class="nav"><a href="https://sports.sina.com.cn/{j}/">频道 {j}</a></li>\n'
+                          for j in range(60))
+    return (f"<html><head><title>新闻 {i}</title></head><body>\n<ul>\n{boilerplate}</ul>\n"
+            f"<p>article {i}: {'word%d ' % i * 20}</p>\n</body></html>").encode()
+
+
+class TestContentCodec(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.directory = osp.join(self.tmp_dir.name, "fileset")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_round_trip(self):
+        pages = [make_page(i) for i in range(10)]
+        dictionary = cc.train_zlib_dictionary(pages)
+        self.assertLessEqual(len(dictionary), cc.ZLIB_DICTIONARY_SIZE)
+        for codec in cc.CODECS:
+            _dictionary = dictionary if cc.uses_dictionary(codec) else None
+            compressed = cc.compress(pages[0], codec, _dictionary)
+            self.assertEqual(pages[0], cc.decompress(compressed, codec, _dictionary))
+        self.assertLess(len(cc.compress(pages[0], "zlib-dict", dictionary)),
+                        len(cc.compress(pages[0], "zlib")) // 2)
+        self.assertEqual(("raw", None), cc.split_codec(None))
+        self.assertEqual(("zlib-dict", "0123abcd"), cc.split_codec("zlib-dict:0123abcd"))
+        with self.assertRaises(ValueError):
+            cc.check_codec("lzma")
+
+    def test_fileset_compresses_per_entry(self):
+        fileset = fs.FileSet(directory=self.directory, storage="segments", codec="zlib-dict", dictionary_samples=4)
+        entries = [fileset.insert(fs.as_insert_entry(make_page(i), f"https://a.com/{i}", f"t{i}", "now"))
+                   for i in range(6)]
+        # trained from the first 4, the ones before the 4th go without the dictionary.
+        self.assertEqual(["zlib"] * 3 + [f"zlib-dict:{fileset.dictionary_id}"] * 3,
+                         [entry.codec for entry in entries])
+        fileset.save()
+        fileset.close()
+
+        loaded = fs.FileSet.load_from(self.directory, mode="append-full-load")
+        self.assertEqual(entries, loaded.recorded_entries)
+        entries.append(loaded.insert(fs.as_insert_entry(make_page(6), "https://a.com/6", "t6", "now")))
+        self.assertEqual(entries[-2].codec, entries[-1].codec)
+        loaded.save()
+        reader = fs.FileSetReader(self.directory)
+        self.assertEqual([make_page(i) for i in range(7)], [reader.read_content(entry) for entry in reader])
+        reader.close()
+        loaded.close()
+
+    def test_files_storage_stays_plain(self):
+        for codec in cc.CODECS[1:]:
+            with self.assertRaises(ValueError):
+                fs.FileSet(directory=self.directory, storage="files", codec=codec)
+
+    def test_raw_entries_stay_readable(self):
+        fileset = fs.FileSet(directory=self.directory)
+        entry = fileset.insert(fs.as_insert_entry(make_page(0), "https://a.com/0", "t", "now"))
+        self.assertIsNone(entry.codec)
+        # as recorded before there were codecs.
+        legacy_entry = fs.FileSetRecordedEntry(*list(entry)[:4])
+        self.assertEqual(make_page(0), fileset.read_content(legacy_entry))
+
+    @unittest.skipIf(cc.zstandard is None, "zstandard is not installed")
+    def test_zstd_dictionary(self):
+        fileset = fs.FileSet(directory=self.directory, storage="segments", codec="zstd-dict", dictionary_samples=4)
+        entries = [fileset.insert(fs.as_insert_entry(make_page(i), f"https://a.com/{i}", f"t{i}", "now"))
+                   for i in range(6)]
+        self.assertTrue(entries[-1].codec.startswith("zstd-dict:"))
+        self.assertEqual([make_page(i) for i in range(6)], [fileset.read_content(entry) for entry in entries])
@@ -0,0 +1,347 @@
+import http.server
+import json
+import os
+import os.path as osp
+import tempfile
+import threading
+import time
+from unittest import TestCase
+
+import Crawler
+import Frontier
+import request_utils
+import test_AsyncCrawler
+
+
+class TestCrawlerState(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.directory = osp.join(self.tmp_dir.name, "crawler")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_exact_dedup_overrides_false_positive(self):
+        crawler = Crawler.Crawler(directory=self.directory, exact_dedup=True)
+        crawler.mark_met("https://sports.sina.com.cn/a")
+        # pretend the bloom filter is saturated: it says "maybe" for every url.
+        crawler.met_url_bf.bitarray.array[:] = 0xFF
+
+        self.assertTrue(crawler.is_met("https://sports.sina.com.cn/a"))
+        self.assertFalse(crawler.is_met("https://sports.sina.com.cn/b"))
+        self.assertEqual([True, False],
+                         crawler.met_mask(["https://sports.sina.com.cn/a", "https://sports.sina.com.cn/b"]).tolist())
+
+    def test_exact_dedup_save_load_snapshot(self):
+        crawler = Crawler.Crawler(directory=self.directory, exact_dedup=True)
+        crawler.mark_met("https://sports.sina.com.cn/a")
+        crawler.save()
+        crawler.make_snapshot("s1")
+        crawler.mark_met("https://sports.sina.com.cn/b")
+        crawler.save()
+
+        loaded = Crawler.Crawler.load(self.directory)
+        self.assertTrue(loaded.is_met("https://sports.sina.com.cn/b"))
+
+        rolled_back = Crawler.Crawler.load_snapshot(self.directory, "s1")
+        self.assertTrue(rolled_back.is_met("https://sports.sina.com.cn/a"))
+        self.assertNotIn("https://sports.sina.com.cn/b", rolled_back.met_url_store)
+
+    def test_politeness_settings(self):
+        crawler = Crawler.Crawler(directory=self.directory, max_workers=4, interval_ms=2000,
+                                  host_intervals_ms={"k.sinaimg.cn": 100}, max_per_host=2)
+        # a single host is requested as often as before: once per interval_ms / max_workers.
+        self.assertEqual(0.5, crawler.queue.interval_of("sports.sina.com.cn"))
+        self.assertEqual(0.1, crawler.queue.interval_of("k.sinaimg.cn"))
+        crawler.queue.put("https://sports.sina.com.cn/a")
+        crawler.save()
+
+        loaded = Crawler.Crawler.load(self.directory)
+        self.assertEqual([("https://sports.sina.com.cn/a", 0, 0)], loaded.queue.snapshot())
+        self.assertEqual(0.1, loaded.queue.interval_of("k.sinaimg.cn"))
+        self.assertEqual(2, loaded.queue.max_per_host)
+
+    def test_process_page_prioritizes_articles(self):
+        crawler = Crawler.Crawler(directory=self.directory, max_queue_size=2)
+        article = "https://sports.sina.com.cn/g/pl/2024-01-09/doc-inaaxhfz7551761.shtml"
+        hubs = ["https://sports.sina.com.cn/g/pl/", "https://sports.sina.com.cn/g/laliga/"]
+        content = "".join(f'<a href="{url}">x</a>' for url in hubs + [article]).encode()
+        crawler.process_page("https://sports.sina.com.cn/", content, "test", depth=1)
+
+        # the queue only holds 2 urls: the article is kept, whatever the order the links were found in.
+        items = crawler.queue.snapshot()
+        self.assertEqual(2, len(items))
+        self.assertIn((article, Crawler.ARTICLE_PRIORITY, 2), items)
+        self.assertEqual(Crawler.ARTICLE_PRIORITY, crawler.queue.get_item_nowait().priority)
+
+    def test_saved_page_keeps_its_extract(self):
+        crawler = Crawler.Crawler(directory=self.directory)
+        article = "https://sports.sina.com.cn/g/pl/2024-01-09/doc-inaaxhfz7551761.shtml"
+        content = ('<html><head><title>site</title></head><body><h1 class="main-title">Title</h1>'
+                   '<div class="article" id="artibody"><p> first  line </p><p>second</p>'
+                   '<img src="//n.sinaimg.cn/a.jpg"></div><a href="/g/pl/">x</a></body></html>').encode()
+        crawler.process_page(article, content, "test")
+
+        entry = crawler.saved_content.recorded_entries[0]
+        self.assertEqual("Title", entry.title)
+        self.assertEqual({"links": ["https://sports.sina.com.cn/g/pl/"], "img_srcs": ["https://n.sinaimg.cn/a.jpg"],
+                          "title": "Title", "text": "first line\nsecond"},
+                         crawler.saved_content.read_sidecar(entry))
+
+    def test_segment_storage(self):
+        crawler = Crawler.Crawler(directory=self.directory, segment_storage=True)
+        article = "https://sports.sina.com.cn/g/pl/2024-01-09/doc-inaaxhfz7551761.shtml"
+        content = b'<html><body><a href="/g/pl/">x</a></body></html>'
+        crawler.process_page(article, content, "test")
+        crawler.save()
+
+        loaded = Crawler.Crawler.load(self.directory)
+        self.assertTrue(loaded.segment_storage)
+        # the entries saved are not loaded, only looked up.
+        self.assertEqual((0, 1), (len(loaded.saved_content), loaded.file_count()))
+        entry = loaded.saved_content.get_by_url(article)
+        self.assertTrue(entry.content_filename.startswith("segment-000000.seg@"))
+        self.assertEqual(content, loaded.saved_content.read_content(entry))
+
+    def test_parse_workers_match_thread_parsing(self):
+        article = "https://sports.sina.com.cn/g/pl/2024-01-09/doc-inaaxhfz7551761.shtml"
+        content = (f'<a href="{article}?from=list">x</a><a href="/g/pl/">x</a><a href="/g/pl">x</a>'
+                   f'<a href="https://example.com/">x</a>').encode()
+        crawler = Crawler.Crawler(directory=self.directory, parse_workers=1)
+        try:
+            _, article_urls, hub_urls = crawler.parse_page("https://sports.sina.com.cn/", content)
+            self.assertEqual(([article], ["https://sports.sina.com.cn/g/pl"]), (article_urls, hub_urls))
+        finally:
+            crawler.close_parse_pool()
+        crawler.save()
+        loaded = Crawler.Crawler.load(self.directory)
+        self.assertEqual(1, loaded.parse_workers)
+        loaded.parse_workers = 0
+        _, article_urls, hub_urls = loaded.parse_page("https://sports.sina.com.cn/", content)
+        self.assertEqual(([article], ["https://sports.sina.com.cn/g/pl"]), (article_urls, hub_urls))
+
+    def test_load_legacy_queue(self):
+        crawler = Crawler.Crawler(directory=self.directory)
+        crawler.save()
+        params_path = osp.join(self.directory, "CrawlerParams.json")
+        with open(params_path) as f:
+            params = json.load(f)
+        # queues saved before the frontier had priorities are lists of urls.
+        params["queue"] = ["https://sports.sina.com.cn/g/pl/",
+                           "https://sports.sina.com.cn/g/pl/2024-01-09/doc-inaaxhfz7551761.shtml"]
+        with open(params_path, "w") as f:
+            json.dump(params, f)
+
+        loaded = Crawler.Crawler.load(self.directory)
+        self.assertEqual([Crawler.HUB_PRIORITY, Crawler.ARTICLE_PRIORITY],
+                         [item.priority for item in loaded.queue.snapshot()])
+
+    def test_spill_queue_save_load_snapshot(self):
+        crawler = Crawler.Crawler(directory=self.directory, max_queue_size=2, spill_queue=True,
+                                  host_interval_ms=0)
+        hubs = [f"https://sports.sina.com.cn/g/{league}" for league in ("pl", "laliga", "seriea", "bundesliga")]
+        content = "".join(f'<a href="{url}">x</a>' for url in hubs).encode()
+        crawler.process_page("https://sports.sina.com.cn/", content, "test")
+        # nothing is lost to the bounded queue.
+        self.assertEqual(4, crawler.queue.qsize())
+        self.assertEqual(2, crawler.queue.spilled_count())
+        crawler.save()
+        crawler.make_snapshot("s1")
+        crawler.queue.put("https://sports.sina.com.cn/g/ligue1/", priority=Crawler.HUB_PRIORITY)
+        crawler.save()
+
+        loaded = Crawler.Crawler.load(self.directory)
+        self.assertIsInstance(loaded.queue, Frontier.SpillingFrontier)
+        self.assertEqual(5, loaded.queue.qsize())
+        loaded.queue.close()
+
+        rolled_back = Crawler.Crawler.load_snapshot(self.directory, "s1")
+        urls = set()
+        while not rolled_back.queue.empty():
+            urls.add(rolled_back.queue.get_nowait())
+        self.assertEqual(set(hubs), urls)
+
+    def test_spill_queue_load_after_the_crawl_went_on(self):
+        crawler = Crawler.Crawler(directory=self.directory, max_queue_size=2, spill_queue=True,
+                                  host_interval_ms=0)
+        hubs = [f"https://sports.sina.com.cn/g/{league}" for league in ("pl", "laliga", "seriea", "bundesliga",
+                                                                        "ligue1", "csl")]
+        for url in hubs:
+            crawler.queue.put(url, priority=Crawler.HUB_PRIORITY)
+        crawler.save()
+        # the crawl goes on: the spill file is read back, truncated and appended to, then the crawler crashes.
+        while not crawler.queue.empty():
+            crawler.queue.task_done(crawler.queue.get_nowait())
+        for i in range(5):
+            crawler.queue.put(f"https://sports.sina.com.cn/g/after-{i}", priority=Crawler.HUB_PRIORITY)
+        crawler.queue.close()
+
+        loaded = Crawler.Crawler.load(self.directory)
+        urls = []
+        while not loaded.queue.empty():
+            urls.append(loaded.queue.get_nowait())
+        self.assertEqual(sorted(hubs), sorted(urls))
+        loaded.queue.close()
+
+    def test_recover_from_write_ahead_log(self):
+        crawler = Crawler.Crawler(directory=self.directory, write_ahead_log=True)
+        crawler.save()
+        # after the save, the crawler goes on and crashes before the next one.
+        article = "https://sports.sina.com.cn/g/pl/2024-01-09/doc-inaaxhfz7551761.shtml"
+        content = b'<a href="https://sports.sina.com.cn/g/laliga">x</a>'
+        crawler.process_page(article, content, "test")
+        crawler.wal.close()
+
+        recovered = Crawler.Crawler.recover(self.directory)
+        self.assertTrue(recovered.is_met(article))
+        self.assertIn(article, recovered.saved_url_bf)
+        self.assertEqual([article], [entry.url for entry in recovered.saved_content])
+        self.assertEqual(["https://sports.sina.com.cn/g/laliga"], [item.url for item in recovered.queue.snapshot()])
+
+        # a save compacts the log into the checkpoint.
+        recovered.save()
+        self.assertEqual(0, recovered.wal.size())
+        reloaded = Crawler.Crawler.recover(self.directory)
+        self.assertEqual(1, reloaded.file_count())
+        self.assertEqual(article, reloaded.saved_content.get_by_url(article).url)
+        self.assertEqual(1, reloaded.queue.qsize())
+
+    def test_recover_from_a_failed_save(self):
+        crawler = Crawler.Crawler(directory=self.directory, write_ahead_log=True)
+        crawler.save()
+        article = "https://sports.sina.com.cn/g/pl/2024-01-09/doc-inaaxhfz7551761.shtml"
+        crawler.process_page(article, b'<a href="https://sports.sina.com.cn/g/laliga">x</a>', "test")
+
+        # the next save crashes after rotating the log and saving the bloom filters, before the FileSet.
+        def crash():
+            raise OSError("disk full")
+
+        crawler.saved_content.save = crash
+        with self.assertRaises(OSError):
+            crawler.save()
+        crawler.wal.close()
+
+        recovered = Crawler.Crawler.recover(self.directory)
+        self.assertEqual([article], [entry.url for entry in recovered.saved_content])
+        self.assertIn(article, recovered.saved_url_bf)
+        self.assertEqual(["https://sports.sina.com.cn/g/laliga"], [item.url for item in recovered.queue.snapshot()])
+
+    def test_recover_after_the_fileset_was_saved(self):
+        crawler = Crawler.Crawler(directory=self.directory, write_ahead_log=True)
+        crawler.save()
+        article = "https://sports.sina.com.cn/g/pl/2024-01-09/doc-inaaxhfz7551761.shtml"
+        crawler.process_page(article, b'<a href="https://sports.sina.com.cn/g/laliga">x</a>', "test")
+
+        # the FileSet is saved, then the crash comes before CrawlerParams.json is.
+        save_fileset = crawler.saved_content.save
+
+        def crash():
+            save_fileset()
+            raise OSError("disk full")
+
+        crawler.saved_content.save = crash
+        with self.assertRaises(OSError):
+            crawler.save()
+        crawler.wal.close()
+
+        recovered = Crawler.Crawler.recover(self.directory)
+        # the SAVED record replayed is in the FileSet already.
+        self.assertEqual(1, recovered.file_count())
+        self.assertEqual(article, recovered.saved_content.get_by_url(article).url)
+
+    def test_background_snapshot_while_crawling(self):
+        crawler = Crawler.Crawler(directory=self.directory, host_interval_ms=0)
+        hub = "https://sports.sina.com.cn/g/pl"
+        article = "https://sports.sina.com.cn/g/pl/2024-01-09/doc-inaaxhfz7551761.shtml"
+        crawler.queue.put(hub, priority=Crawler.HUB_PRIORITY)
+        crawler.queue.put(article, priority=Crawler.ARTICLE_PRIORITY)
+        crawler.save()
+        # a worker has taken the article and is fetching it when the snapshot is taken.
+        in_flight = crawler.queue.get_item_nowait()
+        self.assertEqual(article, in_flight.url)
+
+        crawler.make_snapshot("s1", background=True)
+        crawler.process_page(article, b"<html></html>", "test")
+        crawler.queue.task_done(article)
+        crawler.wait_for_snapshot()
+        self.assertEqual(1, len(crawler.saved_content))
+
+        rolled_back = Crawler.Crawler.load_snapshot(self.directory, "s1")
+        # the url in flight is back in the queue, and nothing it did after the snapshot is kept.
+        self.assertEqual({hub, article}, {item.url for item in rolled_back.queue.snapshot()})
+        self.assertFalse(rolled_back.is_met(article))
+        self.assertEqual(0, len(rolled_back.saved_content))
+
+
+class TestCrawlerRun(TestCase):
+
+    def setUp(self):
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), test_AsyncCrawler.SyntheticSiteHandler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.base_url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.tmp_dir.cleanup()
+
+    def make_crawler(self, **kwargs):
+        crawler = Crawler.Crawler(directory=osp.join(self.tmp_dir.name, "crawler"), **kwargs)
+        crawler.strict_filter = lambda url: url.startswith(self.base_url + "/article/")
+        crawler.loose_filter = lambda url: False
+        for i in range(test_AsyncCrawler.HUB_COUNT):
+            crawler.queue.put(f"{self.base_url}/hub/{i}", priority=Crawler.HUB_PRIORITY)
+        return crawler
+
+    def test_crawls_synthetic_site_without_stalls(self):
+        crawler = self.make_crawler(max_workers=4, host_interval_ms=0)
+        start_time = time.time()
+        crawler.run(epoch_count=2, secs=1, make_snapshot=True)
+        # the epochs turn over and the workers drain without any fixed sleep.
+        self.assertLess(time.time() - start_time, 2 + 1.5)
+
+        expected = sorted(f"{self.base_url}/article/{i}-{j}" for i in range(test_AsyncCrawler.HUB_COUNT)
+                          for j in range(test_AsyncCrawler.ARTICLES_PER_HUB))
+        self.assertEqual(expected, sorted(entry.url for entry in crawler.saved_content))
+        self.assertEqual(2, len(os.listdir(osp.join(crawler.directory, "snapshots"))))
+        self.assertEqual([], crawler.workers)
+
+    def test_streaming_crawl(self):
+        crawler = self.make_crawler(max_workers=2, host_interval_ms=0, stream_pages=True)
+        crawler.run(epoch_count=1, secs=1, make_snapshot=False)
+
+        expected = sorted(f"{self.base_url}/article/{i}-{j}" for i in range(test_AsyncCrawler.HUB_COUNT)
+                          for j in range(test_AsyncCrawler.ARTICLES_PER_HUB))
+        self.assertEqual(expected, sorted(entry.url for entry in crawler.saved_content))
+        entry = crawler.saved_content.recorded_entries[0]
+        self.assertEqual([entry.url.replace("article", "hub").rsplit("-", 1)[0]],
+                         crawler.saved_content.read_sidecar(entry)["links"])
+
+    def test_stuck_fetch_is_abandoned(self):
+        crawler = self.make_crawler(max_workers=1, host_interval_ms=0)
+        fetch_started = threading.Event()
+
+        def slow_fetch(url, worker_name):
+            fetch_started.set()
+            time.sleep(1)
+            return request_utils.FetchResult(url, 200, b"<html></html>", None, None)
+
+        crawler.fetch = slow_fetch
+        crawler.start_workers()
+        self.assertTrue(fetch_started.wait(1))
+        worker = crawler.workers[0]
+
+        start_time = time.time()
+        crawler.stop_workers(drain_timeout_s=0.1)
+        self.assertLess(time.time() - start_time, 0.5)
+        # the url being fetched is still in flight, so it is saved with the queue.
+        self.assertEqual(test_AsyncCrawler.HUB_COUNT, len(crawler.as_state_dict()["queue"]))
+
+        worker.join(2)
+        self.assertFalse(worker.is_alive())
+        # the page fetched after the deadline is dropped, and its url is back in the queue.
+        self.assertEqual(test_AsyncCrawler.HUB_COUNT, crawler.queue.qsize())
+        self.assertEqual(0, crawler.met_url_bf.bitarray.count())
@@ -0,0 +1,101 @@
+import json
+import os
+import os.path as osp
+import tempfile
+from unittest import TestCase
+
+import EntryLog as el
+import FileSet as fs
+
+
+def make_entry(i):
+    return fs.FileSetRecordedEntry(f"{i}.html", f"https://a.com/{i}", f"标题 {i}", "240110_10_00_00_000000")
+
+
+class TestEntryLog(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.directory = self.tmp_dir.name
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_append_sync_and_read(self):
+        log = el.EntryLog(self.directory, entry_class=fs.FileSetRecordedEntry)
+        entries = [make_entry(i) for i in range(10)]
+        log.append(entries[:3])
+        # a frozen copy saving the first 5, then the FileSet saving all of them.
+        self.assertEqual(2, log.sync(entries[:5]))
+        self.assertEqual(5, log.sync(entries))
+        self.assertEqual(0, log.sync(entries[4:], base_count=4))
+
+        log = el.EntryLog(self.directory, entry_class=fs.FileSetRecordedEntry)
+        self.assertEqual(10, len(log))
+        self.assertEqual(entries[7], log.read(7))
+        self.assertEqual(entries, list(log))
+        self.assertEqual(entries[6:], log.read_all(6))
+        with self.assertRaises(IndexError):
+            log.read(10)
+        with self.assertRaises(ValueError):
+            log.sync(entries[12:], base_count=12)
+
+    def test_watermark_and_torn_write(self):
+        log = el.EntryLog(self.directory)
+        log.append([make_entry(i) for i in range(4)])
+        # a crash after the index slot of a fifth entry is written but before its record is.
+        with open(log.index_path, "ab") as f:
+            f.write(el.INDEX_SLOT.pack(os.path.getsize(log.heap_path), 100, 0))
+        self.assertEqual(4, len(el.EntryLog(self.directory)))
+
+        # opened at a watermark of 2, the entries past it are cut off by the first append.
+        log = el.EntryLog(self.directory, count=2)
+        self.assertEqual(2, len(log))
+        log.append([make_entry(9)])
+        self.assertEqual(["0.html", "1.html", "9.html"], [entry[0] for entry in el.EntryLog(self.directory)])
+        log.truncate(1)
+        self.assertEqual(1, len(el.EntryLog(self.directory)))
+        with self.assertRaises(ValueError):
+            el.EntryLog(self.directory, count=2)
+
+    def test_fileset_saves_only_new_entries(self):
+        directory = osp.join(self.directory, "fileset")
+        fileset = fs.FileSet(directory=directory)
+        for i in range(3):
+            fileset.insert(fs.as_insert_entry(f"page {i}", f"https://a.com/{i}", f"t{i}", "now"))
+        fileset.save()
+        fileset.make_snapshot("s1")
+
+        fileset = fs.FileSet.load_from(directory, mode="append")
+        self.assertEqual(0, len(fileset))
+        heap_size = osp.getsize(fileset.entry_log.heap_path)
+        fileset.insert(fs.as_insert_entry("page 3", "https://a.com/3", "t3", "now"))
+        fileset.save()
+        self.assertEqual(heap_size + len(el.encode_entry(fileset.recorded_entries[0])),
+                         osp.getsize(fileset.entry_log.heap_path))
+
+        loaded = fs.FileSet.load_from(directory, mode="append-full-load")
+        self.assertEqual([f"https://a.com/{i}" for i in range(4)], [entry.url for entry in loaded])
+        self.assertEqual(b"page 3", loaded.read_content(loaded.recorded_entries[3]))
+
+        rolled_back = fs.FileSet.load_from_snapshot("s1", directory)
+        self.assertEqual(3, len(rolled_back))
+        self.assertEqual(3, len(fs.FileSet.load_from(directory, mode="append-full-load")))
+        self.assertEqual(["0.html", "1.html", "2.html"], sorted(os.listdir(osp.join(directory, "contents"))))
+
+    def test_fileset_json_entries_are_migrated(self):
+        directory = osp.join(self.directory, "fileset")
+        fileset = fs.FileSet(directory=directory)
+        entry = fileset.insert(fs.as_insert_entry("page", "https://a.com/0", "t", "now"))
+        # as saved before the entry log.
+        with open(osp.join(directory, "FileSet.json"), "w") as f:
+            json.dump({"directory": directory, "filename_counter": 1}, f)
+        with open(osp.join(directory, "FileSetEntries.json"), "w") as f:
+            json.dump([list(entry)], f, indent=4)
+        os.remove(fileset.entry_log.index_path)
+
+        loaded = fs.FileSet.load_from(directory, mode="append-full-load")
+        self.assertEqual([entry], loaded.recorded_entries)
+        self.assertTrue(el.exists(directory))
+        loaded.save()
+        self.assertEqual([entry], fs.FileSet.load_from(directory, mode="append-full-load").recorded_entries)
@@ -0,0 +1,53 @@
+import os.path as osp
+import tempfile
+from unittest import TestCase
+
+import FileSet as fs
+
+
+class TestFileSetReader(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.directory = osp.join(self.tmp_dir.name, "fileset")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def insert(self, fileset, i):
+        return fileset.insert(fs.as_insert_entry(f"page {i}", f"https://a.com/{i}", f"t{i}", "now"),
+                              sidecar={"i": i})
+
+    def test_read_while_saving(self):
+        for storage in ("files", "segments"):
+            fileset = fs.FileSet(directory=self.directory, storage=storage)
+            reader = fs.FileSetReader(self.directory)
+            self.assertEqual(([], []), (list(reader), reader[:]))
+
+            entries = [self.insert(fileset, i) for i in range(5)]
+            # the entries recorded but not saved yet are not in the log.
+            self.assertEqual(0, reader.refresh())
+            fileset.save()
+            self.assertEqual(0, len(reader))
+            self.assertEqual(5, reader.refresh())
+
+            self.assertEqual(entries[3], reader[3])
+            self.assertEqual(entries[-1], reader[-1])
+            self.assertEqual(entries[1:4], reader[1:4])
+            self.assertEqual(entries[::2], reader[::2])
+            self.assertEqual(entries, list(reader))
+            with self.assertRaises(IndexError):
+                reader[5]
+            self.assertEqual(b"page 2", reader.read_content(reader[2]))
+            self.assertEqual({"i": 2}, reader.read_sidecar(reader[2]))
+
+            entries.append(self.insert(fileset, 5))
+            fileset.save()
+            self.assertEqual(6, reader.refresh())
+            self.assertEqual(b"page 5", reader.read_content(reader[5]))
+            reader.close()
+            fileset.close()
+
+    def test_missing_directory(self):
+        with self.assertRaises(FileNotFoundError):
+            fs.FileSetReader(self.directory)
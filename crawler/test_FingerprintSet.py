@@ -0,0 +1,42 @@
+import os.path as osp
+import tempfile
+from unittest import TestCase
+
+import FingerprintSet as fps
+
+
+class TestFingerprintSet(TestCase):
+
+    urls = [f"https://news.zhibo8.com/zuqiu/{i}native.htm" for i in range(100)]
+
+    def test_add_contains_across_merges(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            fingerprint_set = fps.FingerprintSet(directory=tmp_dir, merge_threshold=16)
+            for url in self.urls[:50]:
+                fingerprint_set.add(url)
+            fingerprint_set.add_many(self.urls[50:60])
+            # some of them are merged into the sorted file, some are still in the delta set.
+            self.assertGreater(len(fingerprint_set.sorted), 0)
+            self.assertGreater(len(fingerprint_set.delta), 0)
+
+            self.assertEqual([True] * 60 + [False] * 40, fingerprint_set.contains_many(self.urls).tolist())
+            self.assertIn(self.urls[0], fingerprint_set)
+            self.assertNotIn(self.urls[-1], fingerprint_set)
+
+            fingerprint_set.add_many(self.urls[:10])
+            self.assertEqual(60, len(fingerprint_set))
+
+    def test_save_load(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            fingerprint_set = fps.FingerprintSet(directory=osp.join(tmp_dir, "a"))
+            fingerprint_set.add_many(self.urls[:50])
+            fingerprint_set.save_to()
+            fingerprint_set.save_to(osp.join(tmp_dir, "b"))
+            fingerprint_set.add_many(self.urls[50:])
+            fingerprint_set.save_to()
+
+            loaded = fps.FingerprintSet.load_from(osp.join(tmp_dir, "a"))
+            self.assertEqual(100, len(loaded))
+            snapshot = fps.FingerprintSet.load_from(osp.join(tmp_dir, "b"))
+            self.assertEqual(50, len(snapshot))
+            self.assertEqual([True] * 50 + [False] * 50, snapshot.contains_many(self.urls).tolist())
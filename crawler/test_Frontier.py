@@ -0,0 +1,192 @@
+import os.path as osp
+import queue
+import tempfile
+import threading
+import time
+from unittest import TestCase
+
+import Frontier
+
+
+class TestHostFrontier(TestCase):
+
+    def test_queue_interface(self):
+        frontier = Frontier.HostFrontier(maxsize=2)
+        frontier.put("https://a.com/1")
+        frontier.put("https://b.com/1", block=False)
+        self.assertEqual(2, frontier.qsize())
+        self.assertTrue(frontier.full())
+        with self.assertRaises(queue.Full):
+            frontier.put("https://a.com/2", block=False)
+        self.assertEqual(["https://a.com/1", "https://b.com/1"], [item.url for item in frontier.snapshot()])
+
+        self.assertEqual("https://a.com/1", frontier.get(timeout=1))
+        self.assertEqual("https://b.com/1", frontier.get_nowait())
+        with self.assertRaises(queue.Empty):
+            frontier.get(timeout=0.05)
+        self.assertTrue(frontier.empty())
+
+    def test_host_interval(self):
+        frontier = Frontier.HostFrontier(default_interval_s=0.2)
+        for i in range(3):
+            frontier.put(f"https://a.com/{i}")
+        frontier.put("https://b.com/0")
+
+        # a.com and b.com are both ready right away.
+        self.assertEqual({"https://a.com/2", "https://b.com/0"}, {frontier.get_nowait(), frontier.get_nowait()})
+        # a.com is not ready again before its interval has passed.
+        with self.assertRaises(queue.Empty):
+            frontier.get_nowait()
+        start_time = time.monotonic()
+        self.assertEqual("https://a.com/1", frontier.get(timeout=1))
+        self.assertGreater(time.monotonic() - start_time, 0.15)
+
+    def test_per_host_override(self):
+        frontier = Frontier.HostFrontier(default_interval_s=10, host_intervals_s={"fast.com": 0})
+        for i in range(3):
+            frontier.put(f"https://slow.com/{i}")
+            frontier.put(f"https://fast.com/{i}")
+        got = [frontier.get_nowait() for _ in range(4)]
+        self.assertEqual(1, sum(url.startswith("https://slow.com") for url in got))
+        self.assertEqual(3, sum(url.startswith("https://fast.com") for url in got))
+
+    def test_max_per_host(self):
+        frontier = Frontier.HostFrontier(max_per_host=1)
+        frontier.put("https://a.com/0")
+        frontier.put("https://a.com/1")
+        first = frontier.get_nowait()
+        with self.assertRaises(queue.Empty):
+            frontier.get_nowait()
+        frontier.task_done(first)
+        self.assertEqual("https://a.com/0", frontier.get_nowait())
+
+    def test_accept_does_not_use_up_the_turn(self):
+        frontier = Frontier.HostFrontier(default_interval_s=10)
+        frontier.put("https://a.com/new")
+        frontier.put("https://a.com/met")
+        self.assertEqual("https://a.com/new", frontier.get_nowait(accept=lambda url: not url.endswith("met")))
+        self.assertEqual(0, frontier.qsize())
+
+    def test_waiting_get_wakes_on_put(self):
+        frontier = Frontier.HostFrontier()
+        got = []
+        t = threading.Thread(target=lambda: got.append(frontier.get(timeout=2)))
+        t.start()
+        time.sleep(0.05)
+        frontier.put("https://a.com/0")
+        t.join()
+        self.assertEqual(["https://a.com/0"], got)
+
+    def test_priority_order(self):
+        frontier = Frontier.HostFrontier()
+        frontier.put("https://a.com/hub-deep", priority=1, depth=3)
+        frontier.put("https://a.com/hub", priority=1, depth=1)
+        frontier.put("https://a.com/article-old", priority=2, depth=2)
+        frontier.put("https://a.com/article-new", priority=2, depth=2)
+        got = [frontier.get_item_nowait() for _ in range(4)]
+        self.assertEqual(["https://a.com/article-new", "https://a.com/article-old", "https://a.com/hub",
+                          "https://a.com/hub-deep"], [item.url for item in got])
+        self.assertEqual(Frontier.FrontierItem("https://a.com/hub", 1, 1), got[2])
+
+    def test_eviction(self):
+        frontier = Frontier.HostFrontier(maxsize=3)
+        frontier.put("https://a.com/hub-old", priority=1, depth=1)
+        frontier.put("https://a.com/hub-new", priority=1, depth=1)
+        frontier.put("https://b.com/article", priority=2, depth=1)
+        # not higher than the lowest: rejected, nothing is evicted.
+        with self.assertRaises(queue.Full):
+            frontier.put("https://a.com/hub-other", block=False, priority=1, depth=1)
+        # an article evicts the oldest of the lowest hubs.
+        frontier.put("https://a.com/article", block=False, priority=2, depth=2)
+        # a deeper hub is rejected, a shallower one evicts the last hub.
+        with self.assertRaises(queue.Full):
+            frontier.put("https://a.com/hub-deep", block=False, priority=1, depth=2)
+        frontier.put("https://a.com/hub-shallow", block=False, priority=1, depth=0)
+        self.assertEqual(["https://b.com/article", "https://a.com/article", "https://a.com/hub-shallow"],
+                         [item.url for item in frontier.snapshot()])
+        self.assertEqual(3, frontier.qsize())
+
+        # the evicted entries are never handed out.
+        got = {frontier.get_nowait() for _ in range(3)}
+        self.assertEqual({"https://b.com/article", "https://a.com/article", "https://a.com/hub-shallow"}, got)
+        self.assertTrue(frontier.empty())
+
+    def test_eviction_across_hosts(self):
+        frontier = Frontier.HostFrontier(maxsize=2)
+        frontier.put("https://a.com/1", priority=1)
+        frontier.put("https://b.com/1", priority=1)
+        # evicts the last url of a.com, then of b.com, while both hosts wait in the ready heap.
+        frontier.put("https://c.com/1", block=False, priority=2)
+        frontier.put("https://c.com/2", block=False, priority=2)
+        frontier.put("https://a.com/2", block=False, priority=3)
+        got = []
+        while not frontier.empty():
+            got.append(frontier.get_nowait())
+        self.assertEqual({"https://a.com/2", "https://c.com/2"}, set(got))
+        with self.assertRaises(queue.Empty):
+            frontier.get_nowait()
+        self.assertIsNone(frontier.time_until_ready())
+
+
+class TestSpillingFrontier(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.spill_path = osp.join(self.tmp_dir.name, "frontier", "spill.bin")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_spills_and_refills(self):
+        frontier = Frontier.SpillingFrontier(self.spill_path, maxsize=10, refill_bytes=64)
+        urls = [f"https://a.com/{i}" for i in range(100)]
+        for i, url in enumerate(urls):
+            frontier.put(url, block=False, priority=1, depth=i)
+        self.assertEqual(100, frontier.qsize())
+        self.assertEqual(90, frontier.spilled_count())
+        self.assertFalse(frontier.full())
+
+        got = []
+        while not frontier.empty():
+            item = frontier.get_item_nowait()
+            got.append(item)
+            self.assertEqual(int(item.url.rsplit("/", 1)[1]), item.depth)
+        # nothing is lost, and the spill file is truncated once it has been read back.
+        self.assertEqual(sorted(urls), sorted(item.url for item in got))
+        self.assertEqual(0, osp.getsize(self.spill_path))
+
+    def test_eviction_spills_the_lowest(self):
+        frontier = Frontier.SpillingFrontier(self.spill_path, maxsize=2, refill_watermark=0)
+        frontier.put("https://a.com/hub", priority=1)
+        frontier.put("https://a.com/article-0", priority=2)
+        frontier.put("https://a.com/article-1", priority=2)
+        self.assertEqual({"https://a.com/article-0", "https://a.com/article-1"},
+                         {item.url for item in frontier.snapshot()})
+        self.assertEqual(1, frontier.spilled_count())
+
+    def test_eviction_across_hosts(self):
+        frontier = Frontier.SpillingFrontier(self.spill_path, maxsize=2, refill_watermark=1)
+        urls = ["https://a.com/1", "https://b.com/1", "https://c.com/1", "https://d.com/1", "https://e.com/1"]
+        for priority, url in enumerate(urls):
+            frontier.put(url, priority=priority)
+        self.assertEqual(3, frontier.spilled_count())
+        got = []
+        while not frontier.empty():
+            got.append(frontier.get_nowait())
+        self.assertEqual(sorted(urls), sorted(got))
+
+    def test_long_url_and_reopen(self):
+        frontier = Frontier.SpillingFrontier(self.spill_path, maxsize=1, refill_bytes=16)
+        long_url = "https://a.com/" + "x" * 100
+        frontier.put("https://a.com/0", priority=5)
+        frontier.put(long_url, priority=1, depth=3)
+        frontier.put("https://a.com/1")
+        # the url in memory is saved through snapshot(), the spilled ones stay in the spill file.
+        self.assertEqual(["https://a.com/0"], [item.url for item in frontier.snapshot()])
+        state = frontier.spill_state()
+        frontier.close()
+
+        reopened = Frontier.SpillingFrontier(self.spill_path, maxsize=1, refill_bytes=16, **state)
+        self.assertEqual(2, reopened.qsize())
+        self.assertEqual(Frontier.FrontierItem(long_url, 1, 3), reopened.get_item_nowait())
+        self.assertEqual("https://a.com/1", reopened.get_nowait())
@@ -0,0 +1,163 @@
+import asyncio
+import http.server
+import os.path as osp
+import tempfile
+import threading
+from unittest import TestCase
+
+import aiohttp
+
+import AsyncCrawler
+import Crawler
+import Frontier
+import HttpCache as hc
+import request_utils
+
+USER_AGENT = "test"
+
+
+class ValidatorHandler(http.server.BaseHTTPRequestHandler):
+    """
+    /etag/{i}: honours If-None-Match.
+    /plain/{i}: no validators, always sends the body in full.
+    Both link to /article/{i}, which does not exist. A query makes another page, with its own ETag.
+    """
+    bodies_sent = []
+
+    def do_GET(self):
+        path, _, query = self.path.partition("?")
+        i = path.split("/")[-1]
+        body = f'<html><body><a href="/article/{i}">{query}</a></body></html>'.encode()
+        etag = f'"v{i}{query}"'
+        if self.path.startswith("/etag/") and self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+        if not self.path.startswith(("/etag/", "/plain/")):
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html")
+        self.send_header("Content-Length", str(len(body)))
+        if self.path.startswith("/etag/"):
+            self.send_header("ETag", etag)
+            self.send_header("Last-Modified", "Mon, 08 Jan 2024 10:00:00 GMT")
+        self.end_headers()
+        ValidatorHandler.bodies_sent.append(self.path)
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestHttpCache(TestCase):
+
+    def setUp(self):
+        ValidatorHandler.bodies_sent = []
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), ValidatorHandler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.base_url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.tmp_dir.cleanup()
+
+    def test_conditional_get(self):
+        cache = hc.HttpCache()
+        url = f"{self.base_url}/etag/1"
+        self.assertEqual({}, cache.validators(url))
+
+        result = request_utils.fetch(url, USER_AGENT)
+        self.assertEqual((200, '"v1"'), (result.status, result.etag))
+        cache.update(url, result.content, result.etag, result.last_modified)
+        # keyed on the normalized url.
+        self.assertEqual({"If-None-Match": '"v1"', "If-Modified-Since": "Mon, 08 Jan 2024 10:00:00 GMT"},
+                         cache.validators(url + "/#top"))
+
+        result = request_utils.fetch(url, USER_AGENT, headers=cache.validators(url))
+        self.assertEqual((304, None), (result.status, result.content))
+        self.assertIsNone(request_utils.fetch(f"{self.base_url}/missing", USER_AGENT))
+
+    def test_urls_differing_in_query(self):
+        cache = hc.HttpCache()
+        urls = [f"{self.base_url}/etag/1?label=a", f"{self.base_url}/etag/1?label=b"]
+        results = [request_utils.fetch(url, USER_AGENT) for url in urls]
+        cache.update(urls[0], results[0].content, results[0].etag, results[0].last_modified)
+        # only the first page is cached, the second one is not sent its validators.
+        self.assertEqual({}, cache.validators(urls[1]))
+        self.assertFalse(cache.is_unchanged(urls[1], results[0].content))
+
+        cache.update(urls[1], results[1].content, results[1].etag, results[1].last_modified)
+        self.assertNotEqual(cache.validators(urls[0]), cache.validators(urls[1]))
+        for url in urls:
+            result = request_utils.fetch(url, USER_AGENT, headers=cache.validators(url))
+            self.assertEqual(304, result.status)
+
+    def test_bounded_save_load(self):
+        cache = hc.HttpCache(max_entries=2)
+        for i in range(3):
+            cache.update(f"https://a.com/{i}", b"body", etag=str(i))
+        cache.get("https://a.com/1")
+        cache.update("https://a.com/3", b"body")
+        # the least recently used ones are dropped.
+        self.assertEqual(["https://a.com/1", "https://a.com/3"], list(cache.entries))
+
+        cache.save_to(self.tmp_dir.name)
+        loaded = hc.HttpCache.load_from(self.tmp_dir.name)
+        self.assertEqual(cache.entries, loaded.entries)
+        self.assertTrue(loaded.is_unchanged("https://a.com/3", b"body"))
+        self.assertFalse(loaded.is_unchanged("https://a.com/3", b"other body"))
+
+    def test_crawler_skips_unchanged_pages(self):
+        for stream_pages in (False, True):
+            ValidatorHandler.bodies_sent = []
+            directory = osp.join(self.tmp_dir.name, f"crawler-{stream_pages}")
+            crawler = Crawler.Crawler(directory=directory, conditional_get=True, stream_pages=stream_pages,
+                                      host_interval_ms=0)
+            crawler.strict_filter = lambda url: False
+            crawler.loose_filter = lambda url: url.startswith(self.base_url + "/article/")
+            urls = [f"{self.base_url}/etag/1", f"{self.base_url}/plain/2"]
+            for url in urls:
+                crawler.crawl_item(Frontier.FrontierItem(url), "test")
+            self.assertEqual(2, crawler.queue.qsize())
+            crawler.save()
+
+            # resumed and seeded again: a 304 for /etag, the same body for /plain. Neither is processed again.
+            crawler = Crawler.Crawler.load(directory)
+            processed = []
+            crawler.process_page = lambda cur_url, *args, **kwargs: processed.append(cur_url)
+            for url in urls:
+                crawler.crawl_item(Frontier.FrontierItem(url), "test")
+            self.assertEqual([], processed)
+            self.assertEqual(["/etag/1", "/plain/2", "/plain/2"], ValidatorHandler.bodies_sent)
+
+    def test_async_crawler_skips_unchanged_pages(self):
+        directory = osp.join(self.tmp_dir.name, "async-crawler")
+        urls = [f"{self.base_url}/etag/1", f"{self.base_url}/plain/2"]
+
+        def crawl(crawler):
+            async def _crawl():
+                async with aiohttp.ClientSession() as session:
+                    for url in urls:
+                        await crawler._fetch_and_process(session, Frontier.FrontierItem(url))
+
+            asyncio.run(_crawl())
+
+        crawler = AsyncCrawler.AsyncCrawler(directory=directory, conditional_get=True, host_interval_ms=0)
+        crawler.strict_filter = lambda url: False
+        crawler.loose_filter = lambda url: url.startswith(self.base_url + "/article/")
+        crawl(crawler)
+        self.assertEqual(2, crawler.queue.qsize())
+        self.assertGreater(crawler.wire_bytes, 0)
+        crawler.save()
+
+        crawler = AsyncCrawler.AsyncCrawler.load(directory)
+        processed = []
+        crawler.process_page = lambda cur_url, *args, **kwargs: processed.append(cur_url)
+        crawl(crawler)
+        self.assertEqual([], processed)
+        self.assertEqual(["/etag/1", "/plain/2", "/plain/2"], ValidatorHandler.bodies_sent)
@@ -0,0 +1,95 @@
+import os
+import os.path as osp
+import tempfile
+from unittest import TestCase
+
+import FileSet as fs
+import SegmentStore as ss
+
+
+class TestSegmentStore(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.directory = osp.join(self.tmp_dir.name, "segments")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_append_read_and_rotate(self):
+        store = ss.SegmentStore(self.directory, segment_size=100)
+        contents = [bytes([i]) * 40 for i in range(5)] + [b"", b"x" * 300]
+        locations = [store.append(content) for content in contents]
+        self.assertEqual("segment-000000.seg@0+40", locations[0])
+        # two records of 48 bytes per segment, the large one in a segment of its own.
+        self.assertEqual([0, 1, 2, 3], ss.list_segments(self.directory))
+        for location, content in zip(locations, contents):
+            self.assertEqual(content, store.read(location))
+        store.close()
+
+        # a store opened again appends to the last segment.
+        store = ss.SegmentStore(self.directory, segment_size=100)
+        location = store.append(b"more")
+        self.assertEqual("segment-000004.seg@0+4", location)
+        self.assertEqual(contents[0], store.read(locations[0]))
+        self.assertEqual(b"more", store.read(location))
+        self.assertIsNone(ss.parse_location("12.html"))
+        store.close()
+
+    def test_truncate_to_and_corruption(self):
+        store = ss.SegmentStore(self.directory, segment_size=100)
+        locations = [store.append(bytes([i]) * 40) for i in range(5)]
+        store.close()
+
+        ss.SegmentStore.truncate_to(self.directory, locations[:3] + ["12.html"])
+        self.assertEqual([0, 1], ss.list_segments(self.directory))
+        self.assertEqual(48, osp.getsize(osp.join(self.directory, "segment-000001.seg")))
+        store = ss.SegmentStore(self.directory, segment_size=100)
+        self.assertEqual("segment-000001.seg@48+40", store.append(b"y" * 40))
+        with self.assertRaises(FileNotFoundError):
+            store.read(locations[4])
+        store.close()
+
+        with open(osp.join(self.directory, "segment-000000.seg"), "r+b") as f:
+            f.seek(ss.RECORD_HEADER.size)
+            f.write(b"z")
+        with self.assertRaises(ValueError):
+            ss.SegmentStore(self.directory).read(locations[0])
+
+    def test_fileset_with_segments(self):
+        directory = osp.join(self.tmp_dir.name, "fileset")
+        fileset = fs.FileSet(directory=directory, storage="segments", segment_size=1024)
+        entries = [fileset.insert(fs.as_insert_entry(f"page {i}" * 50, f"https://a.com/{i}", f"t{i}", "now"),
+                                  sidecar={"i": i})
+                   for i in range(10)]
+        # no file per page, for the contents nor for the sidecars.
+        self.assertEqual(["FileSetEntries.heap", "FileSetEntries.idx", "segments", "snapshots", "url_index"],
+                         sorted(os.listdir(directory)))
+        self.assertEqual(sorted(os.listdir(osp.join(directory, "segments"))),
+                         [ss.segment_filename(i) for i in ss.list_segments(osp.join(directory, "segments"))])
+        self.assertEqual({"i": 4}, fileset.read_sidecar(entries[4]))
+        fileset.make_snapshot("s1")
+        extra = fileset.insert(fs.as_insert_entry("extra", "https://a.com/extra", "t", "now"))
+        fileset.save()
+        fileset.close()
+
+        loaded = fs.FileSet.load_from(directory, mode="append-full-load")
+        self.assertEqual("segments", loaded.storage)
+        self.assertEqual([entry.url for entry in entries + [extra]], [entry.url for entry in loaded])
+        self.assertEqual(b"page 3" * 50, loaded.read_content(loaded.recorded_entries[3]))
+        loaded.close()
+
+        rolled_back = fs.FileSet.load_from_snapshot("s1", directory)
+        self.assertEqual(10, len(rolled_back))
+        self.assertIsNone(rolled_back.read_sidecar(extra))
+        segments_dir = osp.join(directory, "segments")
+        # the last record kept is the sidecar of the last entry.
+        last_record = ss.parse_location(entries[-1].sidecar_location)
+        self.assertEqual(last_record.offset + ss.RECORD_HEADER.size + last_record.length,
+                         osp.getsize(osp.join(segments_dir, last_record.segment_filename)))
+        self.assertEqual({"i": 9}, rolled_back.read_sidecar(entries[-1]))
+        entry = rolled_back.insert(fs.as_insert_entry("again", "https://a.com/again", "t", "now"))
+        self.assertEqual(b"again", rolled_back.read_content(entry))
+        self.assertEqual(sorted(os.listdir(segments_dir)),
+                         [ss.segment_filename(i) for i in ss.list_segments(segments_dir)])
+        rolled_back.close()
@@ -0,0 +1,99 @@
+import os
+import os.path as osp
+import shutil
+import tempfile
+from unittest import TestCase
+
+import FileSet as fs
+import UrlIndex as ui
+
+
+class TestUrlIndex(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.directory = self.tmp_dir.name
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_lookup_merge_truncate(self):
+        index = ui.UrlIndex(osp.join(self.directory, "index"), merge_threshold=4)
+        index.add_many([f"https://a.com/{i}" for i in range(10)], 0)
+        index.add("https://a.com/3", 10)
+        self.assertEqual(10, index.lookup("https://a.com/3"))
+        self.assertEqual(9, index.lookup("https://a.com/9"))
+        self.assertIsNone(index.lookup("https://a.com/10"))
+        index.save()
+
+        index = ui.UrlIndex.load_from(osp.join(self.directory, "index"))
+        self.assertEqual((11, 11), (index.indexed_count, len(index)))
+        self.assertEqual(10, index.lookup("https://a.com/3"))
+        index.add("https://a.com/3", 11)
+        self.assertEqual(11, index.lookup("https://a.com/3"))
+
+        # rolled back, the url is found at its older entry.
+        index.truncate(10)
+        self.assertEqual(3, index.lookup("https://a.com/3"))
+        self.assertEqual(10, index.indexed_count)
+
+    def test_save_below_threshold_keeps_sorted_file(self):
+        directory = osp.join(self.directory, "index")
+        index = ui.UrlIndex(directory, merge_threshold=8)
+        index.add_many([f"https://a.com/{i}" for i in range(8)], 0)
+        index.save()
+        sorted_inode = os.stat(osp.join(directory, "url_index.npy")).st_ino
+
+        # each save only writes the delta run.
+        for i in range(8, 11):
+            index.add(f"https://a.com/{i % 3}", i)
+            index.save()
+        self.assertEqual(sorted_inode, os.stat(osp.join(directory, "url_index.npy")).st_ino)
+        self.assertEqual((8, 3), (len(index.sorted), len(index.delta)))
+
+        index = ui.UrlIndex.load_from(directory)
+        self.assertEqual((11, 11), (index.indexed_count, len(index)))
+        self.assertEqual(10, index.lookup("https://a.com/1"))
+        self.assertEqual(5, index.lookup("https://a.com/5"))
+
+        index.truncate(10)
+        self.assertEqual(1, index.lookup("https://a.com/1"))
+        self.assertEqual(9, index.lookup("https://a.com/0"))
+        index.save()
+        index = ui.UrlIndex.load_from(directory)
+        self.assertEqual((10, 1), (index.indexed_count, index.lookup("https://a.com/1")))
+        self.assertEqual(sorted_inode, os.stat(osp.join(directory, "url_index.npy")).st_ino)
+
+        # once the delta reaches the threshold, it is merged and its run removed.
+        index.add_many([f"https://b.com/{i}" for i in range(6)], 10)
+        index.save()
+        self.assertEqual((16, 0), (len(index.sorted), len(index.delta)))
+        self.assertFalse(osp.exists(osp.join(directory, "url_index_delta.npy")))
+        self.assertEqual(15, ui.UrlIndex.load_from(directory).lookup("https://b.com/5"))
+
+    def test_fileset_get_by_url(self):
+        directory = osp.join(self.directory, "fileset")
+        fileset = fs.FileSet(directory=directory)
+        for i in range(5):
+            fileset.insert(fs.as_insert_entry(f"page {i}", f"https://a.com/{i}", f"t{i}", "now"))
+        fileset.save()
+        fileset.make_snapshot("s1")
+        fileset.insert(fs.as_insert_entry("page 1 again", "https://a.com/1", "t", "now"))
+        fileset.save()
+
+        fileset = fs.FileSet.load_from(directory, mode="append")
+        self.assertEqual(b"page 1 again", fileset.read_content(fileset.get_by_url("https://a.com/1")))
+        self.assertEqual("2.html", fileset.get_by_url("https://a.com/2").content_filename)
+        self.assertFalse(fileset.contains_url("https://a.com/5"))
+        fileset.insert(fs.as_insert_entry("page 5", "https://a.com/5", "t", "now"))
+        self.assertTrue(fileset.contains_url("https://a.com/5"))
+
+        rolled_back = fs.FileSet.load_from_snapshot("s1", directory)
+        self.assertEqual("1.html", rolled_back.get_by_url("https://a.com/1").content_filename)
+        self.assertFalse(rolled_back.contains_url("https://a.com/5"))
+
+        # a FileSet saved before it had a url index gets one when loaded.
+        shutil.rmtree(osp.join(directory, "url_index"))
+        loaded = fs.FileSet.load_from(directory, mode="append")
+        self.assertEqual("4.html", loaded.get_by_url("https://a.com/4").content_filename)
+        self.assertEqual(5, loaded.url_index.indexed_count)
@@ -0,0 +1,75 @@
+import os.path as osp
+import tempfile
+from unittest import TestCase
+
+import FileSet as fs
+import Frontier
+import WriteAheadLog as wal
+
+
+class TestWriteAheadLog(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.directory = self.tmp_dir.name
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_records_round_trip(self):
+        log = wal.WriteAheadLog(self.directory)
+        items = [Frontier.FrontierItem("https://a.com/中超", 2, 1), Frontier.FrontierItem("https://a.com/b", 1, 3)]
+        entry = fs.FileSetRecordedEntry("0.html", "https://a.com/中超", "Untitled", "240111_10_00_00_000000")
+        log.log_enqueue(items)
+        log.log_fetched("https://a.com/中超")
+        log.log_saved(entry)
+        log.close()
+
+        records = list(wal.read_records(self.directory))
+        self.assertEqual([wal.ENQUEUE, wal.ENQUEUE, wal.FETCHED, wal.SAVED], [record.type for record in records])
+        self.assertEqual(items, [record.value for record in records[:2]])
+        self.assertEqual("https://a.com/中超", records[2].value)
+        self.assertEqual(entry, records[3].value)
+
+    def test_torn_tail_is_dropped_and_truncated(self):
+        log = wal.WriteAheadLog(self.directory)
+        log.log_fetched("https://a.com/0")
+        log.log_fetched("https://a.com/1")
+        log.close()
+        filepath = osp.join(self.directory, wal.wal_filename(0))
+        with open(filepath, "rb") as f:
+            data = f.read()
+        # a crash in the middle of the second record.
+        with open(filepath, "wb") as f:
+            f.write(data[:-3])
+
+        self.assertEqual(["https://a.com/0"], [record.value for record in wal.read_records(self.directory)])
+        log = wal.WriteAheadLog(self.directory)
+        log.log_fetched("https://a.com/2")
+        log.close()
+        self.assertEqual(["https://a.com/0", "https://a.com/2"],
+                         [record.value for record in wal.read_records(self.directory)])
+
+    def test_corrupted_record_stops_reading(self):
+        log = wal.WriteAheadLog(self.directory)
+        log.log_fetched("https://a.com/0")
+        log.log_fetched("https://a.com/1")
+        log.close()
+        filepath = osp.join(self.directory, wal.wal_filename(0))
+        with open(filepath, "r+b") as f:
+            f.seek(-1, 2)
+            f.write(b"X")
+        self.assertEqual(["https://a.com/0"], [record.value for record in wal.read_records(self.directory)])
+
+    def test_rotate_and_remove(self):
+        log = wal.WriteAheadLog(self.directory)
+        log.log_fetched("https://a.com/0")
+        self.assertEqual(1, log.rotate())
+        log.log_fetched("https://a.com/1")
+        self.assertEqual(["https://a.com/1"], [record.value for record in wal.read_records(self.directory, 1)])
+        log.remove_before(1)
+        self.assertEqual([1], wal.list_generations(self.directory))
+        log.close()
+
+        # reopening continues the latest generation.
+        self.assertEqual(1, wal.WriteAheadLog(self.directory, generation=0).generation)
@@ -0,0 +1,101 @@
+import gzip
+import http.server
+import threading
+import zlib
+from unittest import TestCase
+
+import request_utils
+
+BODY = b"<html><body>" + b"<p>the same paragraph again</p>" * 2000 + b"</body></html>"
+
+
+class EncodingHandler(http.server.BaseHTTPRequestHandler):
+    """
+    /{encoding}: BODY in that Content-Encoding. "deflate" is zlib-wrapped, "raw-deflate" is sent as deflate too.
+    """
+    accept_encodings = []
+
+    def do_GET(self):
+        EncodingHandler.accept_encodings.append(self.headers.get("Accept-Encoding"))
+        encoding = self.path.strip("/")
+        if encoding == "gzip":
+            body = gzip.compress(BODY)
+        elif encoding == "deflate":
+            body = zlib.compress(BODY)
+        elif encoding == "raw-deflate":
+            compressor = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+            body = compressor.compress(BODY) + compressor.flush()
+            encoding = "deflate"
+        else:
+            body = BODY
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        if encoding != "identity":
+            self.send_header("Content-Encoding", encoding)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestPageExtractor(TestCase):
+
+    def test_links_come_out_while_feeding(self):
+        extractor = request_utils.PageExtractor("https://a.com/list/")
+        self.assertEqual(["https://a.com/list/1"], extractor.feed(b'<html><body><a href="1">one</a><a hr'))
+        self.assertEqual(["https://a.com/2"], extractor.feed(b'ef="/2">two</a><a href="javascript:;">x</a>'))
+        page = extractor.close()
+        self.assertEqual(["https://a.com/list/1", "https://a.com/2"], page.links)
+
+    def test_chunking_does_not_matter(self):
+        content = ('<html><head><title>site</title></head><body>'
+                   '<div class="news-left"><h1 class="news-title">dongqiudi <b>title</b></h1>'
+                   '<div class="con"><p>first   paragraph</p><div><p>second <a href="/x">link</a></p></div></div>'
+                   '</div><img src="//img.com/a.jpg"><p>outside</p></body></html>').encode()
+        expected = request_utils.PageExtract(["https://a.com/x"], ["https://img.com/a.jpg"], "dongqiudi title",
+                                             "first paragraph\nsecond link")
+        self.assertEqual(expected, request_utils.extract_page(content, "https://a.com/"))
+        for chunk_size in (1, 7, 64):
+            extractor = request_utils.PageExtractor("https://a.com/")
+            for chunk in request_utils.iter_chunks(content, chunk_size):
+                extractor.feed(chunk)
+            self.assertEqual(expected, extractor.close())
+
+    def test_fallbacks(self):
+        content = b'<html><head><title> the  site </title></head><body><p>a</p><div><p>b</p></div></body></html>'
+        self.assertEqual(("the site", "a\nb"), request_utils.extract_page(content, "https://a.com/")[2:])
+
+
+class TestFetch(TestCase):
+
+    def setUp(self):
+        EncodingHandler.accept_encodings = []
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), EncodingHandler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.base_url = f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_compressed_bodies_are_decoded(self):
+        result = request_utils.fetch(f"{self.base_url}/identity", "test")
+        self.assertEqual((BODY, len(BODY), len(BODY)), (result.content, result.wire_bytes, result.decoded_bytes))
+        for encoding in ("gzip", "deflate", "raw-deflate"):
+            result = request_utils.fetch(f"{self.base_url}/{encoding}", "test")
+            self.assertEqual(BODY, result.content)
+            self.assertEqual(len(BODY), result.decoded_bytes)
+            self.assertLess(result.wire_bytes, len(BODY) // 10)
+        self.assertEqual(request_utils.ACCEPT_ENCODING, EncodingHandler.accept_encodings[0])
+
+        result, reader = request_utils.open_content(f"{self.base_url}/gzip", "test")
+        self.assertEqual(BODY, b"".join(reader))
+        self.assertEqual(len(BODY), reader.decoded_bytes)
+
+    def test_body_size_is_bounded(self):
+        max_bytes = len(BODY) - 1
+        for encoding in ("identity", "gzip", "deflate"):
+            self.assertIsNone(request_utils.fetch(f"{self.base_url}/{encoding}", "test", max_bytes=max_bytes))
+        self.assertEqual(BODY, request_utils.fetch(f"{self.base_url}/gzip", "test", max_bytes=len(BODY)).content)
@@ -86,3 +86,63 @@ class Test1(TestCase):
 
         for url in true_urls:
             self.assertTrue(utils.is_zhibo8_news_football_article(url))
+
+    def test_classify_urls_matches_the_filters(self):
+        urls = [
+            'https://sports.sina.com.cn/g/pl/2024-01-09/doc-inaaxhfz7551761.shtml?from=list#top',
+            'https://SPORTS.sina.com.cn/china/2024-01-10/doc-inaazexe4395870.shtml',
+            'https://sports.sina.com.cn/china/2024-01-10/x/doc-inaazexe4395870.shtml',
+            'https://sports.sina.com.cn/g/2024-01-09/doc-inaaxhfz7551761.shtml',
+            'https://sports.sina.com.cn/g/pl/2024-01-09/inaaxhfz7551761.shtml',
+            'https://sports.sina.com.cn/g/pl/',
+            'https://sports.sina.com.cn/',
+            'https://k.sina.com.cn/article_123.html',
+            'https://news.zhibo8.com/zuqiu/2024-01-11/659ff140399f2native.htm',
+            'https://news.zhibo8.com/zuqiu/2024-01-11/659ff140399f2.htm',
+            'https://news.zhibo8.com/zuqiu/more.htm?label=1',
+            'https://news.zhibo8.com/zuqiubao/',
+            'https://news.zhibo8.com/nba/2024-01-11/659ff140399f2native.htm',
+            'https://www.dongqiudi.com/articles/3881745',
+            'mailto:someone@example.com',
+        ]
+        for filter_config in ("sina", "zhibo8"):
+            normalized, is_article, is_in_domain = utils.classify_urls(urls, filter_config)
+            expected = [as_unique_url(url) for url in urls]
+            self.assertEqual(expected, normalized)
+            self.assertEqual([utils.strict_filter_recipe[filter_config](url) for url in expected],
+                             is_article.tolist())
+            self.assertEqual([utils.loose_filter_recipe[filter_config](url) for url in expected],
+                             is_in_domain.tolist())
+        self.assertEqual("https://www.dongqiudi.com/articles/3881745.html", normalized[-2])
+        self.assertEqual(0, len(utils.classify_urls([], "sina")[1]))
+
+
+class TestSharedExclusiveLock(TestCase):
+
+    def test_exclusive_waits_for_shared(self):
+        import threading
+        import time
+        lock = utils.SharedExclusiveLock()
+        events = []
+        acquired = threading.Event()
+        release = threading.Event()
+
+        def exclusive():
+            with lock.exclusive():
+                events.append("exclusive")
+                acquired.set()
+                release.wait()
+
+        with lock.shared():
+            with lock.shared():
+                t = threading.Thread(target=exclusive)
+                t.start()
+                time.sleep(0.05)
+                self.assertEqual([], events)
+                events.append("shared done")
+        self.assertTrue(acquired.wait(1))
+        self.assertEqual(["shared done", "exclusive"], events)
+        release.set()
+        t.join()
+        with lock.shared():
+            pass
@@ -1,6 +1,19 @@
+import contextlib
+import functools
+import re
+import shutil
+import threading
 import urllib.parse
+from typing import List, Tuple
+
 import numpy as np
 
+try:
+    import fcntl
+except ImportError:
+    # not available on Windows
+    fcntl = None
+
 dqd_domain = 'www.dongqiudi.com'
 
 
@@ -89,6 +102,32 @@ def is_zhibo8_news_football_article(url) -> bool:
     return True
 
 
+# the number of urls whose normalization and classification are cached.
+# a page links to hundreds of urls, most of them on every page of the site (navigation, hubs).
+URL_CACHE_SIZE = 1 << 16
+
+_dqd_article_path = re.compile(r"/articles/[^/]*")
+
+
+@functools.lru_cache(maxsize=URL_CACHE_SIZE)
+def _unique_url_parts(_url: str, keep_query: bool) -> Tuple[str, str, str]:
+    """
+    as_unique_url, with a single parse of the url.
+    :return: the unique url, its netloc and its path.
+    """
+    scheme, netloc, path, params, query, _ = urllib.parse.urlparse(_url)
+    netloc = netloc.lower()
+    if path.endswith("/"):
+        path = path[:-1]
+
+    # 如果是懂球帝文章，且没有.html后缀，则加上.html后缀
+    if netloc == dqd_domain and _dqd_article_path.fullmatch(path) and not path.endswith(".html"):
+        path = path + ".html"
+
+    url = urllib.parse.urlunparse((scheme.lower(), netloc, path, params, query if keep_query else "", ""))
+    return url, netloc, path
+
+
 def as_unique_url(_url: str, keep_query=False) -> str:
     """
     将url转换为唯一的url。
@@ -96,23 +135,12 @@ def as_unique_url(_url: str, keep_query=False) -> str:
     - 去除url中的query(参数)
     - 将url中的scheme和netloc转换为小写
     - 若url以/结尾，则去除(因为https://www.example.com/和https://www.example.com是同一个网址)
+    结果有缓存(URL_CACHE_SIZE)。
     :param _url
     :param keep_query: 是否保留query(参数)
     :return:
     """
-    url = urllib.parse.urlparse(_url)
-    url = url._replace(fragment="")
-    if not keep_query:
-        url = url._replace(query="")
-    url = url._replace(scheme=url.scheme.lower(), netloc=url.netloc.lower())
-    if url.path.endswith("/"):
-        url = url._replace(path=url.path[:-1])
-
-    # 如果是懂球帝文章，且没有.html后缀，则加上.html后缀
-    if is_dqd_football_article(url.geturl()) and not url.path.endswith(".html"):
-        url = url._replace(path=url.path + ".html")
-
-    return url.geturl()
+    return _unique_url_parts(_url, keep_query)[0]
 
 
 sina_sports_domain = 'sports.sina.com.cn'
@@ -183,6 +211,121 @@ def count_ones_in_bloomfilter_npy(npy_path):
     return np.count_nonzero(arr)
 
 
+# ioctl request number of FICLONE on Linux.
+_FICLONE = 0x40049409
+
+
+def clone_file(src, dst):
+    """
+    Copy src to dst, as a copy-on-write reflink when the file system supports it (btrfs, xfs, ...).
+    Falls back to shutil.copyfile, which copies in the kernel where it can.
+    :param src:
+    :param dst:
+    :return:
+    """
+    if fcntl is not None:
+        try:
+            with open(src, 'rb') as f_src, open(dst, 'wb') as f_dst:
+                fcntl.ioctl(f_dst.fileno(), _FICLONE, f_src.fileno())
+            return
+        except OSError:
+            pass
+    shutil.copyfile(src, dst)
+
+
+class SharedExclusiveLock:
+    """
+    A lock held either by any number of threads in shared mode, or by a single thread in exclusive mode.
+    A thread waiting for exclusive mode keeps new threads from entering shared mode, so it is not starved.
+    Not reentrant.
+    """
+
+    def __init__(self):
+        self.cond = threading.Condition()
+        self._shared_count = 0
+        self._exclusive = False
+        self._exclusive_waiting = 0
+
+    @contextlib.contextmanager
+    def shared(self):
+        with self.cond:
+            self.cond.wait_for(lambda: not self._exclusive and self._exclusive_waiting == 0)
+            self._shared_count += 1
+        try:
+            yield
+        finally:
+            with self.cond:
+                self._shared_count -= 1
+                if self._shared_count == 0:
+                    self.cond.notify_all()
+
+    @contextlib.contextmanager
+    def exclusive(self):
+        with self.cond:
+            self._exclusive_waiting += 1
+            self.cond.wait_for(lambda: not self._exclusive and self._shared_count == 0)
+            self._exclusive_waiting -= 1
+            self._exclusive = True
+        try:
+            yield
+        finally:
+            with self.cond:
+                self._exclusive = False
+                self.cond.notify_all()
+
+
+# the strict and loose filters as patterns of the urls normalized by as_unique_url, for classify_urls:
+# (netloc, article path regex, in-domain path regex), the regexes matching the whole path.
+url_patterns_recipe = {
+    "sina": (sina_sports_domain,
+             re.compile(r"/(?:china/[^/]*|(?:global|g)/[^/]*/[^/]*)/doc-[^/]*\.shtml"),
+             re.compile(r".*", re.DOTALL)),
+    "zhibo8": (zhibo8_news_domain,
+               re.compile(r"/zuqiu/[^/]*/[^/]*native\.htm"),
+               re.compile(r"/zuqiu.*", re.DOTALL)),
+}
+
+
+def classify_url(_url: str, filter_config: str) -> Tuple[str, bool, bool]:
+    """
+    Normalize a url and classify it with a single parse, cached with as_unique_url.
+    :param _url: a raw url, e.g. an absolute href.
+    :param filter_config: see url_patterns_recipe.
+    :return: as_unique_url(_url), whether it passes the strict filter (an article),
+             whether it passes the loose filter (in the domain).
+    """
+    url, url_netloc, path = _unique_url_parts(_url, False)
+    netloc, article_path, domain_path = url_patterns_recipe[filter_config]
+    if url_netloc != netloc:
+        return url, False, False
+    return url, article_path.fullmatch(path) is not None, domain_path.fullmatch(path) is not None
+
+
+def classify_urls(urls, filter_config: str) -> Tuple[List[str], np.ndarray, np.ndarray]:
+    """
+    classify_url for a batch of urls, e.g. the links of a page.
+    :return: the normalized urls, and bool arrays: is_article, is_in_domain.
+    """
+    results = [classify_url(url, filter_config) for url in urls]
+    if not results:
+        return [], np.zeros(0, dtype=bool), np.zeros(0, dtype=bool)
+    normalized, is_article, is_in_domain = zip(*results)
+    return list(normalized), np.array(is_article, dtype=bool), np.array(is_in_domain, dtype=bool)
+
+
+# the filters of the crawler, by filter_config. They live here rather than in Crawler,
+# so that parsing processes can pick them by name without importing the crawler.
+strict_filter_recipe = {
+    "sina": is_sina_sports_football_article,
+    "zhibo8": is_zhibo8_news_football_article
+}
+
+loose_filter_recipe = {
+    "sina": is_sina_sports_domain,
+    "zhibo8": is_zhibo8_football_domain
+}
+
+
 is_sina_sports_football_article('https://sports.sina.com.cn/global/france/2024-01-10/doc-inaayyri7443394.shtml'
                                 )
 